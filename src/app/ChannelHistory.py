@@ -0,0 +1,62 @@
+from typing import Iterable, Iterator
+
+from IHistoryManager import HistoryItem, HistoryView
+
+
+class ChannelHistory:
+    """A channel's in-memory history, which hands out cheap immutable views of itself.
+
+    Items are kept in an append-only list with a moving start offset: appends add to the end of the list
+    and trims advance the start, so neither changes the items a view covers, and views take O(1) to create.
+    Once most of the list is trimmed items, the live items are copied to a new list, leaving the old list
+    untouched for any views still reading it. Copies happen at most once per trimmed half, so trims stay O(1) amortized.
+    """
+    __slots__ = ("_items", "_start")
+    COMPACT_MIN_TRIMMED = 32 #don't bother copying tiny histories
+
+
+    def __init__(self, items: Iterable[HistoryItem] = ()) -> None:
+        self._items: list[HistoryItem] = list(items)
+        self._start = 0
+
+
+    def view(self) -> HistoryView:
+        """Get an immutable view of the history as it is now"""
+        return HistoryView(self._items, self._start, len(self._items))
+
+
+    def append(self, item: HistoryItem) -> None:
+        self._items.append(item)
+
+
+    def popleft(self) -> HistoryItem:
+        """Remove and return the oldest item"""
+        if self._start >= len(self._items):
+            raise IndexError("popleft from an empty ChannelHistory")
+        item = self._items[self._start]
+        self._start += 1
+        if self._start >= self.COMPACT_MIN_TRIMMED and self._start * 2 >= len(self._items):
+            #a new list rather than deleting in place, as views may still be reading the old one
+            self._items = self._items[self._start:]
+            self._start = 0
+        return item
+
+
+    def __len__(self) -> int:
+        return len(self._items) - self._start
+
+
+    def __getitem__(self, index: int) -> HistoryItem:
+        return self._items[range(self._start, len(self._items))[index]]
+
+
+    def __iter__(self) -> Iterator[HistoryItem]:
+        return iter(self.view())
+
+
+    def __reversed__(self) -> Iterator[HistoryItem]:
+        return reversed(self.view())
+
+
+    def __repr__(self) -> str:
+        return f"ChannelHistory({list(self)!r})"
@@ -0,0 +1,154 @@
+import re
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+from IHistoryManager import HistoryItem
+
+
+class ReplyLink(NamedTuple):
+    """How one history item relates to the messages before it"""
+    item: HistoryItem
+    parent_id: Optional[int]            #the message it explicitly replies to, if any
+    previous_in_turn: Optional[int]     #the same author's message right before it, if it continues their turn
+    previous_turn: Optional[int]        #the last message of the turn before its own, by another author
+
+
+class ContextSelector:
+    """Chooses which of a channel's history items go into a prompt, when they don't all fit its history budget.
+
+    Keeps a per-channel index of reply links, from the "[reply to: id]" prefix EventHandler adds to replies,
+    and of author adjacency, i.e. runs of consecutive messages by one author, or turns.
+    The chain being answered is ranked first: the message replied to and the rest of its turn, then the message
+    that replies to, and so on. A turn without an explicit reply, like the bot's own replies, is taken to answer
+    the turn just before it, for one step at a time. The rest of the budget is filled with the newest messages,
+    and the selection is returned in chronological order.
+
+    The index follows the channel's history: items are indexed as they're appended, forgotten as they're trimmed,
+    and a channel is reindexed whenever its history is replaced, e.g. when loaded or merged out of order.
+    """
+    REPLY_PATTERN = re.compile(r"^\[reply to: (\d+)\] ")
+    MAX_CHAIN_ITEMS = 100
+
+
+    def __init__(self, budget: int) -> None:
+        """Args:
+            budget: the most tokens of history to select for a prompt
+        """
+        self.budget = budget
+        self._links: dict[int, dict[int, ReplyLink]] = {}
+        self._last: dict[int, ReplyLink] = {}
+
+        self._selections = 0
+        self._chain_items_selected = 0
+        self._items_selected = 0
+        self._items_skipped = 0
+
+
+    def index(self, channel_id: int, items: Iterable[HistoryItem]) -> None:
+        """Index items appended to the end of a channel's history, in order"""
+        links = self._links.setdefault(channel_id, {})
+        last = self._last.get(channel_id)
+        for item in items:
+            match = self.REPLY_PATTERN.match(item.content)
+            parent_id = int(match.group(1)) if match else None
+            if last is None:
+                link = ReplyLink(item, parent_id, None, None)
+            elif last.item.name == item.name:
+                link = ReplyLink(item, parent_id, last.item.id, last.previous_turn)
+            else:
+                link = ReplyLink(item, parent_id, None, last.item.id)
+            links[item.id] = link
+            last = link
+        if last is not None:
+            self._last[channel_id] = last
+
+
+    def forget(self, channel_id: int, items: Iterable[HistoryItem]) -> None:
+        """Drop items trimmed from a channel's history from its index"""
+        links = self._links.get(channel_id, {})
+        for item in items:
+            links.pop(item.id, None)
+
+
+    def reset(self, channel_id: int, items: Iterable[HistoryItem] = ()) -> None:
+        """Reindex a channel whose history has been replaced, or drop it if no items are given"""
+        self._links.pop(channel_id, None)
+        self._last.pop(channel_id, None)
+        self.index(channel_id, items)
+
+
+    def select(self, channel_id: int, history: Sequence[HistoryItem], reply_id: Optional[int] = None
+               ) -> list[HistoryItem]:
+        """Select the items from a channel's history to put in a prompt, within the token budget.
+
+        Args:
+            channel_id: the channel the history belongs to
+            history: the channel's history, in chronological order
+            reply_id: the id of the message the prompt replies to, if any, whose reply chain is ranked first
+
+        Returns:
+            list[HistoryItem]: the selected items, in chronological order
+        """
+        present = {item.id for item in history}
+        selected: set[int] = set()
+        used = 0
+        for item in self._chain(channel_id, reply_id):
+            tokens = item.token_count or 0
+            if item.id in present and used + tokens <= self.budget:
+                selected.add(item.id)
+                used += tokens
+        chain_selected = len(selected)
+
+        for item in reversed(history):
+            if item.id in selected:
+                continue
+            tokens = item.token_count or 0
+            if used + tokens > self.budget:
+                break
+            selected.add(item.id)
+            used += tokens
+
+        self._selections += 1
+        self._chain_items_selected += chain_selected
+        self._items_selected += len(selected)
+        self._items_skipped += len(present) - len(selected)
+        return [item for item in history if item.id in selected]
+
+
+    def _chain(self, channel_id: int, reply_id: Optional[int]) -> list[HistoryItem]:
+        """Get the reply chain ending at a given message, most relevant first"""
+        links = self._links.get(channel_id, {})
+        chain: list[HistoryItem] = []
+        seen: set[int] = set()
+        current = reply_id
+        implicit = False
+        while current in links and current not in seen and len(chain) < self.MAX_CHAIN_ITEMS:
+            #the message and the rest of its turn, newest first, taking the newest explicit reply within the turn
+            parent_id = None
+            turn_start = current
+            member: Optional[int] = current
+            while member in links and member not in seen:
+                link = links[member]
+                seen.add(member)
+                chain.append(link.item)
+                if parent_id is None:
+                    parent_id = link.parent_id
+                turn_start = member
+                member = link.previous_in_turn
+
+            if parent_id is not None:
+                current, implicit = parent_id, False
+            elif not implicit:
+                current, implicit = links[turn_start].previous_turn, True
+            else:
+                break
+        return chain
+
+
+    def stats(self) -> dict[str, float]:
+        """Get counters describing the selections made"""
+        return {
+            "selections": self._selections,
+            "chain_items_selected": self._chain_items_selected,
+            "items_selected": self._items_selected,
+            "items_skipped": self._items_skipped
+        }
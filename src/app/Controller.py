@@ -3,7 +3,6 @@ import json
 import sys
 import asyncio
 from typing import Dict, Tuple
-from types import FrameType
 from datetime import datetime
 import time
 
@@ -12,6 +11,7 @@ from discord import Message, TextChannel, Thread
 from discord.ext import commands
 
 from EventHandler import EventHandler
+from HistoryBackfill import HistoryBackfill
 from ConfigManager import ConfigManager
 from Logger import Logger
 from ai.BaseAIModelProviderFactory import BaseAIModelProviderFactory
@@ -71,8 +71,14 @@ class Controller:
     
 
     async def on_ready(self) -> None:
-        """Runs once the websocket is connected to Discord
+        """Runs once the websocket is connected to Discord, and again after every reconnect.
+        Setup only happens on the first connect: the provider and its history are kept across reconnects,
+        as replacing them would orphan anything not yet persisted.
         """
+        if hasattr(self, "ai_model_provider"):
+            self.logger.info("Reconnected to Discord API, keeping the running AIModelProvider")
+            return
+
         if platform.system() != 'Windows':
             self.bot.loop.add_signal_handler(signal.SIGINT, self.handle_shutdown)
             self.bot.loop.add_signal_handler(signal.SIGTERM, self.handle_shutdown)
@@ -98,8 +104,17 @@ class Controller:
             self.ai_model_provider,
             self.config_manager, 
             self.logger)
+        self.history_backfill = HistoryBackfill(
+            self.bot,
+            self.event_handler.normalize_message,
+            self.ai_model_provider,
+            self.config_manager,
+            self.logger)
 
+        #messages from here on are handled live, so backfill only needs what was sent before now
+        listening_since_id = discord.utils.time_snowflake(discord.utils.utcnow())
         self.bot.add_listener(self.event_handler.on_message, 'on_message')
+        self.bot.loop.create_task(self._warm_up_channels(listening_since_id))
 
         await self.bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, 
                                        name=f"{await self.ai_model_provider.get_model_name()}"))        
@@ -107,28 +122,50 @@ class Controller:
         for channel_id in self.ANNOUNCE_CHANNELS:
             channel = self.bot.get_channel(channel_id)
             if isinstance(channel, (TextChannel, Thread)):
+                offline_note = ("including what was said while I was offline. "
+                                if self.history_backfill.enabled
+                                else "but I can't see anything that happened while I was offline. ")
                 await channel.send("`pepeleli is online and listening to everything " 
                     "in this channel, but I will only reply when tagged. "
-                    "I will try to remember what happened before this, but I can't see anything that happened while I was offline. "
+                    f"I will try to remember what happened before this, {offline_note}"
                     f"[Provider type: {self.AI_PROVIDER_TYPE}]"
                     f"[Model: {await self.ai_model_provider.get_model_name()}]`")
             else:
                 self.logger.error(f"Channel id {channel_id} in MONITOR_CHANNELS is invalid channel type")
                 
 
+    async def _warm_up_channels(self, listening_since_id: int) -> None:
+        """Load the monitored channels' histories ahead of their first message after a restart,
+        most recently active channels first, then backfill the messages sent while the bot was offline.
+        Runs in the background, a message arriving for a channel still warming up shares its load
+        rather than starting another."""
+        #discord ids are snowflakes, which sort by creation time, so the newest last message has the largest id
+        by_activity = sorted(
+            self.MONITOR_CHANNELS,
+            key=lambda channel_id: getattr(self.bot.get_channel(channel_id), "last_message_id", None) or 0,
+            reverse=True)
+        start = time.perf_counter()
+        try:
+            await self.ai_model_provider.warm_up(by_activity)
+        except Exception as e:
+            self.logger.exception("an exception was raised trying to warm up channel histories", e)
+            return
+        self.logger.info(
+            f"warmed up {len(by_activity)} monitored channels in {int((time.perf_counter() - start) * 1000)} ms")
+        await self.history_backfill.run(by_activity, listening_since_id)
+
+
     async def on_close(self) -> None:
         """Runs when disconnecting from Discord
         """
         self.logger.error(f"Disconnected from Discord API")
         
 
-    def handle_shutdown(self, signal: int, frame: FrameType) -> None:
-        """This is run when we get SIGINT or SIGTERM, to shut down the bot
+    def handle_shutdown(self) -> None:
+        """This is run when we get SIGINT or SIGTERM, to shut down the bot.
+        Signal handlers run inside the already running event loop, so schedule the shutdown on it.
         """
-        try:
-            self.bot.loop.run_until_complete(self.shutdown())
-        finally:
-            self.bot.loop.close()
+        self.bot.loop.create_task(self.shutdown())
 
 
     def win_handle_shutdown(self) -> None:
@@ -144,6 +181,11 @@ class Controller:
     async def shutdown(self) -> None:
         """clean up and shut down the bot
         """
+        if hasattr(self, "ai_model_provider"):
+            try:
+                await self.ai_model_provider.close()
+            except Exception as e:
+                self.logger.exception("an exception was raised trying to close the AIModelProvider", e)
         await self.bot.close()
         
 
@@ -64,14 +64,7 @@ class EventHandler(IEventHandler):
         if message.author.bot: #don't need to handle a message the bot itself sent
             return
 
-        if message.reference:
-            message.content = f"[reply to: {message.reference.message_id}] " + message.content
-
-        try:
-            message.content = await self._replace_mentions(message)
-        except Exception as e:
-            self.logger.exception("replace_mentions threw an exception", e)
-            pass
+        await self.normalize_message(message)
         
         if ((message.guild is not None and message.guild.me in message.mentions)
             or(self.BOT_USERNAME.lower() in message.content.lower())):
@@ -102,6 +95,21 @@ class EventHandler(IEventHandler):
                 
 
 
+    async def normalize_message(self, message: Message) -> None:
+        """Rewrite a user message's content the way it is kept in conversation history:
+        prefixed with the id of the message it replies to, if any, and with user mentions replaced by names.
+        Used for live messages, and for messages backfilled after a restart.
+        """
+        if message.reference:
+            message.content = f"[reply to: {message.reference.message_id}] " + message.content
+
+        try:
+            message.content = await self._replace_mentions(message)
+        except Exception as e:
+            self.logger.exception("replace_mentions threw an exception", e)
+            pass
+
+
     async def _replace_mentions(self, message: Message) -> str:
         """
         Replace user id mentions/tags in message content with usernames
@@ -0,0 +1,276 @@
+import os
+import mmap
+import struct
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+
+from attr import dataclass
+
+from IHistoryManager import HistoryItem
+from HistoryRecordCodec import HistoryRecordCodec
+
+ArchiveRef = tuple[int, int] #(segment, byte offset) locating a record within one channel's archive
+
+
+@dataclass(slots=True)
+class ActiveSegment:
+    """The segment a channel is appending to, with its files held open"""
+    segment: int
+    segment_file: BinaryIO
+    index_file: BinaryIO
+    size: int
+
+
+class HistoryArchive:
+    """Local, append-only archive of history items trimmed from context.
+
+    Each channel has its own directory of segment files, named after the timestamp of their first record.
+    Records are appended in the order they are evicted from history, which is chronological per channel.
+    Alongside each segment, a sparse index file holds a (timestamp, offset) entry every INDEX_INTERVAL records,
+    so range reads can jump close to the first wanted record in a memory-mapped segment.
+
+    Appends return a reference to each record, so other stores of trimmed history, e.g. retrieval indexes,
+    can point at the archived copy rather than keeping one of their own.
+    The segment each channel appends to is kept open, with its size tracked in memory, for up to
+    MAX_OPEN_SEGMENTS channels. When a segment is opened for appending, a record left partly written
+    by a crash is cut off its end first, so the next append doesn't land after it and break reads.
+
+    Methods do blocking file I/O, callers on the event loop should run them in a thread.
+    """
+    SEGMENT_SUFFIX = ".seg"
+    INDEX_SUFFIX = ".idx"
+    INDEX_ENTRY = struct.Struct("<qQ") #timestamp in milliseconds, byte offset into the segment
+    INDEX_INTERVAL = 64
+    MAX_OPEN_SEGMENTS = 64
+
+
+    def __init__(self, archive_dir: str, max_segment_bytes: int) -> None:
+        """
+        Args:
+            archive_dir: directory to keep the archive in, one subdirectory per channel
+
+            max_segment_bytes: start a new segment once the current one reaches this size
+        """
+        self.archive_dir = archive_dir
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        self._segments: dict[int, list[int]] = {} #first timestamp of each segment, per channel
+        self._indexes: dict[tuple[int, int], list[tuple[int, int]]] = {} #sparse index per (channel, segment)
+        self._unindexed: dict[tuple[int, int], int] = {} #records appended since the last index entry
+        self._active: OrderedDict[int, ActiveSegment] = OrderedDict() #open segment per channel, least recent first
+        self.items_archived = 0
+        self.torn_records_truncated = 0
+
+
+    def append(self, items: list[HistoryItem]) -> list[ArchiveRef]:
+        """Append history items to the archive, returning where each one was written"""
+        with self._lock:
+            refs = [self._append_item(item) for item in items]
+            self.items_archived += len(items)
+            return refs
+
+
+    def read(self, channel_id: int, start_ms: int, end_ms: int) -> list[HistoryItem]:
+        """Read archived history items for a channel with timestamps in [start_ms, end_ms]"""
+        with self._lock:
+            segments = self._get_segments(channel_id)
+            first = max(bisect_right(segments, start_ms) - 1, 0)
+            results: list[HistoryItem] = []
+            for segment in segments[first:]:
+                if segment > end_ms:
+                    break
+                results.extend(self._read_segment(channel_id, segment, start_ms, end_ms))
+            return results
+
+
+    def read_refs(self, channel_id: int, refs: list[ArchiveRef]) -> list[HistoryItem]:
+        """Read the archived history items at the given references for a channel, in the order given"""
+        items: list[Optional[HistoryItem]] = [None] * len(refs)
+        by_segment: dict[int, list[int]] = {}
+        for position, (segment, _) in enumerate(refs):
+            by_segment.setdefault(segment, []).append(position)
+        with self._lock:
+            for segment, positions in by_segment.items():
+                with open(self._segment_path(channel_id, segment), "rb") as segment_file:
+                    with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                        for position in positions:
+                            items[position], _ = HistoryRecordCodec.decode(buffer, refs[position][1])
+        return [item for item in items if item is not None]
+
+
+    def close(self) -> None:
+        """Close the segments held open for appending"""
+        with self._lock:
+            while self._active:
+                _, active = self._active.popitem()
+                self._close_segment(active)
+
+
+    def stats(self) -> dict[str, float]:
+        """Get counters describing the archive's activity"""
+        return {
+            "items_archived": self.items_archived,
+            "channels": len(self._segments),
+            "torn_records_truncated": self.torn_records_truncated
+        }
+
+
+    def _append_item(self, item: HistoryItem) -> ArchiveRef:
+        """Append a single item to the current segment of its channel, rolling to a new segment if needed"""
+        channel_id = item.channel_id
+        timestamp_ms = item.timestamp_ms
+        active = self._active_segment(channel_id, timestamp_ms)
+
+        record = HistoryRecordCodec.encode(item)
+        offset = active.size
+        active.segment_file.write(record)
+        active.size += len(record)
+
+        key = (channel_id, active.segment)
+        unindexed = self._unindexed.get(key, self.INDEX_INTERVAL)
+        if unindexed >= self.INDEX_INTERVAL:
+            active.index_file.write(self.INDEX_ENTRY.pack(timestamp_ms, offset))
+            self._indexes[key].append((timestamp_ms, offset))
+            unindexed = 0
+        self._unindexed[key] = unindexed + 1
+        return active.segment, offset
+
+
+    def _active_segment(self, channel_id: int, timestamp_ms: int) -> ActiveSegment:
+        """Get the open segment a channel appends to, opening its last segment or rolling to a new one as needed"""
+        active = self._active.pop(channel_id, None)
+        segments = self._get_segments(channel_id)
+        if active is None and segments:
+            active = self._open_segment(channel_id, segments[-1])
+        if active is not None and active.size >= self.max_segment_bytes:
+            self._close_segment(active)
+            active = None
+        if active is None:
+            segments.append(max(timestamp_ms, segments[-1] + 1) if segments else timestamp_ms)
+            active = self._open_segment(channel_id, segments[-1])
+
+        self._active[channel_id] = active
+        while len(self._active) > self.MAX_OPEN_SEGMENTS:
+            _, idle = self._active.popitem(last=False)
+            self._close_segment(idle)
+        return active
+
+
+    def _open_segment(self, channel_id: int, segment: int) -> ActiveSegment:
+        """Open a segment and its index for appending, unbuffered so reads of the files see every append"""
+        size = self._recover_tail(channel_id, segment)
+        return ActiveSegment(
+            segment,
+            open(self._segment_path(channel_id, segment), "ab", buffering=0),
+            open(self._segment_path(channel_id, segment, self.INDEX_SUFFIX), "ab", buffering=0),
+            size)
+
+
+    @staticmethod
+    def _close_segment(active: ActiveSegment) -> None:
+        active.segment_file.close()
+        active.index_file.close()
+
+
+    def _recover_tail(self, channel_id: int, segment: int) -> int:
+        """Check the records of a segment after its last index entry, cutting off a record left partly written
+        by a crash, along with index entries past the end of what's left, or partly written themselves.
+
+        Returns:
+            int: the size of the segment once recovered
+        """
+        key = (channel_id, segment)
+        path = self._segment_path(channel_id, segment)
+        index = self._get_index(channel_id, segment)
+        if not os.path.exists(path):
+            index.clear()
+            size = 0
+        else:
+            size = os.path.getsize(path)
+            start = next((offset for _, offset in reversed(index) if offset < size), 0)
+            with open(path, "rb") as segment_file:
+                segment_file.seek(start)
+                tail = segment_file.read()
+            position = 0
+            records = 0
+            while position + HistoryRecordCodec.LENGTH.size <= len(tail):
+                record_len, = HistoryRecordCodec.LENGTH.unpack_from(tail, position)
+                next_position = position + HistoryRecordCodec.LENGTH.size + record_len
+                if next_position > len(tail):
+                    break
+                try:
+                    HistoryRecordCodec.decode(tail, position)
+                except (struct.error, UnicodeDecodeError):
+                    break
+                position = next_position
+                records += 1
+            if start + position < size:
+                size = start + position
+                os.truncate(path, size)
+                self.torn_records_truncated += 1
+            index[:] = [entry for entry in index if entry[1] < size]
+            self._unindexed[key] = records if index else self.INDEX_INTERVAL
+
+        index_path = self._segment_path(channel_id, segment, self.INDEX_SUFFIX)
+        index_size = len(index) * self.INDEX_ENTRY.size
+        if os.path.exists(index_path) and os.path.getsize(index_path) != index_size:
+            os.truncate(index_path, index_size)
+        return size
+
+
+    def _read_segment(self, channel_id: int, segment: int, start_ms: int, end_ms: int) -> list[HistoryItem]:
+        """Read the items in [start_ms, end_ms] from one segment"""
+        path = self._segment_path(channel_id, segment)
+        if os.path.getsize(path) == 0:
+            return []
+
+        index = self._get_index(channel_id, segment)
+        position = bisect_right(index, (start_ms, -1)) - 1
+        offset = index[position][1] if position >= 0 else 0
+
+        results: list[HistoryItem] = []
+        with open(path, "rb") as segment_file:
+            with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                end = len(buffer)
+                while offset < end:
+                    timestamp_ms, next_offset = HistoryRecordCodec.peek_timestamp(buffer, offset)
+                    if timestamp_ms > end_ms:
+                        break
+                    if timestamp_ms >= start_ms:
+                        item, _ = HistoryRecordCodec.decode(buffer, offset)
+                        results.append(item)
+                    offset = next_offset
+        return results
+
+
+    def _get_segments(self, channel_id: int) -> list[int]:
+        """Get the sorted first timestamps of a channel's segments, listing them from disk on first use"""
+        if channel_id not in self._segments:
+            channel_dir = os.path.join(self.archive_dir, str(channel_id))
+            os.makedirs(channel_dir, exist_ok=True)
+            self._segments[channel_id] = sorted(
+                int(name[:-len(self.SEGMENT_SUFFIX)]) for name in os.listdir(channel_dir)
+                if name.endswith(self.SEGMENT_SUFFIX))
+        return self._segments[channel_id]
+
+
+    def _get_index(self, channel_id: int, segment: int) -> list[tuple[int, int]]:
+        """Get the sparse index of a segment, loading it from disk on first use"""
+        key = (channel_id, segment)
+        if key not in self._indexes:
+            index: list[tuple[int, int]] = []
+            path = self._segment_path(channel_id, segment, self.INDEX_SUFFIX)
+            if os.path.exists(path):
+                with open(path, "rb") as index_file:
+                    data = index_file.read()
+                index = [(timestamp_ms, offset) for timestamp_ms, offset in self.INDEX_ENTRY.iter_unpack(
+                    data[: len(data) - len(data) % self.INDEX_ENTRY.size])]
+            self._indexes[key] = index
+        return self._indexes[key]
+
+
+    def _segment_path(self, channel_id: int, segment: int, suffix: Optional[str] = None) -> str:
+        """Get the path of a segment file, or its index file"""
+        return os.path.join(self.archive_dir, str(channel_id), f"{segment:020d}{suffix or self.SEGMENT_SUFFIX}")
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+import discord
+from discord import Message, TextChannel, Thread
+from discord.ext import commands
+
+from ILogger import ILogger
+from IConfigManager import IConfigManager
+from ai.IAIModelProvider import IAIModelProvider
+
+
+class HistoryBackfill:
+    """Catches the conversation history up on messages sent to monitored channels while the bot was offline.
+
+    For each channel, the messages newer than the last one in its history are fetched from the Discord API,
+    normalized the same way as live messages, and added to the history as one batch.
+    Channels are fetched concurrently, up to HISTORY_BACKFILL_CONCURRENCY at a time; discord.py waits out
+    any rate limits it is given, so this only bounds how many requests are queued on them at once.
+    """
+    DEFAULT_MAX_MESSAGES = 200
+    DEFAULT_CONCURRENCY = 2
+
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 normalize_message: Callable[[Message], Awaitable[None]],
+                 ai_model_provider: IAIModelProvider,
+                 config_manager: IConfigManager,
+                 logger: ILogger
+                 ) -> None:
+        """Initialize the backfill
+
+        Args:
+            bot: the connected bot, to fetch channel history with
+            normalize_message: reference to a coroutine rewriting a user message's content
+                        the way live messages are kept in history, i.e. IEventHandler.normalize_message
+            ai_model_provider: IAIModelProvider reference, whose history is backfilled
+            config_manager: IConfigManager reference, to get config params
+        """
+        self.bot = bot
+        self.normalize_message = normalize_message
+        self.ai_model_provider = ai_model_provider
+        self.logger = logger
+
+        try:
+            #the most messages fetched per channel, 0 disables backfill
+            self.max_messages = int(config_manager.get_parameter("HISTORY_BACKFILL_MAX_MESSAGES")
+                                    or self.DEFAULT_MAX_MESSAGES)
+            self.concurrency = int(config_manager.get_parameter("HISTORY_BACKFILL_CONCURRENCY")
+                                   or self.DEFAULT_CONCURRENCY)
+        except Exception as e:
+            self.logger.exception("HistoryBackfill encounted an unexpected exception loading config values", e)
+            raise
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+
+    @property
+    def enabled(self) -> bool:
+        #without a latest message id, every startup would add the last max_messages again
+        return self.max_messages > 0 and self.ai_model_provider.SUPPORTS_BACKFILL
+
+
+    async def run(self, channel_ids: list[int], before_id: Optional[int] = None) -> dict[str, float]:
+        """Backfill the given channels.
+
+        Args:
+            channel_ids: the channels to backfill, fetched in this order as concurrency allows
+            before_id: a message id from when the bot started listening. Messages newer than this may have
+                        been added live already, so backfill starts from the newest message older than it.
+                        Any fetched again are dropped as duplicates.
+
+        Returns:
+            dict[str, float]: the channels and messages backfilled, seconds taken and messages per second
+        """
+        if not self.enabled:
+            return {}
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._backfill_channel(channel_id, before_id) for channel_id in channel_ids),
+                                       return_exceptions=True)
+        messages = 0
+        channels = 0
+        for channel_id, result in zip(channel_ids, results):
+            if isinstance(result, Exception):
+                self.logger.exception("an exception was raised trying to backfill channel {}", result, channel_id)
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            if result is None:
+                continue
+            messages += result
+            channels += 1
+        seconds = time.perf_counter() - start
+        stats = {
+            "channels": channels,
+            "messages": messages,
+            "seconds": seconds,
+            "messages_per_second": messages / seconds if seconds else 0.0
+        }
+        self.logger.info(
+            f"backfilled {messages} messages in {channels} of {len(channel_ids)} channels "
+            f"in {int(seconds * 1000)} ms, {stats['messages_per_second']:.0f} messages/s")
+        return stats
+
+
+    async def _backfill_channel(self, channel_id: int, before_id: Optional[int]) -> Optional[int]:
+        """Fetch and add the messages a channel's history is missing,
+        returning how many were added, or None if the channel can't be backfilled"""
+        channel = self.bot.get_channel(channel_id)
+        if not isinstance(channel, (TextChannel, Thread)):
+            self.logger.error(f"Channel id {channel_id} in MONITOR_CHANNELS is invalid channel type")
+            return None
+        after_id = await self.ai_model_provider.get_latest_message_id(channel_id, before_id)
+        after = discord.Object(id=after_id) if after_id else None
+
+        start = time.perf_counter()
+        async with self._semaphore:
+            #newest first, so a gap longer than max_messages keeps its most recent messages
+            fetched = [message async for message in
+                       channel.history(limit=self.max_messages, after=after, oldest_first=False)]
+        fetch_ms = (time.perf_counter() - start) * 1000
+
+        #as with live messages, other bots are ignored, and the bot's own messages are kept as its replies
+        bot_user_id = self.bot.user.id if self.bot.user else None
+        messages = [message for message in fetched if not message.author.bot or message.author.id == bot_user_id]
+        for message in messages:
+            if not message.author.bot:
+                await self.normalize_message(message)
+        await self.ai_model_provider.add_messages(channel_id, messages)
+        self.logger.debug(
+            f"_backfill_channel fetched {len(fetched)} messages for channel {channel_id} in {int(fetch_ms)} ms, "
+            f"added {len(messages)}")
+        return len(messages)
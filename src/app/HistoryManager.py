@@ -1,22 +1,78 @@
-from collections import deque
-from typing import Callable, Awaitable, Union
+import asyncio
+import os
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Awaitable, Iterable, Mapping, Optional, Sequence, Union
 
+import attr
 import aioboto3
+from aiobotocore.config import AioConfig
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 
 from ILogger import ILogger
 from IConfigManager import IConfigManager
-from IHistoryManager import IHistoryManager, HistoryItem
+from IHistoryManager import IHistoryManager, HistoryItem, HistoryView
+from ChannelHistory import ChannelHistory
+from SeenMessageIndex import SeenMessageIndex
+from HistoryWriteBuffer import HistoryWriteBuffer
+from HistoryArchive import HistoryArchive
+from HistorySummarizer import HistorySummarizer
+from HistorySnapshot import HistorySnapshot
+from ContextSelector import ContextSelector
+from retrieval.IRetrievalSource import IRetrievalSource
+from retrieval.IEmbedder import IEmbedder
+from retrieval.HashingEmbedder import HashingEmbedder
+from retrieval.OpenAIEmbedder import OpenAIEmbedder
+from retrieval.VectorRetriever import VectorRetriever
+from retrieval.KeywordRetriever import KeywordRetriever
 
 
 class HistoryManager(IHistoryManager):
+    TABLE_NAME = 'pepeleli-chat-history'
+    DEFAULT_DEDUP_WINDOW = 1000
+    DEFAULT_WRITE_BATCH_SIZE = 25
+    DEFAULT_WRITE_MAX_AGE_SECONDS = 2.0
+    DEFAULT_WRITE_MAX_PENDING = 1000
+    DEFAULT_LOAD_PAGE_SIZE = 100
+    DEFAULT_MAX_POOL_CONNECTIONS = 10
+    TTL_ATTRIBUTE = 'expires_at'
+    ALWAYS_WRITE_BEHIND = False #set by backends whose writes are only efficient in batches
+    DEFAULT_DATA_DIR = 'data'
+    DEFAULT_ARCHIVE_SEGMENT_BYTES = 16 * 1024 * 1024
+    DEFAULT_RETRIEVAL_CANDIDATES = 20
+    DEFAULT_VECTOR_TOKEN_BUDGET = 400
+    DEFAULT_KEYWORD_TOKEN_BUDGET = 200
+    DEFAULT_EMBED_BATCH_SIZE = 32
+    DEFAULT_WARMUP_CONCURRENCY = 4
+    DEFAULT_SUMMARY_TOKEN_BUDGET = 200
+    DEFAULT_SUMMARY_BATCH_SIZE = 10
+    DEFAULT_TOKEN_COUNT_CONCURRENCY = 8
+    DEFAULT_SNAPSHOT_INTERVAL_SECONDS = 300.0
+    TRUNCATE_ATTEMPTS = 3 #recounts allowed to bring an oversized item under HISTORY_MAX_ITEM_TOKENS
+    #attributes read back when loading history, as expression placeholders since some are reserved words
+    PERSISTED_ATTRIBUTES = {
+        "#timestamp": "timestamp",
+        "#content": "content",
+        "#name": "name",
+        "#id": "id",
+        "#channel_id": "channel_id",
+        "#token_count": "token_count",
+        "#token_model": "token_model"
+    }
+
+
     def __init__(self, 
                  count_tokens: Callable[[list[HistoryItem]], Awaitable[int]], 
                  format_msg: Callable[[HistoryItem], str], 
                  max_history_len: int, 
                  logger: ILogger, 
-                 config_manager: IConfigManager
+                 config_manager: IConfigManager,
+                 tokenizer_id: str = "",
+                 summarize: Optional[Callable[[str, list[HistoryItem], int], Awaitable[str]]] = None
                 ) -> None:
         """
         Args:
@@ -34,73 +90,598 @@ class HistoryManager(IHistoryManager):
             logger: reference to the active logger instance
 
             config_manager: reference to the active config manager instance
+
+            tokenizer_id: identifies the tokenizer/model behind count_tokens.
+                        stored alongside persisted token counts, so they can be trusted when reloaded
+                        with the same tokenizer, and recounted when the model has changed.
+
+            summarize: reference to an async coroutine that folds history items into a rolling summary,
+                        given the summary so far, the items and the maximum tokens the new summary may use.
+                        used to summarize trimmed history, if enabled by HISTORY_SUMMARIZE.
         """
         self.count_tokens = count_tokens
         self.format_msg = format_msg
         self.max_history_len = max_history_len
         self.logger = logger
         self.config_manager = config_manager
+        self.tokenizer_id = tokenizer_id
         
         try:
             self._persist = (True if self.config_manager.get_parameter("PERSIST_HISTORY") == "true" 
                             else False)
+            _dedup_window = int(self.config_manager.get_parameter("HISTORY_DEDUP_WINDOW") 
+                                or self.DEFAULT_DEDUP_WINDOW)
+            _write_behind = self.config_manager.get_parameter("HISTORY_WRITE_BEHIND") == "true"
+            _write_batch_size = int(self.config_manager.get_parameter("HISTORY_WRITE_BATCH_SIZE")
+                                    or self.DEFAULT_WRITE_BATCH_SIZE)
+            _write_max_age = float(self.config_manager.get_parameter("HISTORY_WRITE_MAX_AGE_SECONDS")
+                                   or self.DEFAULT_WRITE_MAX_AGE_SECONDS)
+            _write_max_pending = int(self.config_manager.get_parameter("HISTORY_WRITE_MAX_PENDING")
+                                     or self.DEFAULT_WRITE_MAX_PENDING)
+            self._load_page_size = int(self.config_manager.get_parameter("HISTORY_LOAD_PAGE_SIZE")
+                                       or self.DEFAULT_LOAD_PAGE_SIZE)
+            self._max_pool_connections = int(self.config_manager.get_parameter("HISTORY_MAX_POOL_CONNECTIONS")
+                                             or self.DEFAULT_MAX_POOL_CONNECTIONS)
+            #a retention window: persisted items expire this long after they are written, even if still in context,
+            #so a channel quiet for longer than this comes back empty after a restart
+            self._ttl_seconds = int(self.config_manager.get_parameter("HISTORY_TTL_SECONDS") or 0)
+            self._data_dir = self.config_manager.get_parameter("HISTORY_DATA_DIR") or self.DEFAULT_DATA_DIR
+            _archive = self.config_manager.get_parameter("HISTORY_ARCHIVE") == "true"
+            _archive_segment_bytes = int(self.config_manager.get_parameter("HISTORY_ARCHIVE_SEGMENT_BYTES")
+                                         or self.DEFAULT_ARCHIVE_SEGMENT_BYTES)
+            self._retrieval_candidates = int(self.config_manager.get_parameter("HISTORY_RETRIEVAL_CANDIDATES")
+                                             or self.DEFAULT_RETRIEVAL_CANDIDATES)
+            _vector_retrieval = self.config_manager.get_parameter("HISTORY_VECTOR_RETRIEVAL") == "true"
+            _vector_token_budget = int(self.config_manager.get_parameter("HISTORY_VECTOR_TOKEN_BUDGET")
+                                       or self.DEFAULT_VECTOR_TOKEN_BUDGET)
+            _embed_batch_size = int(self.config_manager.get_parameter("HISTORY_EMBED_BATCH_SIZE")
+                                    or self.DEFAULT_EMBED_BATCH_SIZE)
+            _keyword_retrieval = self.config_manager.get_parameter("HISTORY_KEYWORD_RETRIEVAL") == "true"
+            _keyword_token_budget = int(self.config_manager.get_parameter("HISTORY_KEYWORD_TOKEN_BUDGET")
+                                        or self.DEFAULT_KEYWORD_TOKEN_BUDGET)
+            self._memory_budget = int(self.config_manager.get_parameter("HISTORY_MEMORY_BUDGET_TOKENS") or 0)
+            self._warmup_concurrency = int(self.config_manager.get_parameter("HISTORY_WARMUP_CONCURRENCY")
+                                           or self.DEFAULT_WARMUP_CONCURRENCY)
+            _summarize = self.config_manager.get_parameter("HISTORY_SUMMARIZE") == "true"
+            _summary_token_budget = int(self.config_manager.get_parameter("HISTORY_SUMMARY_TOKEN_BUDGET")
+                                        or self.DEFAULT_SUMMARY_TOKEN_BUDGET)
+            _summary_batch_size = int(self.config_manager.get_parameter("HISTORY_SUMMARY_BATCH_SIZE")
+                                      or self.DEFAULT_SUMMARY_BATCH_SIZE)
+            _token_count_concurrency = int(self.config_manager.get_parameter("HISTORY_TOKEN_COUNT_CONCURRENCY")
+                                           or self.DEFAULT_TOKEN_COUNT_CONCURRENCY)
+            self._max_item_tokens = int(self.config_manager.get_parameter("HISTORY_MAX_ITEM_TOKENS") or 0)
+            _spill_truncated = self.config_manager.get_parameter("HISTORY_SPILL_TRUNCATED") == "true"
+            _context_tokens = int(self.config_manager.get_parameter("HISTORY_CONTEXT_TOKENS") or 0)
+            _snapshot = self.config_manager.get_parameter("HISTORY_SNAPSHOT") == "true"
+            _snapshot_interval = float(self.config_manager.get_parameter("HISTORY_SNAPSHOT_INTERVAL_SECONDS")
+                                       or self.DEFAULT_SNAPSHOT_INTERVAL_SECONDS)
+            _embedder: Optional[IEmbedder] = None
+            if _vector_retrieval:
+                _embedder = self._create_embedder(self.config_manager.get_parameter("HISTORY_EMBEDDER"))
         except Exception as e:
             self.logger.exception("HistoryManager encounted an unexpected exception loading config values", e)
             raise
         
         if self._persist:
-            self._session = aioboto3.Session(region_name='us-west-2')
+            self._open_persistence()
+        elif self._memory_budget:
+            self.logger.warning(
+                "HISTORY_MEMORY_BUDGET_TOKENS is set, but PERSIST_HISTORY is not, so idle channels won't be evicted")
+        #keeps trimmed history on local disk, if enabled.
+        #retrieval indexes refer to items in the archive rather than copying them, so retrieval enables it too
+        self._archive: Optional[HistoryArchive] = None
+        if _archive or _embedder or _keyword_retrieval:
+            self._archive = HistoryArchive(os.path.join(self._data_dir, "archive"), _archive_segment_bytes)
+
+        #full text of items truncated to HISTORY_MAX_ITEM_TOKENS, returned in their place from the archive.
+        #kept apart from the archive, whose records must be appended in chronological order as items are trimmed
+        self._spill: Optional[HistoryArchive] = None
+        if _spill_truncated and self._archive:
+            self._spill = HistoryArchive(os.path.join(self._data_dir, "spill"), _archive_segment_bytes)
+        elif _spill_truncated:
+            self.logger.warning(
+                "HISTORY_SPILL_TRUNCATED is enabled, but there is no archive to read spilled items from")
+        self._items_truncated = 0
+        self._tokens_truncated = 0
+
+        #searchable stores of trimmed history, each with the prompt tokens it may fill
+        self._retrieval_sources: list[tuple[IRetrievalSource, int]] = []
+        if _embedder and self._archive:
+            self._retrieval_sources.append((
+                VectorRetriever(_embedder, self._archive, os.path.join(self._data_dir, "vectors"),
+                                self.logger, _embed_batch_size),
+                _vector_token_budget
+            ))
+        if _keyword_retrieval and self._archive:
+            self._retrieval_sources.append((
+                KeywordRetriever(self._archive, os.path.join(self._data_dir, "keywords")),
+                _keyword_token_budget
+            ))
+
+        #picks the reply chain and newest messages for a prompt when the history doesn't all fit, if enabled
+        self._context_selector: Optional[ContextSelector] = None
+        if _context_tokens:
+            self._context_selector = ContextSelector(_context_tokens)
+
+        self._summarizer: Optional[HistorySummarizer] = None #rolling summaries of trimmed history, if enabled
+        if _summarize and summarize:
+            self._summarizer = HistorySummarizer(
+                summarize, os.path.join(self._data_dir, "summaries"), self.logger,
+                _summary_token_budget, _summary_batch_size)
+        elif _summarize:
+            self.logger.warning("HISTORY_SUMMARIZE is enabled, but this model provider can't summarize history")
+
+        #snapshots of the in-memory histories to local disk, restored on startup, if enabled
+        self._snapshot: Optional[HistorySnapshot] = None
+        if _snapshot:
+            self._snapshot = HistorySnapshot(
+                os.path.join(self._data_dir, "snapshot.bin"), self._snapshot_items, self.logger, _snapshot_interval)
+
+        self._dynamodb_stack: Optional[AsyncExitStack] = None #keeps the long-lived dynamodb resource open
+        self._table: Optional[Any] = None
+        self._table_lock = asyncio.Lock()
+        #bounds the token counts in flight across all channel loads, so a cold load can't flood the tokenizer
+        self._token_count_semaphore = asyncio.Semaphore(_token_count_concurrency)
+        self._pool_in_use = 0 #dynamodb requests currently holding a pooled connection
+        self._pool_peak = 0
+        self._pool_requests = 0
         
-        self._local_history: dict[int, deque[HistoryItem]] = {} #in-memory message history, keyed by channel id
+        #in-memory message history, keyed by channel id, in least to most recently used order
+        self._local_history: OrderedDict[int, ChannelHistory] = OrderedDict()
+        self._token_totals: dict[int, int] = {} #running total of tokens in each channel's in-memory history
+        self._seen_messages = SeenMessageIndex(_dedup_window) #recently seen message ids, to drop replayed messages
+        self._loads: dict[int, asyncio.Task[None]] = {} #in-flight history loads, shared by concurrent callers
+        self._load_requests = 0
+        self._loads_shared = 0
+        #per-channel locks ordering appends, trims and clears, dropped once no one holds or awaits them
+        self._channel_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._evictions = 0
+        self._reloads = 0
+        self._evicted_channels: set[int] = set() #channels evicted from memory, so their next load is a reload
+        self._last_reload_ms = 0.0
+        self._total_reload_ms = 0.0
+        
+        self._write_buffer: Optional[HistoryWriteBuffer] = None #batches persistence writes, if write-behind is enabled
+        if self._persist and (_write_behind or self.ALWAYS_WRITE_BEHIND):
+            self._write_buffer = HistoryWriteBuffer(
+                self._persist_history_items,
+                self.logger,
+                _write_batch_size,
+                _write_max_age,
+                _write_max_pending
+            )
         
     
-    async def get_history(self, channel_id: int) -> deque[HistoryItem]:
+    @classmethod
+    def create(cls,
+               count_tokens: Callable[[list[HistoryItem]], Awaitable[int]],
+               format_msg: Callable[[HistoryItem], str],
+               max_history_len: int,
+               logger: ILogger,
+               config_manager: IConfigManager,
+               tokenizer_id: str = "",
+               summarize: Optional[Callable[[str, list[HistoryItem], int], Awaitable[str]]] = None
+              ) -> 'HistoryManager':
+        """Create the history manager for the persistence backend selected by HISTORY_BACKEND,
+        dynamodb by default, dynamodb with messages packed into segments, or an embedded sqlite database.
+        Arguments are as for __init__."""
+        backend = config_manager.get_parameter("HISTORY_BACKEND") or "dynamodb"
+        if backend == "dynamodb":
+            return cls(count_tokens, format_msg, max_history_len, logger, config_manager, tokenizer_id, summarize)
+        if backend == "dynamodb-segments":
+            from SegmentedHistoryManager import SegmentedHistoryManager #imported here, as it subclasses this class
+            return SegmentedHistoryManager(
+                count_tokens, format_msg, max_history_len, logger, config_manager, tokenizer_id, summarize)
+        if backend == "sqlite":
+            from SQLiteHistoryManager import SQLiteHistoryManager #imported here, as it subclasses this class
+            return SQLiteHistoryManager(
+                count_tokens, format_msg, max_history_len, logger, config_manager, tokenizer_id, summarize)
+        raise ValueError(f"unknown HISTORY_BACKEND: {backend}")
+
+
+    def _open_persistence(self) -> None:
+        """Set up the persistence backend, a dynamodb session. Connections are opened lazily on first use."""
+        self._session = aioboto3.Session(region_name='us-west-2')
+
+
+    @property
+    def _history_budget(self) -> int:
+        """Tokens available to the in-context history, after reserving the retrieval sources' and summary's budgets"""
+        reserved = sum(budget for _, budget in self._retrieval_sources)
+        if self._summarizer:
+            reserved += self._summarizer.max_tokens
+        return self.max_history_len - reserved
+
+
+    def _create_embedder(self, embedder_type: str) -> IEmbedder:
+        """Create the embedder for semantic retrieval selected by config"""
+        if embedder_type == "openai":
+            return OpenAIEmbedder(self.config_manager.get_parameter("OPENAI_API_KEY"))
+        if embedder_type in ("", "hashing"):
+            return HashingEmbedder(int(self.config_manager.get_parameter("HISTORY_EMBEDDING_DIMENSION") or 256))
+        raise ValueError(f"unknown HISTORY_EMBEDDER: {embedder_type}")
+
+
+    async def get_history(self, channel_id: int) -> HistoryView:
         """Retrieve the history for a given channel ID,
-        from in-memory cache if available, otherwise from dynamodb"""
-        if channel_id not in self._local_history:
-            if self._persist:
-                self._local_history[channel_id] = await self._get_persisted_history(channel_id)
+        from in-memory cache if available, otherwise from dynamodb.
+        Returns an immutable view, so callers can read it across awaits while other messages
+        are appended and trimmed, without copying it."""
+        return (await self._channel_history(channel_id)).view()
+
+
+    async def get_context(self, channel_id: int, reply_id: Optional[int] = None) -> Sequence[HistoryItem]:
+        """Retrieve the history items for a given channel ID to put in a prompt, in chronological order.
+        With HISTORY_CONTEXT_TOKENS set, a history over that many tokens has the chain of messages
+        leading to reply_id selected first, then the newest messages, as a list, otherwise it is returned whole."""
+        history = await self.get_history(channel_id)
+        if not self._context_selector or self._token_totals.get(channel_id, 0) <= self._context_selector.budget:
+            return history
+        return self._context_selector.select(channel_id, history, reply_id)
+
+
+    async def _channel_history(self, channel_id: int) -> ChannelHistory:
+        """Get the live, mutable history for a given channel ID, loading it if it isn't in memory.
+        Concurrent calls for a channel that isn't in memory share a single load."""
+        while channel_id not in self._local_history:
+            load = self._loads.get(channel_id)
+            self._load_requests += 1
+            if load is None:
+                load = asyncio.get_running_loop().create_task(self._load_history(channel_id))
+                self._loads[channel_id] = load
+                load.add_done_callback(lambda _: self._loads.pop(channel_id, None))
             else:
-                self._local_history[channel_id] = deque()
+                self._loads_shared += 1
+            #shielded, so a cancelled caller doesn't cancel the load for everyone else waiting on it
+            await asyncio.shield(load)
 
+        self._local_history.move_to_end(channel_id)
         return self._local_history[channel_id]
 
 
+    async def _load_history(self, channel_id: int) -> None:
+        """Load the history for a given channel ID into memory, from dynamodb if persisted"""
+        start = time.perf_counter()
+        if self._persist:
+            channel_history = await self._get_persisted_history(channel_id)
+            await self._ensure_token_counts(channel_history)
+            if self._write_buffer:
+                channel_history = self._merge_unflushed(channel_id, channel_history)
+        else:
+            channel_history = deque()
+        if channel_id in self._local_history:
+            #cleared while loading, the cleared history wins
+            return
+        self._local_history[channel_id] = ChannelHistory(channel_history)
+        self._token_totals[channel_id] = sum(item.token_count or 0 for item in channel_history)
+        if self._context_selector:
+            self._context_selector.reset(channel_id, channel_history)
+
+        if channel_id in self._evicted_channels:
+            self._evicted_channels.discard(channel_id)
+            self._reloads += 1
+            self._last_reload_ms = (time.perf_counter() - start) * 1000
+            self._total_reload_ms += self._last_reload_ms
+            self.logger.debug(
+                f"_load_history reloaded evicted channel {channel_id} in {int(self._last_reload_ms)} ms")
+        self._evict_idle_channels()
+
+
+    def _channel_lock(self, channel_id: int) -> asyncio.Lock:
+        """Get the lock ordering updates to a channel's history"""
+        lock = self._channel_locks.get(channel_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._channel_locks[channel_id] = lock
+        return lock
+
+
+    def _merge_unflushed(self, channel_id: int, channel_history: deque[HistoryItem]) -> deque[HistoryItem]:
+        """Add items still waiting in the write buffer to history loaded from dynamodb,
+        so a channel reloaded after eviction doesn't lose its newest messages.
+        The oldest items are dropped again if the merged history no longer fits the history budget."""
+        loaded_ids = {item.id for item in channel_history}
+        unflushed = [item for item in self._write_buffer.pending(channel_id) if item.id not in loaded_ids] \
+            if self._write_buffer else []
+        if not unflushed:
+            return channel_history
+        merged = deque(sorted([*channel_history, *unflushed], key=lambda item: item.timestamp_ms))
+        history_len = sum(item.token_count or 0 for item in merged)
+        while merged and history_len > self._history_budget:
+            history_len -= merged.popleft().token_count or 0
+        return merged
+
+
+    def _evict_idle_channels(self) -> None:
+        """Drop the least recently used channels' histories from memory while over the memory budget.
+        Only used when history is persisted, since evicted channels are reloaded from dynamodb on next use.
+        The most recently used channel, and channels in the middle of an update, are never evicted."""
+        if not self._memory_budget or not self._persist:
+            return
+        resident_tokens = sum(self._token_totals.values())
+        most_recent = next(reversed(self._local_history), None)
+        for channel_id in list(self._local_history):
+            if resident_tokens <= self._memory_budget:
+                break
+            lock = self._channel_locks.get(channel_id)
+            if channel_id == most_recent or (lock and lock.locked()):
+                continue
+            del self._local_history[channel_id]
+            resident_tokens -= self._token_totals.pop(channel_id, 0)
+            if self._context_selector:
+                self._context_selector.reset(channel_id)
+            self._evicted_channels.add(channel_id)
+            self._evictions += 1
+            self.logger.debug(
+                f"_evict_idle_channels evicted channel {channel_id}, {resident_tokens} tokens now resident")
+
+
+    async def _ensure_token_counts(self, items: Iterable[HistoryItem]) -> None:
+        """Count tokens for any of the given items which don't already have a token count
+        from the current tokenizer, e.g. items persisted before a model change.
+        Items are counted one at a time, with at most HISTORY_TOKEN_COUNT_CONCURRENCY counts in flight."""
+        uncounted = [item for item in items 
+                     if item.token_count is None or item.token_model != self.tokenizer_id]
+        if not uncounted:
+            return
+        async def count_item(item: HistoryItem) -> int:
+            async with self._token_count_semaphore:
+                return await self.count_tokens([item])
+
+        counts = await asyncio.gather(*(count_item(item) for item in uncounted))
+        for item, count in zip(uncounted, counts):
+            item.token_count = count
+            item.token_model = self.tokenizer_id
+        self.logger.debug(f"_ensure_token_counts counted tokens for {len(uncounted)} items")
+
+
+    @staticmethod
+    def _to_dynamo_timestamp(timestamp_ms: int) -> Decimal:
+        """Convert a millisecond timestamp to the seconds stored as dynamodb's sort key.
+        Goes through float, so keys match those written before timestamps were held in milliseconds,
+        which were Decimal(message.created_at.timestamp())"""
+        return Decimal(timestamp_ms / 1000)
+
+
+    @staticmethod
+    def _from_dynamo_timestamp(timestamp: Decimal) -> int:
+        """Convert a dynamodb sort key in seconds back to a millisecond timestamp"""
+        return int((Decimal(timestamp) * 1000).to_integral_value())
+
+
+    def _item_from_dynamo(self, record: Mapping[str, Any]) -> HistoryItem:
+        """Build a HistoryItem from a dynamodb item.
+        dynamodb returns all numbers as Decimal, so integer fields are converted back to int"""
+        token_count = record.get("token_count")
+        return HistoryItem(
+            timestamp_ms = self._from_dynamo_timestamp(record["timestamp"]),
+            content = str(record["content"]),
+            name = str(record["name"]),
+            id = int(record["id"]),
+            channel_id = int(record["channel_id"]),
+            token_count = int(token_count) if token_count is not None else None,
+            token_model = str(record.get("token_model", ""))
+        )
+
+
+    def _item_to_dynamo(self, item: HistoryItem) -> dict[str, Any]:
+        """Build a dynamodb item from a HistoryItem, including its token count,
+        and an expiry time if a TTL is configured. The expiry counts from when the item is written,
+        the TTL is a retention window rather than a time since the item left context."""
+        record: dict[str, Any] = {
+            "timestamp": self._to_dynamo_timestamp(item.timestamp_ms),
+            "content": item.content,
+            "name": item.name,
+            "id": item.id,
+            "channel_id": item.channel_id
+        }
+        if item.token_count is not None:
+            record["token_count"] = item.token_count
+            record["token_model"] = item.token_model
+        if self._ttl_seconds:
+            record[self.TTL_ATTRIBUTE] = int(time.time()) + self._ttl_seconds
+        return record
+
+
+    async def _get_table(self) -> Any:
+        """Get the dynamodb table resource, creating the long-lived client on first use.
+        The client keeps a pool of keep-alive connections, so requests don't repeat
+        client construction, credential resolution and TLS setup."""
+        if self._table is None:
+            async with self._table_lock:
+                if self._table is None:
+                    stack = AsyncExitStack()
+                    dynamodb = await stack.enter_async_context(self._session.resource(
+                        'dynamodb',
+                        config=AioConfig(max_pool_connections=self._max_pool_connections, tcp_keepalive=True)
+                    ))
+                    self._table = await dynamodb.Table(self.TABLE_NAME)
+                    self._dynamodb_stack = stack
+        return self._table
+
+
+    @asynccontextmanager
+    async def _dynamodb_table(self) -> AsyncIterator[Any]:
+        """Use the shared dynamodb table resource for a request, tracking connection pool usage"""
+        table = await self._get_table()
+        self._pool_in_use += 1
+        self._pool_requests += 1
+        self._pool_peak = max(self._pool_peak, self._pool_in_use)
+        try:
+            yield table
+        finally:
+            self._pool_in_use -= 1
+
+
     async def _get_persisted_history(self, channel_id: int) -> deque[HistoryItem]:
-        """Retrieve persisted history for a given channel ID from dynamodb"""
+        """Retrieve persisted history for a given channel ID from dynamodb.
+        Only the most recent items that fit within the history token budget are loaded: 
+        pages are read newest first until the token budget is met, then reversed into chronological order.
+        With a TTL configured, expired items are skipped, as dynamodb may take days to actually delete them."""
+        history_items: list[HistoryItem] = []
+        history_len = 0
+        query_args: dict[str, Any] = {
+            "KeyConditionExpression": Key('channel_id').eq(channel_id),
+            "ScanIndexForward": False,
+            "Limit": self._load_page_size,
+            "ProjectionExpression": ", ".join(self.PERSISTED_ATTRIBUTES.keys()),
+            "ExpressionAttributeNames": self.PERSISTED_ATTRIBUTES
+        }
+        if self._ttl_seconds:
+            query_args["FilterExpression"] = (Attr(self.TTL_ATTRIBUTE).not_exists()
+                                              | Attr(self.TTL_ATTRIBUTE).gt(int(time.time())))
+
+        async with self._dynamodb_table() as table:
+            budget_met = False
+            while not budget_met:
+                response = await table.query(**query_args)
+                page = [self._item_from_dynamo(item) for item in response.get('Items', [])]
+                await self._ensure_token_counts(page)
+                for item in page:
+                    if history_len + (item.token_count or 0) > self._history_budget:
+                        budget_met = True
+                        break
+                    history_items.append(item)
+                    history_len += item.token_count or 0
+                
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_args["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+        self.logger.debug(
+            f"_get_persisted_history loaded {len(history_items)} items with {history_len} tokens "
+            f"for channel {channel_id}")
+        history_items.reverse()
+        return deque(history_items)
 
-        async with self._session.resource('dynamodb') as dynamodb:
-            table = await dynamodb.Table('pepeleli-chat-history')
-            response = await table.query(
-                KeyConditionExpression=Key('channel_id').eq(channel_id),
-                ScanIndexForward=True
-            )
-            if 'Items' in response:
-                history_items = [HistoryItem(**item) for item in response['Items']] #type: ignore
-                return deque(history_items)
-            else:
-                return deque()
+
+    async def is_duplicate(self, channel_id: int, message_id: int) -> bool:
+        """Check if a message has already been added to the history for a given channel ID,
+        so callers can skip any further work on a replayed message"""
+        return self._seen_messages.contains(channel_id, message_id)
 
 
     async def add_history_item(self, channel_id: int, item: HistoryItem) -> None:
-        """Add an item to the history for a given channel ID"""
-        channel_history = await self.get_history(channel_id)
-        channel_history.append(item)
-        self._local_history[channel_id] = channel_history
+        """Add an item to the history for a given channel ID.
+        Items with a message id already seen recently in the channel are dropped."""
+        if self._seen_messages.check_and_record(channel_id, item.id):
+            self.logger.debug(
+                f"add_history_item dropped duplicate message {item.id} in channel {channel_id}, "
+                f"{self._seen_messages.duplicates_suppressed} duplicates suppressed so far")
+            return
 
-        if self._persist:
-            await self._persist_history_item(item)
-        
-        await self._trim_history(channel_id)
+        #appends, persistence and trims for a channel run one message at a time, in arrival order,
+        #so a trim can't delete an item before its write lands, or reorder a burst of messages
+        async with self._channel_lock(channel_id):
+            #the item is written before it's appended, so if anything fails it isn't in the history,
+            #and its id is forgotten again so a redelivery of the message isn't dropped as a duplicate
+            try:
+                await self._ensure_token_counts([item])
+                if self._max_item_tokens and (item.token_count or 0) > self._max_item_tokens:
+                    item = await self._truncate_item(item)
+                channel_history = await self._channel_history(channel_id)
+                if self._write_buffer:
+                    await self._write_buffer.add(item)
+                elif self._persist:
+                    await self._persist_history_item(item)
+            except BaseException:
+                self._seen_messages.forget(channel_id, item.id)
+                raise
+
+            channel_history.append(item)
+            self._local_history[channel_id] = channel_history
+            self._token_totals[channel_id] += item.token_count or 0
+            if self._context_selector:
+                self._context_selector.index(channel_id, [item])
+            await self._trim_history(channel_id)
+        self._evict_idle_channels()
+
+
+    async def add_history_items(self, channel_id: int, items: list[HistoryItem]) -> None:
+        """Add a batch of items to the history for a given channel ID, e.g. messages backfilled after a restart.
+        The batch has its tokens counted together and is persisted in one batched write, rather than item by item.
+        Items may be older than messages already added, so they're merged into the history by timestamp.
+        Items with a message id already seen recently in the channel, or already in its history, are dropped."""
+        new_items = [item for item in sorted(items, key=lambda item: item.timestamp_ms)
+                     if not self._seen_messages.check_and_record(channel_id, item.id)]
+        if not new_items:
+            return
+
+        async with self._channel_lock(channel_id):
+            try:
+                channel_history = await self._channel_history(channel_id)
+                present_ids = {item.id for item in channel_history}
+                new_items = [item for item in new_items if item.id not in present_ids]
+                if not new_items:
+                    return
+                await self._ensure_token_counts(new_items)
+                if self._max_item_tokens:
+                    new_items = [await self._truncate_item(item) if (item.token_count or 0) > self._max_item_tokens
+                                 else item for item in new_items]
+                if self._write_buffer:
+                    for item in new_items:
+                        await self._write_buffer.add(item)
+                elif self._persist:
+                    await self._persist_history_items(new_items)
+            except BaseException:
+                #as in add_history_item, nothing is added, so the ids are forgotten for a retry
+                for item in new_items:
+                    self._seen_messages.forget(channel_id, item.id)
+                raise
+
+            if channel_history and channel_history[-1].timestamp_ms > new_items[0].timestamp_ms:
+                channel_history = ChannelHistory(
+                    sorted([*channel_history, *new_items], key=lambda item: item.timestamp_ms))
+                if self._context_selector:
+                    self._context_selector.reset(channel_id, channel_history)
+            else:
+                for item in new_items:
+                    channel_history.append(item)
+                if self._context_selector:
+                    self._context_selector.index(channel_id, new_items)
+            self._local_history[channel_id] = channel_history
+            self._token_totals[channel_id] += sum(item.token_count or 0 for item in new_items)
+            await self._trim_history(channel_id)
+        self.logger.debug(f"add_history_items added {len(new_items)} items to channel {channel_id}")
+        self._evict_idle_channels()
+
+
+    async def _truncate_item(self, item: HistoryItem) -> HistoryItem:
+        """Cut the middle out of an item over HISTORY_MAX_ITEM_TOKENS, e.g. a pasted log, leaving a marker in its place,
+        so one message can't push the rest of the conversation out of context.
+        The share of the content kept is estimated from the token count, then recounted, shrinking again if needed.
+        The full item is spilled alongside the archive, if enabled."""
+        content = item.content
+        keep = len(content)
+        tokens = item.token_count or 0
+        truncated = item
+        for _ in range(self.TRUNCATE_ATTEMPTS):
+            #aim a little under the cap, as the marker and the cut points shift the count
+            keep = int(keep * self._max_item_tokens / tokens * 0.9)
+            head = content[:keep - keep // 2]
+            tail = content[len(content) - keep // 2:] if keep // 2 else ""
+            truncated = attr.evolve(item, content=f"{head}\n[... {len(content) - keep} characters cut ...]\n{tail}",
+                                    token_count=None, token_model="")
+            await self._ensure_token_counts([truncated])
+            tokens = truncated.token_count or 0
+            if tokens <= self._max_item_tokens:
+                break
+        self._items_truncated += 1
+        self._tokens_truncated += (item.token_count or 0) - tokens
+        self.logger.info(
+            f"_truncate_item cut message {item.id} in channel {item.channel_id} "
+            f"from {item.token_count} to {tokens} tokens")
+        if self._spill:
+            await asyncio.to_thread(self._spill.append, [item])
+        return truncated
 
 
     async def _persist_history_item(self, item: HistoryItem) -> None:
         """Persist a history item to dynamodb for a given channel ID"""
-        async with self._session.resource('dynamodb') as dynamodb:
-            table = await dynamodb.Table('pepeleli-chat-history')
+        async with self._dynamodb_table() as table:
             try:
                 await table.put_item(
-                    Item = item.__dict__,
+                    Item = self._item_to_dynamo(item),
                     ConditionExpression="attribute_not_exists(message_id)"
                 )
             except ClientError as ce:
@@ -111,61 +692,315 @@ class HistoryManager(IHistoryManager):
                     raise
 
 
+    async def _persist_history_items(self, items: list[HistoryItem]) -> None:
+        """Persist a batch of history items to dynamodb, used by the write-behind buffer and batched adds.
+        batch_writer doesn't support condition expressions, 
+        so repeated keys within the batch are collapsed instead."""
+        async with self._dynamodb_table() as table:
+            async with table.batch_writer(overwrite_by_pkeys=["channel_id", "timestamp"]) as batch:
+                for item in items:
+                    await batch.put_item(Item=self._item_to_dynamo(item))
+
+
+    async def scan_persisted_history(self, segment: int, total_segments: int,
+                                     start_key: Optional[dict[str, Any]] = None
+                                     ) -> AsyncIterator[tuple[list[HistoryItem], Optional[dict[str, Any]]]]:
+        """Stream every persisted history item with a parallel scan of the dynamodb table, one scan segment.
+        Dynamodb splits scan segments by partition key, so each channel is in one segment,
+        and returns a channel's items in sort key order. Expired items are skipped, as for loads."""
+        scan_args: dict[str, Any] = {
+            "Segment": segment,
+            "TotalSegments": total_segments,
+            "Limit": self._load_page_size,
+            "ProjectionExpression": ", ".join(self.PERSISTED_ATTRIBUTES.keys()),
+            "ExpressionAttributeNames": self.PERSISTED_ATTRIBUTES
+        }
+        if start_key:
+            scan_args["ExclusiveStartKey"] = start_key
+        if self._ttl_seconds:
+            scan_args["FilterExpression"] = (Attr(self.TTL_ATTRIBUTE).not_exists()
+                                             | Attr(self.TTL_ATTRIBUTE).gt(int(time.time())))
+
+        async with self._dynamodb_table() as table:
+            while True:
+                response = await table.scan(**scan_args)
+                last_key = response.get('LastEvaluatedKey')
+                yield [self._item_from_dynamo(record) for record in response.get('Items', [])], last_key
+                if not last_key:
+                    return
+                scan_args["ExclusiveStartKey"] = last_key
+
+
+    async def import_history_items(self, items: list[HistoryItem]) -> None:
+        """Persist a batch of history items as they are, bypassing the in-memory history and write buffer"""
+        if items:
+            await self._persist_history_items(items)
+
+
     async def clear_history(self, channel_id: int) -> None:
         """Clear the history for a given channel ID"""
-        self._local_history[channel_id] = deque()
+        async with self._channel_lock(channel_id):
+            self._local_history[channel_id] = ChannelHistory()
+            self._token_totals[channel_id] = 0
+            if self._context_selector:
+                self._context_selector.reset(channel_id)
+
+
+    async def get_archived_history(self, channel_id: int, start_ms: int, end_ms: int) -> list[HistoryItem]:
+        """Retrieve history items trimmed from a given channel ID, 
+        with timestamps between start_ms and end_ms inclusive.
+        Items which were truncated are returned in full, if they were spilled.
+        Returns nothing if the archive is not enabled."""
+        if not self._archive:
+            return []
+        items = await asyncio.to_thread(self._archive.read, channel_id, start_ms, end_ms)
+        if self._spill:
+            spilled_items = await asyncio.to_thread(self._spill.read, channel_id, start_ms, end_ms)
+            spilled = {item.id: item for item in spilled_items}
+            items = [spilled.get(item.id, item) for item in items]
+        return items
+
+
+    async def retrieve(self, channel_id: int, query: str) -> list[HistoryItem]:
+        """Retrieve history items trimmed from a given channel ID which are relevant to a query,
+        to bring back into the prompt. Each retrieval source fills its own token budget with its
+        best matches not already in context. Results are returned in chronological order."""
+        if not query or not self._retrieval_sources:
+            return []
+        in_context = {item.id for item in await self.get_history(channel_id)}
+        selected: dict[int, HistoryItem] = {}
+        for source, budget in self._retrieval_sources:
+            used = 0
+            for item in await source.search(channel_id, query, self._retrieval_candidates):
+                if item.id in in_context or item.id in selected:
+                    continue
+                if used + (item.token_count or 0) > budget:
+                    continue
+                selected[item.id] = item
+                used += item.token_count or 0
+        return sorted(selected.values(), key=lambda item: item.timestamp_ms)
+
+
+    async def get_summary(self, channel_id: int) -> str:
+        """Get the rolling summary of the history trimmed from a given channel ID,
+        to be placed in the prompt ahead of the history it replaces.
+        Returns nothing if summarization is not enabled, or nothing has been summarized yet."""
+        if not self._summarizer:
+            return ""
+        return await self._summarizer.get_summary(channel_id)
+
+
+    async def warm_up(self, channel_ids: list[int]) -> dict[int, float]:
+        """Load the histories of the given channel IDs ahead of their first message, e.g. at startup.
+        The local snapshot is restored first, if enabled, and channels it restores aren't loaded again.
+        The rest are loaded at most HISTORY_WARMUP_CONCURRENCY at a time, started in the given order.
+        Stops starting new loads once warming up has filled the memory budget and started evicting,
+        and keeps each newly warmed channel least recently used, so the more active channels stay loaded.
+
+        Returns:
+            dict: milliseconds taken to warm up each channel loaded
+        """
+        timings: dict[int, float] = {}
+        if self._snapshot:
+            await self._restore_snapshot()
+            self._snapshot.start()
+        if not self._persist:
+            return timings
+        semaphore = asyncio.Semaphore(self._warmup_concurrency)
+        evictions_before = self._evictions
+
+        async def warm_up_channel(channel_id: int) -> None:
+            async with semaphore:
+                if self._evictions > evictions_before:
+                    self.logger.info(f"warm_up skipped channel {channel_id}, the memory budget is full")
+                    return
+                start = time.perf_counter()
+                try:
+                    channel_history = await self.get_history(channel_id)
+                except Exception as e:
+                    self.logger.exception("HistoryManager failed to warm up channel {}", e, channel_id)
+                    return
+                if channel_id in self._local_history:
+                    self._local_history.move_to_end(channel_id, last=False)
+                timings[channel_id] = (time.perf_counter() - start) * 1000
+                self.logger.info(
+                    f"warm_up loaded {len(channel_history)} items with {self._token_totals.get(channel_id, 0)} "
+                    f"tokens for channel {channel_id} in {int(timings[channel_id])} ms")
+
+        await asyncio.gather(*(warm_up_channel(channel_id) for channel_id in channel_ids))
+        return timings
+
+
+    async def _restore_snapshot(self) -> None:
+        """Restore the in-memory histories from the local snapshot.
+        When history is also persisted, only a snapshot taken on a clean shutdown is restored,
+        as a background snapshot may be missing items persisted after it was taken.
+        Items added since startup are kept, merged with the restored ones."""
+        if not self._snapshot:
+            return
+        items, clean = await asyncio.to_thread(self._snapshot.load)
+        if self._persist and not clean:
+            if items:
+                self.logger.info(
+                    "HistoryManager skipped a snapshot not taken on a clean shutdown, loading persisted history")
+            return
+        await self._ensure_token_counts(items)
+        by_channel: dict[int, list[HistoryItem]] = {}
+        for item in items:
+            by_channel.setdefault(item.channel_id, []).append(item)
+
+        for channel_id, restored in by_channel.items():
+            async with self._channel_lock(channel_id):
+                current = self._local_history.get(channel_id, ChannelHistory())
+                current_ids = {item.id for item in current}
+                restored = [item for item in restored if item.id not in current_ids]
+                merged = ChannelHistory(sorted([*restored, *current], key=lambda item: item.timestamp_ms))
+                history_len = sum(item.token_count or 0 for item in merged)
+                while merged and history_len > self._history_budget:
+                    history_len -= merged.popleft().token_count or 0
+                self._local_history[channel_id] = merged
+                for item in restored:
+                    self._seen_messages.check_and_record(channel_id, item.id)
+                if self._context_selector:
+                    self._context_selector.reset(channel_id, merged)
+                #restored channels count as least recently used, channels already active stay ahead of them
+                if not current:
+                    self._local_history.move_to_end(channel_id, last=False)
+                self._token_totals[channel_id] = history_len
+        self.logger.info(f"HistoryManager restored {len(items)} items in {len(by_channel)} channels from the snapshot")
+        self._evict_idle_channels()
+
+
+    def _snapshot_items(self) -> list[HistoryItem]:
+        """Gather every in-memory history item for a snapshot, channel by channel"""
+        return [item for channel_history in self._local_history.values() for item in channel_history]
+
+
+    async def close(self) -> None:
+        """Flush anything not yet persisted, called on shutdown.
+        Unflushed history is written first, and a failure closing any one part doesn't stop the rest."""
+        closing: list[tuple[str, Callable[[], Awaitable[None]]]] = []
+        if self._write_buffer:
+            closing.append(("write buffer", self._write_buffer.close))
+        if self._summarizer:
+            closing.append(("summarizer", self._summarizer.close))
+        for source, _ in self._retrieval_sources:
+            closing.append((type(source).__name__, source.close))
+        if self._snapshot:
+            closing.append(("snapshot", self._snapshot.close))
+        for name, close in closing:
+            try:
+                await close()
+            except Exception as e:
+                self.logger.exception("HistoryManager failed to close its {}", e, name)
+        if self._archive:
+            await asyncio.to_thread(self._archive.close)
+        if self._dynamodb_stack:
+            await self._dynamodb_stack.aclose()
+            self._dynamodb_stack = None
+            self._table = None
+
+
+    def get_stats(self) -> dict[str, float]:
+        """Get counters describing the history manager's activity"""
+        stats: dict[str, float] = {
+            "channels": len(self._local_history),
+            "resident_tokens": sum(self._token_totals.values()),
+            "load_requests": self._load_requests,
+            "loads_shared": self._loads_shared,
+            "evictions": self._evictions,
+            "reloads": self._reloads,
+            "last_reload_ms": self._last_reload_ms,
+            "avg_reload_ms": self._total_reload_ms / self._reloads if self._reloads else 0.0,
+            "duplicates_suppressed": self._seen_messages.duplicates_suppressed,
+            "items_truncated": self._items_truncated,
+            "tokens_truncated": self._tokens_truncated
+        }
+        if self._archive:
+            stats.update({f"archive_{key}": value for key, value in self._archive.stats().items()})
+        if self._spill:
+            stats.update({f"spill_{key}": value for key, value in self._spill.stats().items()})
+        for source, _ in self._retrieval_sources:
+            stats.update({f"{type(source).__name__}_{key}": value for key, value in source.stats().items()})
+        if self._context_selector:
+            stats.update({f"context_{key}": value for key, value in self._context_selector.stats().items()})
+        if self._summarizer:
+            stats.update({f"summarizer_{key}": value for key, value in self._summarizer.stats().items()})
+        if self._snapshot:
+            stats.update({f"snapshot_{key}": value for key, value in self._snapshot.stats().items()})
+        if self._write_buffer:
+            stats.update({f"write_buffer_{key}": value for key, value in self._write_buffer.stats().items()})
+        if self._persist:
+            stats.update(self._persistence_stats())
+        return stats
+
+
+    def _persistence_stats(self) -> dict[str, float]:
+        """Get counters describing the persistence backend, the dynamodb connection pool"""
+        return {
+            "pool_max_connections": self._max_pool_connections,
+            "pool_in_use": self._pool_in_use,
+            "pool_peak_in_use": self._pool_peak,
+            "pool_requests": self._pool_requests
+        }
 
 
     async def _trim_history(self, channel_id: int) -> None:
         """Trim the history for a given channel ID to stay within context length.
-        Currently just truncates, will eventually archive
+        Uses the token counts cached on each item, so no tokenizer calls are needed.
+        Trimmed items are written to the local archive, if enabled.
         """
-        channel_history = await self.get_history(channel_id)
-        history_len = await self.count_tokens(list(channel_history))
+        channel_history = await self._channel_history(channel_id)
+        history_len = self._token_totals[channel_id]
         self.logger.debug(
             f"_trim_history found history length {history_len} for channel {channel_id}")
         
-        all_removed: list[HistoryItem] = []
-        while history_len > self.max_history_len and channel_history:
-            #TODO: archive history in a retrieveable manner
-            #for now: just truncate it.
-            removed = channel_history.popleft()
-            all_removed.append(removed)
-            len_diff = await self.count_tokens([removed])
-            history_len -= len_diff
-            self.logger.debug(
-                f"_trim_history truncated {len_diff} tokens "
-                f"for a new total length of {history_len}")
+        excess = history_len - self._history_budget
+        if excess <= 0:
+            return
+        
+        #find the shortest prefix of the history that covers the excess, then cut it in one step
+        cut_len = 0
+        cut_tokens = 0
+        for item in channel_history:
+            if cut_tokens >= excess:
+                break
+            cut_tokens += item.token_count or 0
+            cut_len += 1
+
+        all_removed = [channel_history.popleft() for _ in range(cut_len)]
+        self._token_totals[channel_id] = history_len - cut_tokens
+        self.logger.debug(
+            f"_trim_history truncated {len(all_removed)} items with {cut_tokens} tokens "
+            f"for a new total length of {self._token_totals[channel_id]}")
             
-        if all_removed and self._persist:
+        if all_removed and self._context_selector:
+            self._context_selector.forget(channel_id, all_removed)
+        if all_removed and self._archive:
+            refs = await asyncio.to_thread(self._archive.append, all_removed)
+            for source, _ in self._retrieval_sources:
+                await source.add_items(all_removed, refs)
+        if all_removed and self._summarizer:
+            self._summarizer.add_items(all_removed)
+        if all_removed and self._write_buffer:
+            self._write_buffer.discard(all_removed)
+        if all_removed and self._persist and not self._ttl_seconds:
+            #with a TTL configured, dynamodb expires trimmed items itself, at the end of their retention window
             await self._delete_persisted_items(all_removed)
         self._local_history[channel_id] = channel_history
 
 
     async def _delete_persisted_items(self, items: Union[HistoryItem, list[HistoryItem]]) -> None:
         """Delete the given history item(s) from dynamodb.
-        items must all have the same channel_id"""
+        Each HistoryItem already carries its channel_id/timestamp key, so no lookup is needed."""
         if not isinstance(items, list):
             items = [items]
-        
-        channel_id = items[0].channel_id
-
-        async with self._session.resource("dynamodb") as dynamodb:
-            table = await dynamodb.Table("your_chat_history_table")
-
-            response = await table.query(
-                KeyConditionExpression=(
-                    Key("channel_id").eq(channel_id)
-                )
-            )
-            message_timestamps = {item['message_id']: item['timestamp'] 
-                                  for item in response['Items'] if item['message_id'] in items}
-
-            async with table.batch_writer() as batch:
-                for message_id in items:
-                    if message_id in message_timestamps:
-                        await batch.delete_item(Key={"channel_id": channel_id, "timestamp": message_timestamps[message_id]}) #type:ignore
-                        self.logger.debug(f"HistoryItem with message_id '{message_id}' has been deleted in channel {channel_id}")
 
-                    else:
-                        self.logger.debug(f"No HistoryItem with message_id '{message_id}' found in channel {channel_id}")
\ No newline at end of file
+        async with self._dynamodb_table() as table:
+            async with table.batch_writer(overwrite_by_pkeys=["channel_id", "timestamp"]) as batch:
+                for item in items:
+                    await batch.delete_item(Key={
+                        "channel_id": item.channel_id,
+                        "timestamp": self._to_dynamo_timestamp(item.timestamp_ms)
+                    })
+        self.logger.debug(f"_delete_persisted_items deleted {len(items)} items")
@@ -0,0 +1,95 @@
+import struct
+from mmap import mmap
+from typing import Iterator, Union
+
+from IHistoryManager import HistoryItem
+
+
+ReadableBuffer = Union[bytes, memoryview, mmap]
+
+
+class HistoryRecordCodec:
+    """Compact, length-prefixed binary encoding of HistoryItems.
+
+    Each record is a fixed header followed by the utf-8 encoded name, token model and content:
+        record_len (uint32, bytes following this field), timestamp (int64, milliseconds),
+        id (uint64), channel_id (uint64), token_count (int32, -1 if not counted),
+        name_len (uint16), token_model_len (uint16), content_len (uint32)
+    """
+    HEADER = struct.Struct("<IqQQiHHI")
+    LENGTH = struct.Struct("<I")
+
+
+    @classmethod
+    def encode(cls, item: HistoryItem) -> bytes:
+        """Encode a single history item as a record"""
+        name = item.name.encode("utf-8")
+        token_model = item.token_model.encode("utf-8")
+        content = item.content.encode("utf-8")
+        record_len = cls.HEADER.size - cls.LENGTH.size + len(name) + len(token_model) + len(content)
+        header = cls.HEADER.pack(
+            record_len,
+            item.timestamp_ms,
+            item.id,
+            item.channel_id,
+            item.token_count if item.token_count is not None else -1,
+            len(name),
+            len(token_model),
+            len(content)
+        )
+        return b"".join((header, name, token_model, content))
+
+
+    @classmethod
+    def encode_all(cls, items: list[HistoryItem]) -> bytes:
+        """Encode several history items as consecutive records"""
+        return b"".join(cls.encode(item) for item in items)
+
+
+    @classmethod
+    def decode(cls, buffer: ReadableBuffer, offset: int = 0) -> tuple[HistoryItem, int]:
+        """Decode the record starting at offset.
+
+        Returns:
+            tuple: the decoded history item, and the offset of the next record
+        """
+        (record_len, timestamp_ms, id, channel_id, token_count,
+         name_len, token_model_len, content_len) = cls.HEADER.unpack_from(buffer, offset)
+        position = offset + cls.HEADER.size
+        name = bytes(buffer[position : position + name_len]).decode("utf-8")
+        position += name_len
+        token_model = bytes(buffer[position : position + token_model_len]).decode("utf-8")
+        position += token_model_len
+        content = bytes(buffer[position : position + content_len]).decode("utf-8")
+
+        item = HistoryItem(
+            timestamp_ms = timestamp_ms,
+            content = content,
+            name = name,
+            id = id,
+            channel_id = channel_id,
+            token_count = token_count if token_count >= 0 else None,
+            token_model = token_model
+        )
+        return item, offset + cls.LENGTH.size + record_len
+
+
+    @classmethod
+    def decode_all(cls, buffer: ReadableBuffer, offset: int = 0, end: int = -1) -> Iterator[HistoryItem]:
+        """Decode consecutive records from offset up to end (or the end of the buffer)"""
+        if end < 0:
+            end = len(buffer)
+        while offset < end:
+            item, offset = cls.decode(buffer, offset)
+            yield item
+
+
+    @classmethod
+    def peek_timestamp(cls, buffer: ReadableBuffer, offset: int) -> tuple[int, int]:
+        """Read only the timestamp of the record starting at offset, without decoding the rest.
+
+        Returns:
+            tuple: the record's timestamp in milliseconds, and the offset of the next record
+        """
+        record_len, timestamp_ms = struct.unpack_from("<Iq", buffer, offset)
+        return timestamp_ms, offset + cls.LENGTH.size + record_len
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import struct
+import time
+from typing import Callable, Optional
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryRecordCodec import HistoryRecordCodec
+
+
+class HistorySnapshot:
+    """Snapshots of every channel's in-memory history to one local file, restored on startup.
+
+    The file is a small header followed by the history items as HistoryRecordCodec records, token counts included,
+    so restored items don't need counting again. Each snapshot is written to a temporary file and renamed over
+    the previous one, so a crash part way through a write leaves the last complete snapshot in place.
+    Snapshots are taken every interval seconds in the background, and once more on close. The snapshot taken
+    on close is marked clean, since nothing can have been added to history after it.
+    """
+    MAGIC = b"PHSN"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBBq") #magic, version, clean (1 if taken on close), written at (ms since the epoch)
+
+
+    def __init__(self,
+                 path: str,
+                 collect: Callable[[], list[HistoryItem]],
+                 logger: ILogger,
+                 interval: float
+                ) -> None:
+        """
+        Args:
+            path: file to write snapshots to
+
+            collect: reference to a function that gathers every history item to snapshot, in chronological
+                        order within each channel. called on the event loop, so it sees a consistent state.
+
+            logger: reference to the active logger instance
+
+            interval: seconds between background snapshots
+        """
+        self.path = path
+        self.collect = collect
+        self.logger = logger
+        self.interval = interval
+
+        self._task: Optional[asyncio.Task[None]] = None
+        self._stop = asyncio.Event()
+        self._save_lock = asyncio.Lock()
+
+        self.snapshots = 0
+        self.failures = 0
+        self.items_restored = 0
+        self.last_items = 0
+        self.last_bytes = 0
+        self.last_snapshot_ms = 0.0
+        self.last_restore_ms = 0.0
+
+
+    def start(self) -> None:
+        """Start taking snapshots in the background, if not already started"""
+        if self._task is None and not self._stop.is_set():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+
+    def load(self) -> tuple[list[HistoryItem], bool]:
+        """Read the last snapshot written, blocking, so callers should run it in a thread.
+        A missing, unreadable or incompatible snapshot restores nothing.
+
+        Returns:
+            tuple: the snapshotted history items, and whether the snapshot was taken on a clean shutdown
+        """
+        start = time.perf_counter()
+        try:
+            with open(self.path, "rb") as snapshot_file:
+                buffer = snapshot_file.read()
+        except FileNotFoundError:
+            return [], False
+        try:
+            magic, version, clean, written_ms = self.HEADER.unpack_from(buffer)
+            if magic != self.MAGIC or version != self.VERSION:
+                self.logger.warning(f"HistorySnapshot ignored {self.path}, it isn't a version {self.VERSION} snapshot")
+                return [], False
+            items = list(HistoryRecordCodec.decode_all(buffer, self.HEADER.size))
+        except (struct.error, UnicodeDecodeError) as e:
+            self.logger.exception("HistorySnapshot failed to read {}, starting without it", e, self.path)
+            return [], False
+        self.items_restored = len(items)
+        self.last_restore_ms = (time.perf_counter() - start) * 1000
+        self.logger.info(
+            f"HistorySnapshot read {len(items)} items written at {written_ms} in {int(self.last_restore_ms)} ms")
+        return items, bool(clean)
+
+
+    async def save(self, clean: bool = False) -> bool:
+        """Take a snapshot now. The items are gathered on the event loop, then encoded and written in a thread.
+
+        Returns:
+            bool: True if the snapshot was written, False if it failed
+        """
+        async with self._save_lock:
+            items = self.collect()
+            start = time.perf_counter()
+            try:
+                self.last_bytes = await asyncio.to_thread(self._write, items, clean)
+            except Exception as e:
+                self.failures += 1
+                self.logger.exception("HistorySnapshot failed to write {} items", e, len(items))
+                return False
+            self.last_snapshot_ms = (time.perf_counter() - start) * 1000
+            self.last_items = len(items)
+            self.snapshots += 1
+            self.logger.debug(
+                f"HistorySnapshot wrote {len(items)} items, {self.last_bytes} bytes "
+                f"in {int(self.last_snapshot_ms)} ms")
+            return True
+
+
+    async def close(self) -> None:
+        """Stop the background snapshots and take a final, clean snapshot, called on shutdown"""
+        self._stop.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.save(clean=True)
+
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "snapshots": self.snapshots,
+            "failures": self.failures,
+            "items_restored": self.items_restored,
+            "last_items": self.last_items,
+            "last_bytes": self.last_bytes,
+            "last_snapshot_ms": self.last_snapshot_ms,
+            "last_restore_ms": self.last_restore_ms
+        }
+
+
+    async def _run(self) -> None:
+        """Background task which takes a snapshot every interval, until closed"""
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._stop.is_set():
+                await self.save()
+
+
+    def _write(self, items: list[HistoryItem], clean: bool) -> int:
+        """Write a snapshot, replacing the previous file in one step so a crash can't leave it partial.
+
+        Returns:
+            int: the size of the snapshot in bytes
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, int(clean), int(time.time() * 1000))
+        body = HistoryRecordCodec.encode_all(items)
+        with open(self.path + ".tmp", "wb") as snapshot_file:
+            snapshot_file.write(header)
+            snapshot_file.write(body)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        return len(header) + len(body)
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+
+
+class HistorySummarizer:
+    """Rolling summaries of the history trimmed from each channel's context.
+
+    Trimmed items are queued per channel, and once a channel has min_batch of them queued,
+    a background task folds them into the channel's summary with the summarize coroutine,
+    off the request path. Summaries are bounded to max_tokens by the summarize coroutine itself.
+    Each summary is cached in memory and persisted as a small json file under summary_dir,
+    along with the timestamp of the newest item it covers, so items are never folded in twice.
+    A channel whose items fail to summarize MAX_ATTEMPTS times in a row has them dropped, so its queue can't grow
+    without bound while the summarize coroutine keeps failing.
+    """
+    MAX_ATTEMPTS = 3
+
+
+    def __init__(self,
+                 summarize: Callable[[str, list[HistoryItem], int], Awaitable[str]],
+                 summary_dir: str,
+                 logger: ILogger,
+                 max_tokens: int,
+                 min_batch: int
+                ) -> None:
+        """
+        Args:
+            summarize: reference to an async coroutine that folds history items into a summary,
+                        given the summary so far, the items and the maximum tokens the new summary may use
+
+            summary_dir: directory to persist summaries in, one file per channel
+
+            logger: reference to the active logger instance
+
+            max_tokens: the most tokens a summary may use in the prompt
+
+            min_batch: how many trimmed items a channel queues before they are summarized
+        """
+        self.summarize = summarize
+        self.summary_dir = summary_dir
+        self.logger = logger
+        self.max_tokens = max_tokens
+        self.min_batch = min_batch
+
+        self._summaries: dict[int, tuple[str, int]] = {} #channel id -> (summary, newest timestamp_ms covered)
+        self._pending: dict[int, list[HistoryItem]] = {}
+        self._failed_attempts: dict[int, int] = {} #channel id to its summarize calls failed in a row
+        self._summarize_task: Optional[asyncio.Task[None]] = None
+
+        self.summaries_updated = 0
+        self.items_summarized = 0
+        self.failures = 0
+        self.items_lost = 0
+        self.last_summary_ms = 0.0
+
+
+    def add_items(self, items: list[HistoryItem]) -> None:
+        """Queue items trimmed from context to be folded into their channel's summary"""
+        for item in items:
+            self._pending.setdefault(item.channel_id, []).append(item)
+        if (any(len(pending) >= self.min_batch for pending in self._pending.values())
+                and (self._summarize_task is None or self._summarize_task.done())):
+            self._summarize_task = asyncio.get_running_loop().create_task(self._summarize_pending(self.min_batch))
+
+
+    async def get_summary(self, channel_id: int) -> str:
+        """Get the summary of a channel's trimmed history, empty if nothing has been summarized yet"""
+        summary, _ = await self._get_summary(channel_id)
+        return summary
+
+
+    async def close(self) -> None:
+        """Summarize everything still queued and wait for it, called on shutdown.
+        Items which still can't be summarized are counted as lost."""
+        if self._summarize_task:
+            await self._summarize_task
+        await self._summarize_pending(1)
+        lost = sum(len(pending) for pending in self._pending.values())
+        if lost:
+            self.items_lost += lost
+            self.logger.error(f"HistorySummarizer lost {lost} unsummarized items on close")
+            self._pending.clear()
+
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "pending": sum(len(pending) for pending in self._pending.values()),
+            "summaries_updated": self.summaries_updated,
+            "items_summarized": self.items_summarized,
+            "failures": self.failures,
+            "items_lost": self.items_lost,
+            "last_summary_ms": self.last_summary_ms
+        }
+
+
+    async def _summarize_pending(self, min_batch: int) -> None:
+        """Fold queued items into their channels' summaries, for each channel with at least min_batch queued.
+        Items that fail to summarize are requeued, and their channel is retried on a later call."""
+        failed: set[int] = set()
+        while True:
+            channel_id = next((channel_id for channel_id, pending in self._pending.items()
+                               if len(pending) >= min_batch and channel_id not in failed), None)
+            if channel_id is None:
+                return
+            items = self._pending.pop(channel_id)
+            summary, covered_ms = await self._get_summary(channel_id)
+            items = [item for item in items if item.timestamp_ms > covered_ms]
+            if not items:
+                continue
+
+            start = time.perf_counter()
+            try:
+                new_summary = (await self.summarize(summary, items, self.max_tokens)).strip()
+                if not new_summary:
+                    raise ValueError("the summary came back empty")
+                summary = new_summary
+            except Exception as e:
+                self.failures += 1
+                failed.add(channel_id)
+                attempts = self._failed_attempts.get(channel_id, 0) + 1
+                if attempts >= self.MAX_ATTEMPTS:
+                    self._failed_attempts.pop(channel_id, None)
+                    self.items_lost += len(items)
+                    self.logger.exception(
+                        "HistorySummarizer failed to summarize {} items for channel {} {} times, dropping them",
+                        e, len(items), channel_id, attempts)
+                    continue
+                self._failed_attempts[channel_id] = attempts
+                self.logger.exception(
+                    "HistorySummarizer failed to summarize {} items for channel {}, they will be retried",
+                    e, len(items), channel_id)
+                self._pending[channel_id] = items + self._pending.get(channel_id, [])
+                continue
+            self._failed_attempts.pop(channel_id, None)
+            self.last_summary_ms = (time.perf_counter() - start) * 1000
+            covered_ms = max(item.timestamp_ms for item in items)
+            self._summaries[channel_id] = (summary, covered_ms)
+            await asyncio.to_thread(self._save, channel_id, summary, covered_ms)
+            self.summaries_updated += 1
+            self.items_summarized += len(items)
+            self.logger.debug(f"HistorySummarizer folded {len(items)} items into the summary for channel {channel_id}")
+
+
+    async def _get_summary(self, channel_id: int) -> tuple[str, int]:
+        """Get a channel's summary and the newest timestamp it covers, loading it from disk on first use"""
+        if channel_id not in self._summaries:
+            loaded = await asyncio.to_thread(self._load, channel_id)
+            self._summaries.setdefault(channel_id, loaded)
+        return self._summaries[channel_id]
+
+
+    def _load(self, channel_id: int) -> tuple[str, int]:
+        path = self._channel_path(channel_id)
+        if not os.path.exists(path):
+            return "", 0
+        with open(path, encoding="utf-8") as summary_file:
+            record = json.load(summary_file)
+        return record["summary"], record["covered_ms"]
+
+
+    def _save(self, channel_id: int, summary: str, covered_ms: int) -> None:
+        """Write a channel's summary, replacing the previous file in one step so a crash can't leave it partial"""
+        os.makedirs(self.summary_dir, exist_ok=True)
+        path = self._channel_path(channel_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as summary_file:
+            json.dump({"summary": summary, "covered_ms": covered_ms}, summary_file)
+        os.replace(path + ".tmp", path)
+
+
+    def _channel_path(self, channel_id: int) -> str:
+        return os.path.join(self.summary_dir, f"{channel_id}.json")
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import struct
+import time
+from decimal import Decimal
+from typing import Any, AsyncIterator, Optional, Union
+
+from ILogger import ILogger
+from IHistoryManager import IHistoryManager, HistoryItem
+from HistoryRecordCodec import HistoryRecordCodec
+
+
+class HistoryExportDirectory:
+    """A directory of exported history, with one part file per scan segment of the store it was exported from.
+
+    Each part is a small header followed by HistoryRecordCodec records, token counts included, so imported items
+    don't need counting again. Parts keep each channel's items together in chronological order, as scanned,
+    and are read back one part per scan segment, a page of records at a time.
+    """
+    MAGIC = b"PHEX"
+    VERSION = 1
+    HEADER = struct.Struct("<4sB") #magic, version
+
+
+    def __init__(self, path: str, page_size: int) -> None:
+        """
+        Args:
+            path: the directory holding the part files, created on first write
+
+            page_size: the most records read per page
+        """
+        self.path = path
+        self.page_size = page_size
+
+
+    def _part_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"part-{segment:05d}.bin")
+
+
+    @property
+    def total_segments(self) -> int:
+        """The number of part files in the directory, which a scan of it must use as its total segments"""
+        if not os.path.isdir(self.path):
+            return 0
+        return len([name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".bin")])
+
+
+    async def scan(self, segment: int, total_segments: int, start_key: Optional[dict[str, Any]] = None
+                   ) -> AsyncIterator[tuple[list[HistoryItem], Optional[dict[str, Any]]]]:
+        """Stream the items in one part file, a page at a time.
+        Yields each page with the key to resume after it, the offset of the next record, or None after the last."""
+        if total_segments != self.total_segments:
+            raise ValueError(f"{self.path} has {self.total_segments} parts, it can't be scanned as {total_segments}")
+        offset = int(start_key["offset"]) if start_key else self.HEADER.size
+        while True:
+            page, offset, more = await asyncio.to_thread(self._read_page, segment, offset)
+            yield page, {"offset": offset} if more else None
+            if not more:
+                return
+
+
+    def _read_page(self, segment: int, offset: int) -> tuple[list[HistoryItem], int, bool]:
+        """Read a page of records from a part file, starting at offset.
+
+        Returns:
+            tuple: the items read, the offset of the next record, and whether there are more records
+        """
+        items: list[HistoryItem] = []
+        with open(self._part_path(segment), "rb") as part_file:
+            magic, version = self.HEADER.unpack(part_file.read(self.HEADER.size))
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError(f"{self._part_path(segment)} is not a version {self.VERSION} history export")
+            part_file.seek(offset)
+            while len(items) < self.page_size:
+                length = part_file.read(HistoryRecordCodec.LENGTH.size)
+                if not length:
+                    break
+                record_len, = HistoryRecordCodec.LENGTH.unpack(length)
+                item, _ = HistoryRecordCodec.decode(length + part_file.read(record_len))
+                items.append(item)
+                offset += len(length) + record_len
+            more = part_file.read(1) != b""
+        return items, offset, more
+
+
+    async def write(self, segment: int, items: list[HistoryItem]) -> None:
+        """Append items to a part file, creating it if needed"""
+        await asyncio.to_thread(self._append, segment, HistoryRecordCodec.encode_all(items))
+
+
+    def _append(self, segment: int, data: bytes) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        path = self._part_path(segment)
+        with open(path, "ab") as part_file:
+            if part_file.tell() == 0:
+                part_file.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+            part_file.write(data)
+
+
+    def size(self, segment: int) -> int:
+        """The size of a part file, 0 if not yet written"""
+        path = self._part_path(segment)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+    def truncate(self, segment: int, size: int) -> None:
+        """Cut a part file back to a given size, e.g. the size checkpointed before a transfer was interrupted,
+        removing it if nothing had been checkpointed"""
+        path = self._part_path(segment)
+        if not os.path.exists(path):
+            return
+        if size:
+            os.truncate(path, size)
+        else:
+            os.remove(path)
+
+
+class HistoryTransfer:
+    """Streams persisted history from one store to another: a history manager's backend, or an export directory.
+
+    The source is scanned in total_segments parallel parts, one worker each, and every page read is written
+    to the target before the next is read, so memory is bounded by a page per worker.
+    After each page, the worker's resume key is saved to a checkpoint file, and a transfer rerun with the same
+    checkpoint resumes each part from there. Export directories are cut back to their checkpointed sizes first.
+    Backends replace items stored under the same key, so the page that was in flight is just written again,
+    except that the segment backend can repeat that page's items if it had sealed a segment part way through.
+    Throughput is logged every report_interval seconds, and returned at the end.
+    """
+
+    def __init__(self,
+                 source: Union[IHistoryManager, HistoryExportDirectory],
+                 target: Union[IHistoryManager, HistoryExportDirectory],
+                 description: str,
+                 total_segments: int,
+                 checkpoint_path: str,
+                 logger: ILogger,
+                 report_interval: float = 10.0
+                 ) -> None:
+        """
+        Args:
+            source: the store to read history from
+
+            target: the store to write history to
+
+            description: names the source and target, to refuse resuming a checkpoint from a different transfer
+
+            total_segments: the number of parts to scan the source in, as parallel workers
+
+            checkpoint_path: the file to checkpoint progress to, and resume from if it exists
+
+            logger: reference to the active logger instance
+
+            report_interval: seconds between throughput reports
+        """
+        self.source = source
+        self.target = target
+        self.description = description
+        self.total_segments = total_segments
+        self.checkpoint_path = checkpoint_path
+        self.logger = logger
+        self.report_interval = report_interval
+
+        self._segments: dict[int, dict[str, Any]] = {}
+        self._checkpoint_lock = asyncio.Lock()
+        self._items = 0
+        self._content_bytes = 0
+        self._pages = 0
+
+
+    async def run(self) -> dict[str, float]:
+        """Transfer everything not already transferred by an earlier run with the same checkpoint.
+
+        Returns:
+            dict: the items, pages and content bytes transferred by this run, seconds taken,
+                    items and content megabytes per second, and the items transferred in total
+        """
+        self._load_checkpoint()
+        pending = [segment for segment, state in self._segments.items() if not state["done"]]
+        if isinstance(self.target, HistoryExportDirectory):
+            for segment in pending:
+                self.target.truncate(segment, self._segments[segment]["target_size"])
+
+        start = time.perf_counter()
+        reporter = asyncio.get_running_loop().create_task(self._report(start))
+        try:
+            await asyncio.gather(*(self._transfer_segment(segment) for segment in pending))
+        finally:
+            reporter.cancel()
+        seconds = time.perf_counter() - start
+        stats = {
+            "items": self._items,
+            "pages": self._pages,
+            "content_bytes": self._content_bytes,
+            "seconds": seconds,
+            "items_per_second": self._items / seconds if seconds else 0.0,
+            "content_mb_per_second": self._content_bytes / 1024 / 1024 / seconds if seconds else 0.0,
+            "total_items": sum(state["items"] for state in self._segments.values())
+        }
+        self.logger.info(
+            f"HistoryTransfer {self.description} moved {self._items} items in {seconds:.1f}s, "
+            f"{stats['items_per_second']:.0f} items/s, {stats['content_mb_per_second']:.1f} MB/s of content, "
+            f"{int(stats['total_items'])} items transferred in total")
+        return stats
+
+
+    async def _transfer_segment(self, segment: int) -> None:
+        """Copy one part of the source to the target, page by page, checkpointing after each page"""
+        state = self._segments[segment]
+        start_key = state["start_key"]
+        if isinstance(self.target, HistoryExportDirectory) and not state["target_size"]:
+            #every part is written, even if empty, as a scan of the export needs them all
+            await self.target.write(segment, [])
+        pages = (self.source.scan(segment, self.total_segments, start_key)
+                 if isinstance(self.source, HistoryExportDirectory)
+                 else self.source.scan_persisted_history(segment, self.total_segments, start_key))
+        async for items, resume_key in pages:
+            if items:
+                if isinstance(self.target, HistoryExportDirectory):
+                    await self.target.write(segment, items)
+                else:
+                    await self.target.import_history_items(items)
+            state["start_key"] = resume_key
+            state["done"] = resume_key is None
+            state["items"] += len(items)
+            if isinstance(self.target, HistoryExportDirectory):
+                state["target_size"] = self.target.size(segment)
+            self._items += len(items)
+            self._pages += 1
+            self._content_bytes += sum(len(item.content) for item in items)
+            await self._save_checkpoint()
+
+
+    def _load_checkpoint(self) -> None:
+        """Load progress from the checkpoint file, or start every segment from the beginning if there isn't one"""
+        self._segments = {segment: {"start_key": None, "done": False, "items": 0, "target_size": 0}
+                          for segment in range(self.total_segments)}
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "r") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint["description"] != self.description or checkpoint["total_segments"] != self.total_segments:
+            raise ValueError(f"{self.checkpoint_path} is the checkpoint of another transfer, "
+                             f"{checkpoint['description']} in {checkpoint['total_segments']} segments")
+        for segment, state in checkpoint["segments"].items():
+            #key values are stored as strings, and dynamodb keys are all numbers, read back as Decimal
+            if state["start_key"]:
+                state["start_key"] = {name: Decimal(value) for name, value in state["start_key"].items()}
+            self._segments[int(segment)] = state
+        self.logger.info(
+            f"HistoryTransfer resuming from {self.checkpoint_path}, "
+            f"{sum(state['done'] for state in self._segments.values())} of {self.total_segments} segments done")
+
+
+    async def _save_checkpoint(self) -> None:
+        """Write progress to the checkpoint file, via a temporary file so an interrupted write keeps the last one"""
+        checkpoint = {
+            "description": self.description,
+            "total_segments": self.total_segments,
+            "segments": {
+                str(segment): {**state, "start_key": {name: str(value) for name, value in state["start_key"].items()}
+                               if state["start_key"] else None}
+                for segment, state in self._segments.items()
+            }
+        }
+        async with self._checkpoint_lock:
+            await asyncio.to_thread(self._write_checkpoint, json.dumps(checkpoint))
+
+
+    def _write_checkpoint(self, data: str) -> None:
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            checkpoint_file.write(data)
+        os.replace(temp_path, self.checkpoint_path)
+
+
+    async def _report(self, start: float) -> None:
+        """Log throughput every report_interval seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            seconds = time.perf_counter() - start
+            done = sum(state["done"] for state in self._segments.values())
+            self.logger.info(
+                f"HistoryTransfer {self.description}: {self._items} items in {seconds:.0f}s, "
+                f"{self._items / seconds:.0f} items/s, {done} of {self.total_segments} segments done")
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+
+
+class HistoryWriteBuffer:
+    """Write-behind buffer for persisting history items in batches.
+
+    Items are queued in memory and handed to flush_items in a single batch once
+    the buffer reaches max_batch_size, once the oldest queued item is max_age seconds old,
+    or when the buffer is closed.
+    If flushing falls behind and max_pending items are queued, add() waits for a flush
+    to complete before accepting more.
+    """
+
+    def __init__(self,
+                 flush_items: Callable[[list[HistoryItem]], Awaitable[None]],
+                 logger: ILogger,
+                 max_batch_size: int,
+                 max_age: float,
+                 max_pending: int
+                ) -> None:
+        """
+        Args:
+            flush_items: reference to an async coroutine that persists a batch of history items
+
+            logger: reference to the active logger instance
+
+            max_batch_size: flush as soon as this many items are queued
+
+            max_age: flush once the oldest queued item has waited this many seconds
+
+            max_pending: apply back-pressure to add() once this many items are queued
+        """
+        self.flush_items = flush_items
+        self.logger = logger
+        self.max_batch_size = max_batch_size
+        self.max_age = max_age
+        self.max_pending = max_pending
+
+        self._pending: list[HistoryItem] = []
+        self._in_flight: list[HistoryItem] = [] #the batch currently being flushed
+        self._oldest_time: Optional[float] = None #monotonic time the oldest pending item was queued
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._flusher: Optional[asyncio.Task[None]] = None
+        self._closed = False
+        self._stop = asyncio.Event() #set on close, ends the flusher's back-off after a failed flush
+
+        self.flushes = 0
+        self.items_flushed = 0
+        self.flush_failures = 0
+        self.backpressure_waits = 0
+        self.items_lost = 0
+        self.last_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+
+    async def add(self, item: HistoryItem) -> None:
+        """Queue a history item to be persisted by a later flush"""
+        while len(self._pending) >= self.max_pending:
+            self.backpressure_waits += 1
+            self.logger.warning(
+                f"HistoryWriteBuffer has {len(self._pending)} unflushed items, waiting for a flush")
+            if not await self.flush():
+                await asyncio.sleep(self.max_age)
+
+        self._pending.append(item)
+        if self._oldest_time is None:
+            self._oldest_time = time.monotonic()
+            self._wake.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._wake.set()
+        self._ensure_flusher()
+
+
+    def discard(self, items: Iterable[HistoryItem]) -> None:
+        """Drop any of the given items which are still waiting to be flushed,
+        e.g. items trimmed from history before they were ever persisted"""
+        ids = {item.id for item in items}
+        self._pending = [item for item in self._pending if item.id not in ids]
+        if not self._pending:
+            self._oldest_time = None
+
+
+    def pending(self, channel_id: int) -> list[HistoryItem]:
+        """Get the items for a channel which are queued or being flushed, i.e. not yet known to be persisted"""
+        return [item for item in self._in_flight + self._pending if item.channel_id == channel_id]
+
+
+    async def flush(self) -> bool:
+        """Persist everything currently queued.
+
+        Returns:
+            bool: True if the flush succeeded, False if it failed and the items were requeued
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            batch = self._pending
+            self._pending = []
+            self._oldest_time = None
+            self._in_flight = batch
+
+            start = time.perf_counter()
+            try:
+                await self.flush_items(batch)
+            except Exception as e:
+                self.flush_failures += 1
+                self.logger.exception(
+                    "HistoryWriteBuffer failed to flush {} items, they will be retried", e, len(batch))
+                self._pending = batch + self._pending
+                self._oldest_time = time.monotonic()
+                return False
+            finally:
+                self._in_flight = []
+
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self._total_flush_ms += self.last_flush_ms
+            self.flushes += 1
+            self.items_flushed += len(batch)
+            self.logger.debug(
+                f"HistoryWriteBuffer flushed {len(batch)} items in {int(self.last_flush_ms)} ms")
+            return True
+
+
+    async def close(self) -> None:
+        """Stop the background flusher and flush anything still queued.
+        Items which still can't be flushed are counted as lost."""
+        self._closed = True
+        if self._flusher:
+            #woken to stop rather than cancelled, so a flush in progress finishes instead of dropping its batch
+            self._stop.set()
+            self._wake.set()
+            await self._flusher
+            self._flusher = None
+
+        if not await self.flush():
+            self.items_lost += len(self._pending)
+            self.logger.error(
+                f"HistoryWriteBuffer lost {len(self._pending)} unflushed items on close")
+            self._pending = []
+            self._oldest_time = None
+
+
+    def stats(self) -> dict[str, float]:
+        """Get counters describing the buffer's activity.
+        depth is the number of items that would be lost if the process crashed right now."""
+        return {
+            "depth": len(self._pending),
+            "flushes": self.flushes,
+            "items_flushed": self.items_flushed,
+            "flush_failures": self.flush_failures,
+            "last_flush_ms": self.last_flush_ms,
+            "avg_flush_ms": self._total_flush_ms / self.flushes if self.flushes else 0.0,
+            "backpressure_waits": self.backpressure_waits,
+            "items_lost": self.items_lost
+        }
+
+
+    def _ensure_flusher(self) -> None:
+        """Start the background flusher task if it isn't already running"""
+        if not self._closed and (self._flusher is None or self._flusher.done()):
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+
+
+    async def _run_flusher(self) -> None:
+        """Background task which flushes the buffer when it is full or its oldest item is too old"""
+        while not self._closed:
+            timeout = None
+            if self._oldest_time is not None:
+                timeout = max(0.0, self._oldest_time + self.max_age - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            if not self._pending:
+                continue
+            too_old = (self._oldest_time is not None
+                       and time.monotonic() - self._oldest_time >= self.max_age)
+            if len(self._pending) >= self.max_batch_size or too_old:
+                if not await self.flush():
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), self.max_age)
+                    except asyncio.TimeoutError:
+                        pass
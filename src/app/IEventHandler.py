@@ -8,4 +8,10 @@ class IEventHandler(ABC):
     @abstractmethod
     async def on_message(self, message: Message) -> None:
         """Handle received messages"""
+        pass
+
+
+    @abstractmethod
+    async def normalize_message(self, message: Message) -> None:
+        """Rewrite a user message's content the way it is kept in conversation history"""
         pass
\ No newline at end of file
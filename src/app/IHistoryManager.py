@@ -1,20 +1,66 @@
+import sys
 from abc import ABC, abstractmethod
-from collections import deque
-from typing import Callable, Awaitable
-from attr import dataclass
-from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Awaitable, Iterator, Optional, Sequence, Union, overload
+from attr import dataclass, ib
 
 from ILogger import ILogger
 from IConfigManager import IConfigManager
 
 
-@dataclass
+@dataclass(slots=True)
 class HistoryItem:
-    timestamp: Decimal
+    """A message in a channel's history.
+    Slotted, with an integer timestamp, to keep the memory of each held item small.
+    Author names and tokenizer ids repeat across many items, so they are interned to share one string."""
+    timestamp_ms: int #message creation time, in milliseconds since the epoch
     content: str
-    name: str
+    name: str = ib(converter=sys.intern)
     id: int
     channel_id: int
+    token_count: Optional[int] = None #prompt tokens used by this item, counted once when it is added
+    token_model: str = ib(default="", converter=sys.intern) #identity of the tokenizer/model that produced token_count
+
+
+class HistoryView(Sequence[HistoryItem]):
+    """An immutable view of a channel's history as it was when the view was taken.
+    Views share the list of items the history is stored in, as a start and end offset into it,
+    so taking one is O(1), and appends and trims made to the history afterwards don't change the view."""
+    __slots__ = ("_items", "_start", "_end")
+
+    def __init__(self, items: list[HistoryItem], start: int = 0, end: Optional[int] = None) -> None:
+        self._items = items
+        self._start = start
+        self._end = len(items) if end is None else end
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @overload
+    def __getitem__(self, index: int) -> HistoryItem: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[HistoryItem]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[HistoryItem, Sequence[HistoryItem]]:
+        positions = range(self._start, self._end)[index]
+        if isinstance(positions, int):
+            return self._items[positions]
+        if positions.step == 1:
+            return HistoryView(self._items, positions.start, positions.stop)
+        return [self._items[position] for position in positions]
+
+    def __iter__(self) -> Iterator[HistoryItem]:
+        items = self._items
+        for position in range(self._start, self._end):
+            yield items[position]
+
+    def __reversed__(self) -> Iterator[HistoryItem]:
+        items = self._items
+        for position in range(self._end - 1, self._start - 1, -1):
+            yield items[position]
+
+    def __repr__(self) -> str:
+        return f"HistoryView({list(self)!r})"
 
 
 class IHistoryManager(ABC):
@@ -26,7 +72,9 @@ class IHistoryManager(ABC):
                  format_msg: Callable[[HistoryItem], str], 
                  max_history_len: int, 
                  logger: ILogger, 
-                 config_manager: IConfigManager
+                 config_manager: IConfigManager,
+                 tokenizer_id: str = "",
+                 summarize: Optional[Callable[[str, list[HistoryItem], int], Awaitable[str]]] = None
                 ) -> None:
         """
         Args:
@@ -44,13 +92,36 @@ class IHistoryManager(ABC):
             logger: reference to the active logger instance
 
             config_manager: reference to the active config manager instance
+
+            tokenizer_id: identifies the tokenizer/model behind count_tokens.
+                        stored alongside persisted token counts, so they can be trusted when reloaded
+                        with the same tokenizer, and recounted when the model has changed.
+
+            summarize: reference to an async coroutine that folds history items into a rolling summary,
+                        given the summary so far, the items and the maximum tokens the new summary may use.
         """
         pass
 
 
     @abstractmethod
-    async def get_history(self, channel_id: int) -> deque[HistoryItem]:
-        """Retrieve the history for a given channel ID"""
+    async def get_history(self, channel_id: int) -> HistoryView:
+        """Retrieve the history for a given channel ID, as an immutable view which 
+        later appends and trims to the channel's history don't change"""
+        pass
+
+
+    @abstractmethod
+    async def get_context(self, channel_id: int, reply_id: Optional[int] = None) -> Sequence[HistoryItem]:
+        """Retrieve the history items for a given channel ID to put in a prompt, in chronological order,
+        favouring the messages leading to reply_id if they don't all fit.
+        The whole history is returned as a HistoryView, like get_history, and a selection from it as a list,
+        so callers can tell which they were given without reading the history again"""
+        pass
+
+
+    @abstractmethod
+    async def is_duplicate(self, channel_id: int, message_id: int) -> bool:
+        """Check if a message has already been added to the history for a given channel ID"""
         pass
 
 
@@ -60,10 +131,77 @@ class IHistoryManager(ABC):
         pass
 
 
+    @abstractmethod
+    async def add_history_items(self, channel_id: int, items: list[HistoryItem]) -> None:
+        """Add a batch of items to the history for a given channel ID, in timestamp order,
+        including items older than those already in its history"""
+        pass
+
+
     @abstractmethod
     async def clear_history(self, channel_id: int) -> None:
         """Clear the history for a given channel ID"""
         pass
 
 
+    @abstractmethod
+    async def get_archived_history(self, channel_id: int, start_ms: int, end_ms: int) -> list[HistoryItem]:
+        """Retrieve history items trimmed from a given channel ID, 
+        with timestamps between start_ms and end_ms inclusive"""
+        pass
+
+
+    @abstractmethod
+    async def retrieve(self, channel_id: int, query: str) -> list[HistoryItem]:
+        """Retrieve history items trimmed from a given channel ID which are relevant to a query,
+        in chronological order"""
+        pass
+
+
+    @abstractmethod
+    async def get_summary(self, channel_id: int) -> str:
+        """Get the rolling summary of the history trimmed from a given channel ID, empty if there is none"""
+        pass
+
+
+    @abstractmethod
+    async def warm_up(self, channel_ids: list[int]) -> dict[int, float]:
+        """Load the histories of the given channel IDs ahead of their first message, e.g. at startup.
+        Channels are started in the given order, so callers should put the most active first.
+
+        Returns:
+            dict: milliseconds taken to warm up each channel loaded
+        """
+        pass
+
+
+    @abstractmethod
+    def scan_persisted_history(self, segment: int, total_segments: int, start_key: Optional[dict[str, Any]] = None
+                               ) -> AsyncIterator[tuple[list[HistoryItem], Optional[dict[str, Any]]]]:
+        """Stream every persisted history item, a page at a time, e.g. to export or migrate it.
+        The items are split into total_segments disjoint parts, which can be scanned in parallel.
+        Each channel's items are all in one part, in chronological order.
+        Yields each page with the key to resume the scan after it, or None after the last page."""
+        pass
+
+
+    @abstractmethod
+    async def import_history_items(self, items: list[HistoryItem]) -> None:
+        """Persist a batch of history items as they are, token counts included, e.g. from an export.
+        Items aren't added to the in-memory history, and replace any already stored under the same key."""
+        pass
+
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Release resources and persist anything outstanding, called on shutdown"""
+        pass
+
+
+    @abstractmethod
+    def get_stats(self) -> dict[str, float]:
+        """Get counters describing the history manager's activity"""
+        pass
+
+
 
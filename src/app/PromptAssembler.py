@@ -0,0 +1,115 @@
+import operator
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Callable, NamedTuple, Optional, Sequence
+
+from IHistoryManager import HistoryItem
+
+
+class RenderedHistory(NamedTuple):
+    """A channel's history as last rendered"""
+    items: deque[HistoryItem]
+    lines: deque[str]   #each item's line, in the same order
+
+
+class PromptAssembler:
+    """Renders history items into the lines of a prompt, rendering each item's line only once.
+
+    Lines are cached by item id, so the line rendered when an item's tokens are counted is reused for every prompt
+    it appears in, and re-rendered only if the item's content changes, e.g. when it is truncated.
+    Each channel's rendered lines are also kept, so the next render of that channel, usually the same history
+    with the oldest items trimmed and a few new ones appended, drops the trimmed lines and adds only the new ones.
+    The items kept are checked to be the very same ones, a quick pass over references with no lines rendered.
+    Any other history, e.g. a reply chain selected from the middle, is put together from cached lines.
+    Callers join the lines once, into the whole prompt, so prompt text is copied only the one time.
+    Token counts are cached on the items themselves by the history manager, so they aren't kept here.
+    """
+    DEFAULT_MAX_CACHED_LINES = 10000
+
+
+    def __init__(self, format_msg: Callable[[HistoryItem], str],
+                 max_cached_lines: int = DEFAULT_MAX_CACHED_LINES) -> None:
+        """
+        Args:
+            format_msg: reference to a function rendering a history item as its line of the prompt
+
+            max_cached_lines: the most lines cached, the least recently used are dropped beyond this
+        """
+        self.format_msg = format_msg
+        self.max_cached_lines = max_cached_lines
+        self._lines: OrderedDict[int, tuple[str, str]] = OrderedDict() #item id to its content and rendered line
+        self._channels: dict[int, RenderedHistory] = {}
+
+        self._lines_rendered = 0
+        self._line_cache_hits = 0
+        self._incremental_renders = 0
+        self._full_renders = 0
+
+
+    def line(self, item: HistoryItem) -> str:
+        """Get the rendered line for a history item, from the cache if it has been rendered before"""
+        cached = self._lines.get(item.id)
+        if cached is not None and cached[0] == item.content:
+            self._lines.move_to_end(item.id)
+            self._line_cache_hits += 1
+            return cached[1]
+        line = self.format_msg(item)
+        self._lines_rendered += 1
+        self._lines[item.id] = (item.content, line)
+        self._lines.move_to_end(item.id)
+        if len(self._lines) > self.max_cached_lines:
+            self._lines.popitem(last=False)
+        return line
+
+
+    def render(self, channel_id: int, history: Sequence[HistoryItem]) -> Sequence[str]:
+        """Render a channel's history as the lines of a prompt, one per item in order,
+        reusing as much of the channel's last render as still applies.
+        The lines returned are kept for the next render, to be joined into the prompt but not changed"""
+        previous = self._channels.get(channel_id)
+        start = self._reusable_start(previous, history) if previous else None
+        if previous and start is not None:
+            for _ in range(start):
+                previous.items.popleft()
+                previous.lines.popleft()
+            for item in history[len(previous.items):]:
+                previous.items.append(item)
+                previous.lines.append(self.line(item))
+            self._incremental_renders += 1
+            return previous.lines
+
+        rendered = RenderedHistory(deque(history), deque(self.line(item) for item in history))
+        self._channels[channel_id] = rendered
+        self._full_renders += 1
+        return rendered.lines
+
+
+    @staticmethod
+    def _reusable_start(previous: RenderedHistory, history: Sequence[HistoryItem]) -> Optional[int]:
+        """Find how many items were trimmed from the front of the previous render, if the new history
+        is the rest of it followed by any new items, otherwise None.
+        Every item kept is compared, as a selection, e.g. a reply chain, can share its first and last items
+        with the previous one but differ in between"""
+        if not history or not previous.items:
+            return None
+        first = history[0]
+        for start, item in enumerate(previous.items):
+            if item is first:
+                break
+        else:
+            return None
+        kept = len(previous.items) - start
+        if kept > len(history) or not all(map(operator.is_, islice(previous.items, start, None), history)):
+            return None
+        return start
+
+
+    def stats(self) -> dict[str, float]:
+        """Get counters describing the assembler's work"""
+        return {
+            "lines_rendered": self._lines_rendered,
+            "line_cache_hits": self._line_cache_hits,
+            "incremental_renders": self._incremental_renders,
+            "full_renders": self._full_renders,
+            "cached_lines": len(self._lines)
+        }
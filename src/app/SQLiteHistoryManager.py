@@ -0,0 +1,242 @@
+import asyncio
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar, Union
+
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+
+T = TypeVar("T")
+
+
+class SQLiteHistoryManager(HistoryManager):
+    """History manager persisting to an embedded SQLite database instead of dynamodb.
+
+    Caching, trimming, eviction and retrieval all work as in HistoryManager, only the persistence hooks differ.
+    The database runs in WAL mode, so reads never wait on a write, and commits skip the fsync of every
+    transaction. All statements run on one dedicated thread that owns the connection, off the event loop.
+    History is stored under a (channel_id, timestamp_ms, id) primary key, so loading the newest items
+    of a channel is a range read over the key, one page at a time.
+    """
+    DEFAULT_SQLITE_FILE = 'history.db'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            channel_id INTEGER NOT NULL,
+            timestamp_ms INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            content TEXT NOT NULL,
+            token_count INTEGER,
+            token_model TEXT NOT NULL DEFAULT '',
+            expires_at INTEGER,
+            PRIMARY KEY (channel_id, timestamp_ms, id)
+        ) WITHOUT ROWID
+    """
+    COLUMNS = "channel_id, timestamp_ms, id, name, content, token_count, token_model, expires_at"
+
+
+    def _open_persistence(self) -> None:
+        """Set up the persistence backend, a SQLite database and the thread that owns its connection.
+        The database is opened on that thread when first used."""
+        try:
+            self._sqlite_path = (self.config_manager.get_parameter("HISTORY_SQLITE_PATH")
+                                 or os.path.join(self._data_dir, self.DEFAULT_SQLITE_FILE))
+        except Exception as e:
+            self.logger.exception("SQLiteHistoryManager encounted an unexpected exception loading config values", e)
+            raise
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-sqlite")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._sqlite_reads = 0
+        self._sqlite_writes = 0
+        self._sqlite_rows_written = 0
+        self._last_write_ms = 0.0
+        self._total_write_ms = 0.0
+
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a function on the database thread, with the connection as its first argument"""
+        def with_connection() -> T:
+            return func(self._connect(), *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, with_connection)
+
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get the connection, opening the database on first use. Only called on the database thread.
+        Rows past their TTL are purged on open, reads skip any that expire while running."""
+        if self._connection is None:
+            directory = os.path.dirname(self._sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self._sqlite_path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute(self.SCHEMA)
+                purged = connection.execute(
+                    "DELETE FROM history WHERE expires_at IS NOT NULL AND expires_at <= ?", (int(time.time()),)
+                ).rowcount
+            self.logger.debug(f"SQLiteHistoryManager opened {self._sqlite_path}, purged {purged} expired items")
+            self._connection = connection
+        return self._connection
+
+
+    def _item_to_row(self, item: HistoryItem) -> tuple[Any, ...]:
+        """Map a history item to a row of the history table, with its expiry if a TTL is configured"""
+        expires_at = int(time.time()) + self._ttl_seconds if self._ttl_seconds else None
+        return (item.channel_id, item.timestamp_ms, item.id, item.name, item.content,
+                item.token_count, item.token_model, expires_at)
+
+
+    @staticmethod
+    def _item_from_row(row: tuple[Any, ...]) -> HistoryItem:
+        """Map a row of the history table back to a history item"""
+        channel_id, timestamp_ms, id, name, content, token_count, token_model = row
+        return HistoryItem(timestamp_ms=timestamp_ms, content=content, name=name, id=id,
+                           channel_id=channel_id, token_count=token_count, token_model=token_model)
+
+
+    def _read_page(self, connection: sqlite3.Connection, channel_id: int,
+                   before: Optional[tuple[int, int]]) -> list[tuple[Any, ...]]:
+        """Read a page of a channel's rows, newest first, starting before a (timestamp_ms, id) key if given"""
+        query = ("SELECT channel_id, timestamp_ms, id, name, content, token_count, token_model FROM history "
+                 "WHERE channel_id = ? AND (expires_at IS NULL OR expires_at > ?)")
+        params: list[Any] = [channel_id, int(time.time())]
+        if before:
+            query += " AND (timestamp_ms, id) < (?, ?)"
+            params.extend(before)
+        query += " ORDER BY timestamp_ms DESC, id DESC LIMIT ?"
+        params.append(self._load_page_size)
+        return connection.execute(query, params).fetchall()
+
+
+    def _scan_page(self, connection: sqlite3.Connection, segment: int, total_segments: int,
+                   after: Optional[tuple[int, int, int]]) -> list[tuple[Any, ...]]:
+        """Read a page of the rows in one scan segment, the channels with channel_id % total_segments == segment,
+        in key order, starting after a (channel_id, timestamp_ms, id) key if given"""
+        query = ("SELECT channel_id, timestamp_ms, id, name, content, token_count, token_model FROM history "
+                 "WHERE channel_id % ? = ? AND (expires_at IS NULL OR expires_at > ?)")
+        params: list[Any] = [total_segments, segment, int(time.time())]
+        if after:
+            query += " AND (channel_id, timestamp_ms, id) > (?, ?, ?)"
+            params.extend(after)
+        query += " ORDER BY channel_id, timestamp_ms, id LIMIT ?"
+        params.append(self._load_page_size)
+        return connection.execute(query, params).fetchall()
+
+
+    def _write_rows(self, connection: sqlite3.Connection, rows: list[tuple[Any, ...]]) -> None:
+        """Insert or replace rows in one transaction"""
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO history ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+    def _delete_rows(self, connection: sqlite3.Connection, keys: list[tuple[int, int, int]]) -> None:
+        """Delete rows by (channel_id, timestamp_ms, id) in one transaction"""
+        with connection:
+            connection.executemany(
+                "DELETE FROM history WHERE channel_id = ? AND timestamp_ms = ? AND id = ?", keys)
+
+
+    async def _get_persisted_history(self, channel_id: int) -> deque[HistoryItem]:
+        """Retrieve persisted history for a given channel ID from the database.
+        As with dynamodb, pages are read newest first until the history token budget is met,
+        then reversed into chronological order."""
+        history_items: list[HistoryItem] = []
+        history_len = 0
+        before: Optional[tuple[int, int]] = None
+        budget_met = False
+        while not budget_met:
+            rows = await self._run(self._read_page, channel_id, before)
+            self._sqlite_reads += 1
+            page = [self._item_from_row(row) for row in rows]
+            await self._ensure_token_counts(page)
+            for item in page:
+                if history_len + (item.token_count or 0) > self._history_budget:
+                    budget_met = True
+                    break
+                history_items.append(item)
+                history_len += item.token_count or 0
+
+            if len(rows) < self._load_page_size:
+                break
+            before = (page[-1].timestamp_ms, page[-1].id)
+
+        self.logger.debug(
+            f"_get_persisted_history loaded {len(history_items)} items with {history_len} tokens "
+            f"for channel {channel_id}")
+        history_items.reverse()
+        return deque(history_items)
+
+
+    async def scan_persisted_history(self, segment: int, total_segments: int,
+                                     start_key: Optional[dict[str, Any]] = None
+                                     ) -> AsyncIterator[tuple[list[HistoryItem], Optional[dict[str, Any]]]]:
+        """Stream every persisted history item in one scan segment of the database, a page at a time.
+        Segments split channels by channel id, and each channel's items are read in key order."""
+        after = ((int(start_key["channel_id"]), int(start_key["timestamp_ms"]), int(start_key["id"]))
+                 if start_key else None)
+        while True:
+            rows = await self._run(self._scan_page, segment, total_segments, after)
+            self._sqlite_reads += 1
+            page = [self._item_from_row(row) for row in rows]
+            last_key = ({"channel_id": page[-1].channel_id, "timestamp_ms": page[-1].timestamp_ms, "id": page[-1].id}
+                        if len(rows) == self._load_page_size else None)
+            yield page, last_key
+            if not last_key:
+                return
+            after = (page[-1].channel_id, page[-1].timestamp_ms, page[-1].id)
+
+
+    async def _persist_history_item(self, item: HistoryItem) -> None:
+        """Persist a history item to the database"""
+        await self._persist_history_items([item])
+
+
+    async def _persist_history_items(self, items: list[HistoryItem]) -> None:
+        """Persist a batch of history items to the database in a single transaction.
+        Items with the same key as one already stored replace it, as with the dynamodb batch writer."""
+        if not items:
+            return
+        start = time.perf_counter()
+        await self._run(self._write_rows, [self._item_to_row(item) for item in items])
+        self._last_write_ms = (time.perf_counter() - start) * 1000
+        self._total_write_ms += self._last_write_ms
+        self._sqlite_writes += 1
+        self._sqlite_rows_written += len(items)
+
+
+    async def _delete_persisted_items(self, items: Union[HistoryItem, list[HistoryItem]]) -> None:
+        """Delete the given history item(s) from the database in a single transaction"""
+        if not isinstance(items, list):
+            items = [items]
+        await self._run(self._delete_rows, [(item.channel_id, item.timestamp_ms, item.id) for item in items])
+        self.logger.debug(f"_delete_persisted_items deleted {len(items)} items")
+
+
+    async def close(self) -> None:
+        """Flush anything not yet persisted, then close the database, called on shutdown"""
+        await super().close()
+        if self._persist:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._close_connection)
+            self._executor.shutdown(wait=True)
+
+
+    def _close_connection(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+    def _persistence_stats(self) -> dict[str, float]:
+        """Get counters describing the persistence backend, the SQLite database"""
+        return {
+            "sqlite_reads": self._sqlite_reads,
+            "sqlite_writes": self._sqlite_writes,
+            "sqlite_rows_written": self._sqlite_rows_written,
+            "sqlite_last_write_ms": self._last_write_ms,
+            "sqlite_avg_write_ms": self._total_write_ms / self._sqlite_writes if self._sqlite_writes else 0.0
+        }
@@ -0,0 +1,54 @@
+from collections import deque
+
+
+class SeenMessageIndex:
+    """Bounded index of recently seen message ids, kept per channel.
+
+    Each channel gets a ring buffer of the most recent `window` message ids,
+    plus a set mirroring the buffer for O(1) membership checks.
+    Once a channel's buffer is full, the oldest id is forgotten as each new one is recorded.
+    """
+
+    def __init__(self, window: int) -> None:
+        """
+        Args:
+            window: how many of the most recent message ids to remember per channel
+        """
+        self.window = window
+        self.duplicates_suppressed = 0
+        self._order: dict[int, deque[int]] = {}
+        self._seen: dict[int, set[int]] = {}
+
+
+    def contains(self, channel_id: int, message_id: int) -> bool:
+        """Check if a message id has recently been seen in a channel, without recording it"""
+        return message_id in self._seen.get(channel_id, ())
+
+
+    def check_and_record(self, channel_id: int, message_id: int) -> bool:
+        """Record a message id as seen in a channel.
+
+        Returns:
+            bool: True if the message id was already seen (i.e. this is a duplicate), otherwise False
+        """
+        seen = self._seen.setdefault(channel_id, set())
+        if message_id in seen:
+            self.duplicates_suppressed += 1
+            return True
+
+        order = self._order.setdefault(channel_id, deque())
+        if len(order) >= self.window:
+            seen.discard(order.popleft())
+        order.append(message_id)
+        seen.add(message_id)
+        return False
+
+
+    def forget(self, channel_id: int, message_id: int) -> None:
+        """Forget a recorded message id, e.g. when adding its message failed, so a redelivery isn't dropped"""
+        seen = self._seen.get(channel_id)
+        if seen is None or message_id not in seen:
+            return
+        seen.discard(message_id)
+        self._order[channel_id].remove(message_id)
+
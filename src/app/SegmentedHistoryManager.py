@@ -0,0 +1,329 @@
+import time
+import zlib
+from collections import deque
+from typing import Any, AsyncIterator, Optional, Union
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+from HistoryRecordCodec import HistoryRecordCodec
+
+
+class SegmentedHistoryManager(HistoryManager):
+    """History manager persisting to dynamodb with many messages packed into each dynamodb item.
+
+    Consecutive messages of a channel are packed into segments of up to HISTORY_SEGMENT_BYTES of encoded records,
+    stored zlib compressed in the segments table under (channel_id, segment), where segment is the timestamp
+    of the segment's first message. New messages are appended to the channel's newest segment, its open tail,
+    which is rewritten by each flush until it is full and a new tail is started. Writes always go through
+    the write-behind buffer, so each rewrite of a tail carries a whole batch of messages.
+    Loading a channel reads a few segments rather than one item per message.
+    Trimmed messages aren't deleted one at a time: once a tail is sealed, the channel's older segments
+    holding only messages which have left context are deleted, unless a TTL expires them instead.
+    """
+    TABLE_NAME = 'pepeleli-chat-history-segments'
+    ITEM_TABLE_NAME = HistoryManager.TABLE_NAME #the one item per message layout, migrated from
+    ALWAYS_WRITE_BEHIND = True
+    DEFAULT_SEGMENT_BYTES = 8 * 1024
+    SEGMENTS_PER_PAGE = 4
+    SEGMENT_ATTRIBUTES = {"#segment": "segment", "#last_ms": "last_ms"}
+
+
+    def _open_persistence(self) -> None:
+        """Set up the persistence backend, a dynamodb session, and the cache of each channel's open tail segment"""
+        super()._open_persistence()
+        try:
+            self._segment_bytes = int(self.config_manager.get_parameter("HISTORY_SEGMENT_BYTES")
+                                      or self.DEFAULT_SEGMENT_BYTES)
+        except Exception as e:
+            self.logger.exception(
+                "SegmentedHistoryManager encounted an unexpected exception loading config values", e)
+            raise
+        #channel id -> (segment key, items) of the channel's open tail, read from dynamodb on first write
+        self._tails: dict[int, tuple[int, list[HistoryItem]]] = {}
+        self._segment_reads = 0
+        self._segment_writes = 0
+        self._segment_bytes_written = 0
+        self._segments_sealed = 0
+        self._segments_deleted = 0
+
+
+    def _segment_to_dynamo(self, channel_id: int, segment: int, items: list[HistoryItem]) -> dict[str, Any]:
+        """Build a dynamodb item from a segment's history items, with an expiry time if a TTL is configured.
+        As with single messages, the expiry counts from when the segment was last written."""
+        record: dict[str, Any] = {
+            "channel_id": channel_id,
+            "segment": segment,
+            "data": zlib.compress(HistoryRecordCodec.encode_all(items)),
+            "item_count": len(items),
+            "last_ms": max(item.timestamp_ms for item in items)
+        }
+        if self._ttl_seconds:
+            record[self.TTL_ATTRIBUTE] = int(time.time()) + self._ttl_seconds
+        return record
+
+
+    @staticmethod
+    def _segment_from_dynamo(record: dict[str, Any]) -> list[HistoryItem]:
+        """Decode a segment's history items from a dynamodb item.
+        The data is bytes as written, or wrapped in a Binary when read back from dynamodb."""
+        return list(HistoryRecordCodec.decode_all(zlib.decompress(bytes(record["data"]))))
+
+
+    async def _get_persisted_history(self, channel_id: int) -> deque[HistoryItem]:
+        """Retrieve persisted history for a given channel ID from its dynamodb segments.
+        Segments are read newest first, a few per request, and their items taken newest first
+        until the history token budget is met, then sorted into chronological order."""
+        history_items: list[HistoryItem] = []
+        history_len = 0
+        query_args: dict[str, Any] = {
+            "KeyConditionExpression": Key('channel_id').eq(channel_id),
+            "ScanIndexForward": False,
+            "Limit": self.SEGMENTS_PER_PAGE
+        }
+        if self._ttl_seconds:
+            query_args["FilterExpression"] = (Attr(self.TTL_ATTRIBUTE).not_exists()
+                                              | Attr(self.TTL_ATTRIBUTE).gt(int(time.time())))
+
+        async with self._dynamodb_table() as table:
+            budget_met = False
+            while not budget_met:
+                response = await table.query(**query_args)
+                self._segment_reads += 1
+                for record in response.get('Items', []):
+                    items = self._segment_from_dynamo(record)
+                    await self._ensure_token_counts(items)
+                    for item in reversed(items):
+                        if history_len + (item.token_count or 0) > self._history_budget:
+                            budget_met = True
+                            break
+                        history_items.append(item)
+                        history_len += item.token_count or 0
+                    if budget_met:
+                        break
+
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_args["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+        self.logger.debug(
+            f"_get_persisted_history loaded {len(history_items)} items with {history_len} tokens "
+            f"for channel {channel_id}")
+        history_items.sort(key=lambda item: item.timestamp_ms)
+        return deque(history_items)
+
+
+    async def _persist_history_item(self, item: HistoryItem) -> None:
+        """Persist a history item by appending it to its channel's tail segment"""
+        await self._persist_history_items([item])
+
+
+    async def _persist_history_items(self, items: list[HistoryItem]) -> None:
+        """Persist a batch of history items, used by the write-behind buffer.
+        Each channel's items are appended to its tail segment, with one write per segment touched."""
+        by_channel: dict[int, list[HistoryItem]] = {}
+        for item in items:
+            by_channel.setdefault(item.channel_id, []).append(item)
+        async with self._dynamodb_table() as table:
+            for channel_id, channel_items in by_channel.items():
+                await self._append_to_tail(table, channel_id, channel_items)
+
+
+    async def scan_persisted_history(self, segment: int, total_segments: int,
+                                     start_key: Optional[dict[str, Any]] = None
+                                     ) -> AsyncIterator[tuple[list[HistoryItem], Optional[dict[str, Any]]]]:
+        """Stream every persisted history item with a parallel scan of the segments table, one scan segment.
+        Each page holds the items of up to HISTORY_LOAD_PAGE_SIZE segments, decoded in order,
+        so a channel's items come out chronologically as with the item table."""
+        scan_args: dict[str, Any] = {
+            "Segment": segment,
+            "TotalSegments": total_segments,
+            "Limit": self._load_page_size
+        }
+        if start_key:
+            scan_args["ExclusiveStartKey"] = start_key
+        if self._ttl_seconds:
+            scan_args["FilterExpression"] = (Attr(self.TTL_ATTRIBUTE).not_exists()
+                                             | Attr(self.TTL_ATTRIBUTE).gt(int(time.time())))
+
+        async with self._dynamodb_table() as table:
+            while True:
+                response = await table.scan(**scan_args)
+                self._segment_reads += 1
+                last_key = response.get('LastEvaluatedKey')
+                page = [item for record in response.get('Items', []) for item in self._segment_from_dynamo(record)]
+                yield page, last_key
+                if not last_key:
+                    return
+                scan_args["ExclusiveStartKey"] = last_key
+
+
+    async def _get_tail(self, table: Any, channel_id: int) -> tuple[int, list[HistoryItem]]:
+        """Get a channel's open tail segment, reading its newest segment from dynamodb if not cached.
+        A channel with no segments yet has an empty tail."""
+        if channel_id not in self._tails:
+            response = await table.query(
+                KeyConditionExpression=Key('channel_id').eq(channel_id), ScanIndexForward=False, Limit=1)
+            self._segment_reads += 1
+            records = response.get('Items', [])
+            self._tails[channel_id] = ((int(records[0]["segment"]), self._segment_from_dynamo(records[0]))
+                                       if records else (0, []))
+        return self._tails[channel_id]
+
+
+    async def _append_to_tail(self, table: Any, channel_id: int, items: list[HistoryItem]) -> None:
+        """Append items to a channel's tail segment, sealing it and starting a new one whenever it is full.
+        Items already in the tail, e.g. from a batch retried after a partial failure, are skipped.
+        The cached tail is only updated once the writes succeed, so a retry starts from the same state."""
+        segment, tail = await self._get_tail(table, channel_id)
+        tail_ids = {item.id for item in tail}
+        items = [item for item in items if item.id not in tail_ids]
+        if not items:
+            return
+
+        tail = list(tail)
+        tail_size = sum(len(HistoryRecordCodec.encode(item)) for item in tail)
+        tail_changed = False
+        changed: list[tuple[int, list[HistoryItem]]] = []
+        sealed = 0
+        for item in items:
+            item_size = len(HistoryRecordCodec.encode(item))
+            if tail and tail_size + item_size > self._segment_bytes:
+                if tail_changed:
+                    changed.append((segment, tail))
+                #segment keys must increase, even for messages within the same millisecond
+                segment = max(item.timestamp_ms, segment + 1)
+                tail = []
+                tail_size = 0
+                sealed += 1
+            elif not tail:
+                segment = item.timestamp_ms
+            tail.append(item)
+            tail_size += item_size
+            tail_changed = True
+        changed.append((segment, tail))
+        await self._write_segments(table, channel_id, changed)
+        self._tails[channel_id] = (segment, tail)
+
+        if sealed:
+            self._segments_sealed += sealed
+            if not self._ttl_seconds:
+                await self._delete_segments_out_of_context(table, channel_id, segment)
+
+
+    async def _write_segments(self, table: Any, channel_id: int, segments: list[tuple[int, list[HistoryItem]]]) -> None:
+        """Write whole segments, replacing any stored under the same keys"""
+        records = [self._segment_to_dynamo(channel_id, segment, items) for segment, items in segments]
+        if len(records) == 1:
+            await table.put_item(Item=records[0])
+        else:
+            async with table.batch_writer(overwrite_by_pkeys=["channel_id", "segment"]) as batch:
+                for record in records:
+                    await batch.put_item(Item=record)
+        self._segment_writes += len(records)
+        self._segment_bytes_written += sum(len(record["data"]) for record in records)
+
+
+    async def _delete_segments_out_of_context(self, table: Any, channel_id: int, tail_segment: int) -> None:
+        """Delete a channel's segments older than its tail whose messages have all been trimmed from context.
+        Only possible while the channel's history is in memory, otherwise they're left for a later seal."""
+        channel_history = self._local_history.get(channel_id)
+        if not channel_history:
+            return
+        oldest_ms = channel_history[0].timestamp_ms
+        query_args: dict[str, Any] = {
+            "KeyConditionExpression": Key('channel_id').eq(channel_id) & Key('segment').lt(tail_segment),
+            "ProjectionExpression": ", ".join(self.SEGMENT_ATTRIBUTES.keys()),
+            "ExpressionAttributeNames": self.SEGMENT_ATTRIBUTES
+        }
+        out_of_context: list[int] = []
+        while True:
+            response = await table.query(**query_args)
+            self._segment_reads += 1
+            out_of_context.extend(int(record["segment"]) for record in response.get('Items', [])
+                                  if int(record["last_ms"]) < oldest_ms)
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args["ExclusiveStartKey"] = response['LastEvaluatedKey']
+        if not out_of_context:
+            return
+        async with table.batch_writer(overwrite_by_pkeys=["channel_id", "segment"]) as batch:
+            for segment in out_of_context:
+                await batch.delete_item(Key={"channel_id": channel_id, "segment": segment})
+        self._segments_deleted += len(out_of_context)
+        self.logger.debug(
+            f"_delete_segments_out_of_context deleted {len(out_of_context)} segments for channel {channel_id}")
+
+
+    async def _delete_persisted_items(self, items: Union[HistoryItem, list[HistoryItem]]) -> None:
+        """Trimmed messages aren't deleted individually, which would mean rewriting their segments.
+        Whole segments are deleted once they leave context, when the channel's tail is next sealed."""
+        pass
+
+
+    async def migrate_item_layout(self, channel_ids: list[int]) -> dict[str, float]:
+        """Copy the given channels' history from the one item per message table into segments.
+        Each channel is read oldest first, a page at a time, and packed into full segments as it streams,
+        so memory stays bounded by a page and a segment, and each segment is written once.
+        Packing is deterministic, so a migration can be rerun, but it should run with the bot stopped,
+        before switching to this backend. Token counts are copied as stored,
+        items persisted without one are counted when next loaded.
+
+        Returns:
+            dict: counters describing the migration
+        """
+        start = time.perf_counter()
+        migrated = {"channels": 0, "items": 0, "segments": 0}
+        async with self._session.resource('dynamodb') as dynamodb, self._dynamodb_table() as table:
+            item_table = await dynamodb.Table(self.ITEM_TABLE_NAME)
+            for channel_id in channel_ids:
+                query_args: dict[str, Any] = {
+                    "KeyConditionExpression": Key('channel_id').eq(channel_id),
+                    "ScanIndexForward": True,
+                    "Limit": self._load_page_size,
+                    "ProjectionExpression": ", ".join(self.PERSISTED_ATTRIBUTES.keys()),
+                    "ExpressionAttributeNames": self.PERSISTED_ATTRIBUTES
+                }
+                segment = 0
+                segment_items: list[HistoryItem] = []
+                segment_size = 0
+                while True:
+                    response = await item_table.query(**query_args)
+                    for item in (self._item_from_dynamo(record) for record in response.get('Items', [])):
+                        item_size = len(HistoryRecordCodec.encode(item))
+                        if segment_items and segment_size + item_size > self._segment_bytes:
+                            await self._write_segments(table, channel_id, [(segment, segment_items)])
+                            migrated["segments"] += 1
+                            segment = max(item.timestamp_ms, segment + 1)
+                            segment_items = []
+                            segment_size = 0
+                        elif not segment_items:
+                            segment = item.timestamp_ms
+                        segment_items.append(item)
+                        segment_size += item_size
+                        migrated["items"] += 1
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    query_args["ExclusiveStartKey"] = response['LastEvaluatedKey']
+                if segment_items:
+                    await self._write_segments(table, channel_id, [(segment, segment_items)])
+                    migrated["segments"] += 1
+                self._tails[channel_id] = (segment, segment_items)
+                migrated["channels"] += 1
+                self.logger.info(
+                    f"migrate_item_layout migrated channel {channel_id}, {migrated['items']} items so far")
+        seconds = time.perf_counter() - start
+        return {**migrated, "seconds": seconds, "items_per_second": migrated["items"] / seconds if seconds else 0.0}
+
+
+    def _persistence_stats(self) -> dict[str, float]:
+        """Get counters describing the persistence backend, the dynamodb connection pool and segment traffic"""
+        return {
+            **super()._persistence_stats(),
+            "segment_reads": self._segment_reads,
+            "segment_writes": self._segment_writes,
+            "segment_bytes_written": self._segment_bytes_written,
+            "segments_sealed": self._segments_sealed,
+            "segments_deleted": self._segments_deleted
+        }
@@ -0,0 +1,59 @@
+from abc import abstractmethod
+from typing import Optional, Sequence
+
+from ai.IAIModelProvider import IAIModelProvider
+from IHistoryManager import HistoryItem
+
+
+class BaseCompletionModelProvider(IAIModelProvider):
+    """Base for AI model providers which send a single text prompt to a completions endpoint,
+    holding the prompt text and history handling they share, so each provider only makes its own calls.
+    """
+    RETRIEVED_HEADER = "### Earlier messages from this chat which may be relevant:\n"
+    RETRIEVED_FOOTER = "### End of earlier messages, the chat continues below:\n"
+    SUMMARY_HEADER = "### Summary of the earlier conversation in this chat:\n"
+    SUMMARY_INSTRUCTION = ("### Instruction: update the summary of a chat with the new messages below. "
+        "Keep who said what, facts about people, ongoing topics, and anything someone asked for or promised. "
+        "Drop small talk. Write only the updated summary, as short plain prose.\n")
+
+    BOT_USERNAME: str
+
+
+    @property
+    def REPLY_INSTRUCTION(self) -> str:
+        return f" Do not mention message ID numbers or specifically say you are replying, however do consider that {self.BOT_USERNAME} is replying to messageID:"
+
+
+    @abstractmethod
+    async def _complete_summary(self, prompt: str, max_tokens: int) -> Optional[str]:
+        """Get the model's completion of a summary prompt, or None if it gave nothing back"""
+        pass
+
+
+    async def _summarize(self, summary: str, messages: list[HistoryItem], max_tokens: int) -> str:
+        """Fold messages trimmed from the chat history into its rolling summary,
+        called by the history manager in the background.
+        The previous summary is kept if the model returns no text"""
+        prompt = self.SUMMARY_INSTRUCTION
+        prompt += f"### Summary so far:\n{summary or '(nothing yet)'}\n### New messages:\n"
+        for message in messages:
+            prompt += self._format_msg(message, with_id=False)
+        prompt += "### Updated summary:\n"
+        text = await self._complete_summary(prompt, max_tokens)
+        return text if text and text.strip() else summary
+
+
+    def _retrieval_query(self, history: Sequence[HistoryItem], reply_id: Optional[int] = None) -> str:
+        """Get the text to search trimmed history with: the message being replied to,
+        or the latest message if not replying to anything in particular"""
+        for message in reversed(history):
+            if reply_id is None or message.id == reply_id:
+                return message.content
+        return ""
+
+
+    def _format_msg(self, message: HistoryItem, with_id: bool = True) -> str:
+        if with_id:
+            return f"<messageID={message.id}> {message.name}: {message.content}\n"
+        else:
+            return f"{message.name}: {message.content}\n"
@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
+from typing import Optional
+
 from discord import Message
 
 class IAIModelProvider(ABC):
+    #whether get_latest_message_id can find where a channel's history ends, which backfill needs
+    #to fetch only what's missing. providers which don't keep message ids aren't backfilled
+    SUPPORTS_BACKFILL = True
+
     @abstractmethod
     async def get_response(self, message: Message) -> str:
         """Get a response from the AI model for the given user message.
@@ -48,6 +54,38 @@ class IAIModelProvider(ABC):
         pass
 
 
+    @abstractmethod
+    async def add_messages(self, channel_id: int, messages: list[Message]) -> None:
+        """Add a batch of messages from one channel to the conversation history used by the AI,
+        e.g. messages sent while the bot was offline, without requesting a response.
+        Messages with a bot author are added as bot messages, others as user messages,
+        which should already be normalized the same way as those passed to add_user_message().
+        
+        Args:
+            channel_id (int): The channel the messages were sent in.
+            messages (list[Message]): The messages to add, in any order.
+        
+        Returns: None
+        """
+        pass
+
+
+    @abstractmethod
+    async def get_latest_message_id(self, channel_id: int, before_id: Optional[int] = None) -> Optional[int]:
+        """Get the id of the newest message in the conversation history for a channel,
+        e.g. to find where a backfill should start from.
+        
+        Args:
+            channel_id (int): The channel to check.
+            before_id (Optional[int]): Only consider messages with an id lower than this,
+                i.e. sent before it, as discord ids increase over time.
+        
+        Returns:
+            Optional[int]: The message id, or None if there are no such messages in the history.
+        """
+        pass
+
+
     @abstractmethod
     async def get_model_name(self) -> str:
         """Get the name of the AI model currently used by this provider.
@@ -55,4 +93,29 @@ class IAIModelProvider(ABC):
         Returns:
             str: The name of the AI model.
         """
+        pass
+
+
+    @abstractmethod
+    async def warm_up(self, channel_ids: list[int]) -> None:
+        """Prepare any per-channel state ahead of the first message in each channel,
+        e.g. loading conversation history after a restart.
+        Called once at startup, with the most recently active channels first.
+        
+        Args:
+            channel_ids (list[int]): The channels to prepare.
+        
+        Returns: None
+        """
+        pass
+
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Release any resources held by this provider, 
+        e.g. persisting conversation history still waiting to be written.
+        Called when the bot shuts down.
+        
+        Returns: None
+        """
         pass
\ No newline at end of file
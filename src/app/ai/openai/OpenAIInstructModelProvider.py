@@ -1,7 +1,6 @@
 import json
 from collections import deque
 from typing import Optional
-from decimal import Decimal
 
 from discord import Message
 import openai
@@ -9,12 +8,13 @@ import tiktoken
 
 from IConfigManager import IConfigManager
 from ILogger import ILogger
-from ai.IAIModelProvider import IAIModelProvider
+from ai.BaseCompletionModelProvider import BaseCompletionModelProvider
 from IHistoryManager import IHistoryManager, HistoryItem
 from HistoryManager import HistoryManager
+from PromptAssembler import PromptAssembler
 
 
-class OpenAIInstructModelProvider(IAIModelProvider):
+class OpenAIInstructModelProvider(BaseCompletionModelProvider):
     """OpenAIModelProvider implementation for the OpenAI API completions endpoint
     intended for gpt-3.5-turbo-instruct
     """
@@ -43,7 +43,6 @@ class OpenAIInstructModelProvider(IAIModelProvider):
 ### End system message\n"""
 
         self.INSTRUCTION = f"### Instruction: continue the chat dialogue below by writing only a single reply in character as {self.BOT_USERNAME}. Do not write messages for other users. Do not write narration, system messages or anything other than dialogue from {self.BOT_USERNAME}."
-        self.REPLY_INSTRUCTION = f" Do not mention message ID numbers or specifically say you are replying, however do consider that {self.BOT_USERNAME} is replying to messageID:"
         self.MENTAL_HEALTH_MSG = """\nPlease don't harm yourself.
 Consider checking out these links to find someone to talk to:  
     <https://findahelpline.com/i/iasp>
@@ -57,14 +56,20 @@ Consider checking out these links to find someone to talk to:
             self._count_tokens_str(self.SYSTEM_MSG) 
             + self._count_tokens_str(self.INSTRUCTION)
             + self._count_tokens_str(self.REPLY_INSTRUCTION)
+            + self._count_tokens_str(self.RETRIEVED_HEADER)
+            + self._count_tokens_str(self.RETRIEVED_FOOTER)
+            + self._count_tokens_str(self.SUMMARY_HEADER)
             + self.MAX_TOKENS_RESPONSE
         )
-        self.history_manager: IHistoryManager = HistoryManager(
+        self.prompt_assembler = PromptAssembler(self._format_msg)
+        self.history_manager: IHistoryManager = HistoryManager.create(
             self._count_tokens_list,
             self._format_msg,
             self.MAX_HISTORY_LEN,
             self.logger,
-            self.config_manager
+            self.config_manager,
+            self.TOKEN_ENCODING_TYPE,
+            self._summarize
         )
 
 
@@ -124,6 +129,10 @@ Consider checking out these links to find someone to talk to:
         
         Returns: None
         """
+        if await self.history_manager.is_duplicate(message.channel.id, message.id):
+            self.logger.debug(f"ignoring a duplicate message {message.id}")
+            return
+
         moderate_reasons = await self._get_moderation(message.content, message.channel.id)
         if moderate_reasons:
             self.logger.warning(f"ignoring a message {message.id} due to content moderation. \n"
@@ -140,31 +149,76 @@ Consider checking out these links to find someone to talk to:
         await self._history_append_bot(message)
 
 
-    async def _history_append_user(self, message: Message) -> None:
-        """Append a new user message to the conversation history
-        """
-        new_item = HistoryItem(
-            timestamp = Decimal(message.created_at.timestamp()),
+    async def add_messages(self, channel_id: int, messages: list[Message]) -> None:
+        """Add a batch of messages to the conversation history, e.g. messages sent while the bot was offline.
+        User messages go through content moderation as in add_user_message(), but without the ignore reaction,
+        as they're old news by now. Duplicates are skipped first, so they aren't sent for moderation."""
+        items = []
+        for message in messages:
+            if await self.history_manager.is_duplicate(channel_id, message.id):
+                continue
+            if message.author.bot:
+                items.append(self._bot_item(message))
+                continue
+            moderate_reasons = await self._get_moderation(message.content, channel_id)
+            if moderate_reasons:
+                self.logger.warning(f"ignoring a backfilled message {message.id} due to content moderation. \n"
+                    f"reasons: {moderate_reasons} \n message content: {message.content}")
+                continue
+            items.append(self._user_item(message))
+        await self.history_manager.add_history_items(channel_id, items)
+
+
+    async def get_latest_message_id(self, channel_id: int, before_id: Optional[int] = None) -> Optional[int]:
+        for item in reversed(await self.history_manager.get_history(channel_id)):
+            if before_id is None or item.id < before_id:
+                return item.id
+        return None
+
+
+    async def warm_up(self, channel_ids: list[int]) -> None:
+        await self.history_manager.warm_up(channel_ids)
+
+
+    async def close(self) -> None:
+        await self.history_manager.close()
+
+
+    def _user_item(self, message: Message) -> HistoryItem:
+        """Make the history item for a user message"""
+        return HistoryItem(
+            timestamp_ms = round(message.created_at.timestamp() * 1000),
             content = message.content,
             name = message.author.display_name,
             id = message.id,
             channel_id = message.channel.id
         )
+
+
+    async def _history_append_user(self, message: Message) -> None:
+        """Append a new user message to the conversation history
+        """
+        new_item = self._user_item(message)
         await self.history_manager.add_history_item(message.channel.id, new_item)
         self.logger.debug("_history_append_user is adding: {} \n new history is now: {}", 
                             new_item, await self.history_manager.get_history(message.channel.id))
 
 
-    async def _history_append_bot(self, message: Message) -> None:
-        """Append a new AI/bot message to the conversation history
-        """
-        new_item = HistoryItem(
-            timestamp = Decimal(message.created_at.timestamp()),
+    def _bot_item(self, message: Message) -> HistoryItem:
+        """Make the history item for an AI/bot message"""
+        return HistoryItem(
+            timestamp_ms = round(message.created_at.timestamp() * 1000),
             content = message.content,
             name = self.BOT_USERNAME,
             id = message.id,
             channel_id = message.channel.id
         )
+
+
+    async def _history_append_bot(self, message: Message) -> None:
+        """Append a new AI/bot message to the conversation history
+        """
+        new_item = self._bot_item(message)
         await self.history_manager.add_history_item(message.channel.id, new_item)
         self.logger.debug("_history_append_bot is adding: {} \n new history is now: {}",
                             new_item, await self.history_manager.get_history(message.channel.id))
@@ -174,8 +228,7 @@ Consider checking out these links to find someone to talk to:
         """Count the number of prompt tokens a given list of messages will require"""
         num_tokens = 0
         for message in messages:
-            formatted_msg = self._format_msg(message)
-            num_tokens += self._count_tokens_str(formatted_msg)
+            num_tokens += self._count_tokens_str(self.prompt_assembler.line(message))
         return num_tokens
 
     
@@ -195,22 +248,33 @@ Consider checking out these links to find someone to talk to:
         Returns:
             str: the prompt to use for the AI request
         """
-        prompt = self.SYSTEM_MSG + self.INSTRUCTION
+        parts = [self.SYSTEM_MSG, self.INSTRUCTION]
         if reply_id:
-            prompt += f"{self.REPLY_INSTRUCTION} {reply_id}"
-        prompt += "\n"
-        history = await self.history_manager.get_history(channel_id)
-        for message in history:
-            prompt += self._format_msg(message)
-        prompt += f"<messageID=TBD> {self.BOT_USERNAME}:"
-        return prompt
-
-
-    def _format_msg(self, message: HistoryItem, with_id: bool = True) -> str:
-        if with_id:
-            return f"<messageID={message.id}> {message.name}: {message.content}\n"
-        else:
-            return f"{message.name}: {message.content}\n"
+            parts.append(f"{self.REPLY_INSTRUCTION} {reply_id}")
+        parts.append("\n")
+        history = await self.history_manager.get_context(channel_id, reply_id)
+        summary = await self.history_manager.get_summary(channel_id)
+        if summary:
+            parts.append(f"{self.SUMMARY_HEADER}{summary}\n")
+        retrieved = await self.history_manager.retrieve(channel_id, self._retrieval_query(history, reply_id))
+        if retrieved:
+            parts.append(self.RETRIEVED_HEADER)
+            parts.extend(self.prompt_assembler.line(message) for message in retrieved)
+            parts.append(self.RETRIEVED_FOOTER)
+        #the history's lines are cached and carried over between prompts, so only new messages are rendered
+        parts.extend(self.prompt_assembler.render(channel_id, history))
+        parts.append(f"<messageID=TBD> {self.BOT_USERNAME}:")
+        return "".join(parts)
+
+
+    async def _complete_summary(self, prompt: str, max_tokens: int) -> Optional[str]:
+        response = await openai.Completion.acreate(
+            model=self.RESPONSE_MODEL,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            stop=self.STOP_SEQUENCES
+        )
+        return response['choices'][0]['text'] if response['choices'] else None
 
 
     async def _get_moderation(self, text: str, channel_id: int) -> Optional[list[str]]:
@@ -231,7 +295,7 @@ Consider checking out these links to find someone to talk to:
             return None
         
         history = await self.history_manager.get_history(channel_id)
-        context = list(history)[-4:]
+        context = history[-4:]
         
         messages = []
         for msg in context:
@@ -1,4 +1,5 @@
 from collections import deque
+from typing import Optional
 
 import openai
 import tiktoken
@@ -14,7 +15,8 @@ class OpenAIModelProvider(IAIModelProvider):
     Needs work to catch up with the OpenAIInstructionModelProvider in feature set.
     Not currently a high priority.
     """
-
+    #history here doesn't keep message ids, so a backfill couldn't tell what's already in it
+    SUPPORTS_BACKFILL = False
 
     def __init__(self, 
                  config_manager: IConfigManager,
@@ -146,6 +148,28 @@ class OpenAIModelProvider(IAIModelProvider):
 
     async def add_bot_message(self, message: Message) -> None:
         raise NotImplementedError("TODO")
+
+
+    async def add_messages(self, channel_id: int, messages: list[Message]) -> None:
+        for message in sorted(messages, key=lambda message: message.created_at):
+            if message.author.bot:
+                await self._history_append_bot(message.content, channel_id)
+            else:
+                await self._history_append_user(message)
+        await self._check_history_len(channel_id)
+
+
+    async def get_latest_message_id(self, channel_id: int, before_id: Optional[int] = None) -> Optional[int]:
+        #history here doesn't keep message ids, see SUPPORTS_BACKFILL
+        return None
+    
+
+    async def warm_up(self, channel_ids: list[int]) -> None:
+        pass
+
+
+    async def close(self) -> None:
+        pass
     
 
     async def get_model_name(self) -> str:
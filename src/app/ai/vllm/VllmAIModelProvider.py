@@ -1,23 +1,27 @@
 from asyncio import AbstractEventLoop
 from collections import deque
 import json
-from typing import Optional
-from decimal import Decimal
+from typing import Optional, Sequence
 
 from discord import Message
 
 from IConfigManager import IConfigManager
 from ILogger import ILogger
-from ai.IAIModelProvider import IAIModelProvider
+from ai.BaseCompletionModelProvider import BaseCompletionModelProvider
 from ai.vllm.VLLMClient import VLLMClient
-from IHistoryManager import IHistoryManager, HistoryItem
+from IHistoryManager import IHistoryManager, HistoryItem, HistoryView
 from HistoryManager import HistoryManager
+from PromptAssembler import PromptAssembler
 
 
-class VllmAIModelProvider(IAIModelProvider):
+class VllmAIModelProvider(BaseCompletionModelProvider):
     """AI model provider implementation for vLLM
     see: https://github.com/vllm-project/vllm
     """
+    #classic puts the reply instruction right after the system message, prefix_cache puts everything that changes
+    #between requests after the history, so consecutive prompts share a long prefix for vLLM's prefix caching
+    PROMPT_LAYOUTS = ("classic", "prefix_cache")
+    PREFIX_REANCHOR_FRACTION = 0.25
 
     def __init__(self, 
                  config_manager: IConfigManager,
@@ -34,6 +38,10 @@ class VllmAIModelProvider(IAIModelProvider):
             _host = self.config_manager.get_parameter("VLLM_AI_PROVIDER_HOST")
             _port = int(self.config_manager.get_parameter("VLLM_AI_PROVIDER_PORT"))
             _api_key = self.config_manager.get_parameter("VLLM_API_KEY")
+            self.PROMPT_LAYOUT = self.config_manager.get_parameter("VLLM_PROMPT_LAYOUT") or "classic"
+            if self.PROMPT_LAYOUT not in self.PROMPT_LAYOUTS:
+                raise ValueError(f"VLLM_PROMPT_LAYOUT must be one of {', '.join(self.PROMPT_LAYOUTS)}, "
+                                 f"not {self.PROMPT_LAYOUT}")
         except ValueError as ve:
             self.logger.exception("error loading VLLMAIModelProvider configuration: ", ve)
             raise
@@ -42,12 +50,14 @@ class VllmAIModelProvider(IAIModelProvider):
         [character info]: {self.BOT_USERNAME} is an eccentric character, chill, friendly and laid back by default, but moody and opinionated and not shy about sharing opinions.  {self.BOT_USERNAME} can even get straight up unhinged if somebody says something that pushes his buttons, is fairly jaded and cynical in general but also has a sense of humour.  He is talking to his friends so he is honest, even a bit fuckin vulgar at times.  Despite the very rough edges, {self.BOT_USERNAME} has a good heart. 
         continue the chat dialogue below by writing only a single reply in character as {self.BOT_USERNAME}. Do not write messages for other users. Do not tag users with the @ symbol. Do not write narration, system messages or anything other than dialogue from {self.BOT_USERNAME}. """
         self.INSTRUCTION = ""#f"### Instruction: "
-        self.REPLY_INSTRUCTION = f" Do not mention message ID numbers or specifically say you are replying, however do consider that {self.BOT_USERNAME} is replying to messageID:"
+        self.RETRIEVED_TAIL_FOOTER = "### End of earlier messages\n"
+        self.REPLY_HEADER = "### Instruction:"
         self.RESPONSE_PRIMER = "### Response:\n"
         self.MAX_TOKENS_RESPONSE = 250
         self.IGNORE_EMOJI = '❌'
         
         self.vllm = VLLMClient(_host, _port, _api_key)
+        self._prefix_anchors: dict[int, int] = {} #channel id to the id of the item its prompts' history starts at
         
     
     async def _init_async(self) -> None:
@@ -55,15 +65,23 @@ class VllmAIModelProvider(IAIModelProvider):
         _prompt_tokens = (await self._count_tokens_str(self.SYSTEM_MSG) + 
                             await self._count_tokens_str(self.INSTRUCTION) +
                             await self._count_tokens_str(self.REPLY_INSTRUCTION) +
+                            await self._count_tokens_str(self.RETRIEVED_HEADER) +
+                            await self._count_tokens_str(self.RETRIEVED_FOOTER) +
+                            await self._count_tokens_str(self.SUMMARY_HEADER) +
                             await self._count_tokens_str(self.RESPONSE_PRIMER))
+        if self.PROMPT_LAYOUT == "prefix_cache":
+            _prompt_tokens += await self._count_tokens_str(self.REPLY_HEADER)
         self.MAX_HISTORY_LEN = self.MAX_CONTEXT_LEN - (self.MAX_TOKENS_RESPONSE + _prompt_tokens)
 
-        self.history_manager: IHistoryManager = HistoryManager(
+        self.prompt_assembler = PromptAssembler(self._format_msg)
+        self.history_manager: IHistoryManager = HistoryManager.create(
             self._count_tokens_list,
             self._format_msg,
             self.MAX_HISTORY_LEN,
             self.logger,
-            self.config_manager
+            self.config_manager,
+            self.RESPONSE_MODEL,
+            self._summarize
         )
     
 
@@ -75,6 +93,26 @@ class VllmAIModelProvider(IAIModelProvider):
         await self._history_append_bot(message)
 
 
+    async def add_messages(self, channel_id: int, messages: list[Message]) -> None:
+        await self.history_manager.add_history_items(channel_id, [
+            self._bot_item(message) if message.author.bot else self._user_item(message) for message in messages])
+
+
+    async def get_latest_message_id(self, channel_id: int, before_id: Optional[int] = None) -> Optional[int]:
+        for item in reversed(await self.history_manager.get_history(channel_id)):
+            if before_id is None or item.id < before_id:
+                return item.id
+        return None
+
+
+    async def warm_up(self, channel_ids: list[int]) -> None:
+        await self.history_manager.warm_up(channel_ids)
+
+
+    async def close(self) -> None:
+        await self.history_manager.close()
+
+
     async def get_response(self, message: Message) -> str:
         """Get a response from the AI model for the given user message.
         The AI also considers prior conversation history in deciding its response.
@@ -103,29 +141,39 @@ class VllmAIModelProvider(IAIModelProvider):
             return ""
 
     
-    async def _history_append_user(self, message: Message) -> None:
-        """Append a new user message to the conversation history"""
-        new_item = HistoryItem(
-            timestamp = Decimal(message.created_at.timestamp()),
+    def _user_item(self, message: Message) -> HistoryItem:
+        """Make the history item for a user message"""
+        return HistoryItem(
+            timestamp_ms = round(message.created_at.timestamp() * 1000),
             content = message.content,
             name = message.author.display_name,
             id = message.id,
             channel_id = message.channel.id
         )
+
+
+    async def _history_append_user(self, message: Message) -> None:
+        """Append a new user message to the conversation history"""
+        new_item = self._user_item(message)
         await self.history_manager.add_history_item(message.channel.id, new_item)
         self.logger.debug("_history_append_user is adding: {} \n new history is now: {}", 
                     new_item, await self.history_manager.get_history(message.channel.id))
 
 
-    async def _history_append_bot(self, message: Message) -> None:
-        """Append a new AI/bot message to the conversation history"""
-        new_item = HistoryItem(
-            timestamp = Decimal(message.created_at.timestamp()),
+    def _bot_item(self, message: Message) -> HistoryItem:
+        """Make the history item for an AI/bot message"""
+        return HistoryItem(
+            timestamp_ms = round(message.created_at.timestamp() * 1000),
             content = message.content,
             name = self.BOT_USERNAME,
             id = message.id,
             channel_id = message.channel.id
         )
+
+
+    async def _history_append_bot(self, message: Message) -> None:
+        """Append a new AI/bot message to the conversation history"""
+        new_item = self._bot_item(message)
         await self.history_manager.add_history_item(message.channel.id, new_item)
         self.logger.debug("_history_append_bot is adding: {} \n new history is now: {}",
                             new_item, await self.history_manager.get_history(message.channel.id))
@@ -133,9 +181,7 @@ class VllmAIModelProvider(IAIModelProvider):
 
     async def _count_tokens_list(self, messages: list[HistoryItem]) -> int:
         """Count the number of prompt tokens a given list of messages will require"""
-        formatted_msgs = []
-        for message in messages:
-            formatted_msgs.append(self._format_msg(message))
+        formatted_msgs = [self.prompt_assembler.line(message) for message in messages]
         num_tokens = await self.vllm.get_token_usage(formatted_msgs)
         return num_tokens
     
@@ -155,23 +201,92 @@ class VllmAIModelProvider(IAIModelProvider):
         Returns:
             str: the prompt to use for the AI request
         """
-        prompt = self.SYSTEM_MSG + self.INSTRUCTION
+        if self.PROMPT_LAYOUT == "prefix_cache":
+            return await self._build_prefix_cached_prompt(channel_id, reply_id)
+        parts = [self.SYSTEM_MSG, self.INSTRUCTION]
         if reply_id:
-            prompt += f"{self.REPLY_INSTRUCTION} {reply_id}"
-        prompt += "\n"
-        history = await self.history_manager.get_history(channel_id)
-        for message in history:
-            prompt += self._format_msg(message)
-        prompt += self.RESPONSE_PRIMER
-        prompt += f"<messageID=TBD> {self.BOT_USERNAME}:"
-        return prompt
+            parts.append(f"{self.REPLY_INSTRUCTION} {reply_id}")
+        parts.append("\n")
+        history = await self.history_manager.get_context(channel_id, reply_id)
+        summary = await self.history_manager.get_summary(channel_id)
+        if summary:
+            parts.append(f"{self.SUMMARY_HEADER}{summary}\n")
+        retrieved = await self.history_manager.retrieve(channel_id, self._retrieval_query(history, reply_id))
+        if retrieved:
+            parts.append(self.RETRIEVED_HEADER)
+            parts.extend(self.prompt_assembler.line(message) for message in retrieved)
+            parts.append(self.RETRIEVED_FOOTER)
+        #the history's lines are cached and carried over between prompts, so only new messages are rendered
+        parts.extend(self.prompt_assembler.render(channel_id, history))
+        parts.append(self.RESPONSE_PRIMER)
+        parts.append(f"<messageID=TBD> {self.BOT_USERNAME}:")
+        return "".join(parts)
+
+
+    async def _build_prefix_cached_prompt(self, channel_id: int, reply_id: Optional[int] = None) -> str:
+        """Build a prompt laid out for vLLM's automatic prefix caching, which reuses the KV cache
+        of the longest prefix a prompt shares with earlier ones instead of prefilling it again.
+
+        The system message and the history come first, as a prefix that only grows between requests
+        in a channel, and the summary, retrieved messages and reply instruction, which can change with
+        every request, come after it. The history also starts from an anchored item, see _anchored_history.
+        """
+        history = await self.history_manager.get_context(channel_id, reply_id)
+        summary = await self.history_manager.get_summary(channel_id)
+        retrieved = await self.history_manager.retrieve(channel_id, self._retrieval_query(history, reply_id))
+        if isinstance(history, HistoryView):
+            #a selection, e.g. a reply chain, changes with every reply anyway, so only whole histories are anchored
+            history = self._anchored_history(channel_id, history)
+
+        parts = [self.SYSTEM_MSG, self.INSTRUCTION, "\n"]
+        parts.extend(self.prompt_assembler.render(channel_id, history))
+        if summary:
+            parts.append(f"{self.SUMMARY_HEADER}{summary}\n")
+        if retrieved:
+            parts.append(self.RETRIEVED_HEADER)
+            parts.extend(self.prompt_assembler.line(message) for message in retrieved)
+            parts.append(self.RETRIEVED_TAIL_FOOTER)
+        if reply_id:
+            parts.append(f"{self.REPLY_HEADER}{self.REPLY_INSTRUCTION} {reply_id}\n")
+        parts.append(self.RESPONSE_PRIMER)
+        parts.append(f"<messageID=TBD> {self.BOT_USERNAME}:")
+        return "".join(parts)
+
+
+    def _anchored_history(self, channel_id: int, history: Sequence[HistoryItem]) -> Sequence[HistoryItem]:
+        """Start a channel's prompt history at the same item for as long as it's in the history.
+        A full history is trimmed by a message or so for every one added, which would change the prompt
+        right after the system message every time. Instead, once the anchored item is trimmed, the start moves
+        on past PREFIX_REANCHOR_FRACTION of the history's tokens at once, so the prefix only changes every
+        so often, for prompts holding between that much less history and all of it."""
+        if not history:
+            return history
+        anchor_id = self._prefix_anchors.get(channel_id)
+        if anchor_id is not None and history[0].id <= anchor_id:
+            for start, item in enumerate(history):
+                if item.id >= anchor_id:
+                    return history[start:]
+
+        start = 0
+        if anchor_id is not None:
+            skip_tokens = sum(item.token_count or 0 for item in history) * self.PREFIX_REANCHOR_FRACTION
+            skipped = 0
+            while start < len(history) - 1 and skipped < skip_tokens:
+                skipped += history[start].token_count or 0
+                start += 1
+        self._prefix_anchors[channel_id] = history[start].id
+        return history[start:]
     
 
-    def _format_msg(self, message: HistoryItem, with_id: bool = True) -> str:
-        if with_id:
-            return f"<messageID={message.id}> {message.name}: {message.content}\n"
-        else:
-            return f"{message.name}: {message.content}\n"
+    async def _complete_summary(self, prompt: str, max_tokens: int) -> Optional[str]:
+        response = await self.vllm.generate_completion(
+            prompt,
+            sampling_params = {
+                "max_tokens": max_tokens,
+                "stop": self.STOP_SEQUENCES
+            }
+        )
+        return response['text'][0] if response and response['text'] else None
         
 
     async def get_model_name(self) -> str:
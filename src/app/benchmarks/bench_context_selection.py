@@ -0,0 +1,107 @@
+"""Compare the history put in a prompt by the chronological tail and by reply-chain selection,
+in a channel with several interleaved conversations: how much of the reply chain being answered makes it in,
+and the share of prompt history tokens it takes. Also reports the history budget the chronological tail needs
+to hold the whole chain, i.e. how far selection lets HISTORY_CONTEXT_TOKENS go below the history kept.
+
+Run from src/app:
+    python -m benchmarks.bench_context_selection --conversations 3 --budget 600
+"""
+import argparse
+import random
+from typing import Optional
+
+from IHistoryManager import HistoryItem
+from ContextSelector import ContextSelector
+
+
+def make_channel(messages: int, conversations: int, chain_length: int, seed: int) -> list[HistoryItem]:
+    """Messages from interleaved conversations, each a back and forth between two authors
+    where every message replies to the previous one in its conversation, until the topic changes
+    about every chain_length messages and a new chain starts"""
+    rng = random.Random(seed)
+    last: list[Optional[int]] = [None] * conversations
+    turns = [0] * conversations
+    items = []
+    for i in range(messages):
+        conversation = rng.randrange(conversations)
+        turns[conversation] += 1
+        name = f"user{conversation}{'ab'[turns[conversation] % 2]}"
+        content = f"message {i} in conversation {conversation} " + "words " * rng.randint(5, 30)
+        if rng.randrange(chain_length) == 0:
+            last[conversation] = None
+        if last[conversation] is not None:
+            content = f"[reply to: {last[conversation]}] " + content
+        items.append(HistoryItem(timestamp_ms=i, content=content, name=name, id=i, channel_id=1,
+                                 token_count=len(content.split()) + 4))
+        last[conversation] = i
+    return items
+
+
+def chain_ids(history: list[HistoryItem], reply_id: int) -> set[int]:
+    """The full chain of explicit replies leading to a message, from the generated conversation"""
+    by_id = {item.id: item for item in history}
+    ids = set()
+    current: Optional[int] = reply_id
+    while current in by_id:
+        ids.add(current)
+        content = by_id[current].content
+        current = int(content[len("[reply to: "):content.index("]")]) if content.startswith("[reply to: ") else None
+    return ids
+
+
+def tail(history: list[HistoryItem], budget: int) -> list[HistoryItem]:
+    selected: list[HistoryItem] = []
+    used = 0
+    for item in reversed(history):
+        if used + (item.token_count or 0) > budget:
+            break
+        selected.append(item)
+        used += item.token_count or 0
+    return selected
+
+
+def run(messages: int, conversations: int, budget: int, requests: int, chain_length: int, seed: int) -> None:
+    history = make_channel(messages, conversations, chain_length, seed)
+    selector = ContextSelector(budget)
+    selector.index(1, history)
+    rng = random.Random(seed)
+
+    results = {"chronological": [0, 0, 0], "reply chain": [0, 0, 0]} #chain items in, chain tokens in, tokens in
+    chain_total = 0
+    tail_budget_needed = 0
+    for _ in range(requests):
+        #replies to one of the latest messages
+        reply_id = history[-1 - rng.randrange(min(20, len(history)))].id
+        chain = sorted(chain_ids(history, reply_id))
+        chain_total += len(chain)
+        tail_budget_needed = max(tail_budget_needed,
+                                 sum(item.token_count or 0 for item in history if item.id >= chain[0]))
+        for name, selected in [("chronological", tail(history, budget)),
+                               ("reply chain", selector.select(1, history, reply_id))]:
+            in_chain = [item for item in selected if item.id in chain]
+            results[name][0] += len(in_chain)
+            results[name][1] += sum(item.token_count or 0 for item in in_chain)
+            results[name][2] += sum(item.token_count or 0 for item in selected)
+
+    print(f"{messages} messages in {conversations} interleaved conversations, "
+          f"{budget} token budget, {requests} replies to chains of about {chain_length} messages")
+    for name, (chain_items, chain_tokens, tokens) in results.items():
+        print(f"{name:>13}: {chain_items / chain_total:.0%} of the chain in the prompt, "
+              f"{chain_tokens / tokens:.0%} of prompt history tokens on the chain")
+    print(f"the chronological tail needs a {tail_budget_needed} token budget to hold every chain")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--conversations", type=int, default=3)
+    parser.add_argument("--budget", type=int, default=600)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--chain-length", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    run(args.messages, args.conversations, args.budget, args.requests, args.chain_length, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark the memory held per history item, comparing the current HistoryItem
+with the previous representation (a dict-backed attrs class with a Decimal timestamp and uninterned names).
+
+Run from src/app:
+    python -m benchmarks.bench_history_item_memory --messages 200000
+"""
+import argparse
+import tracemalloc
+from collections import deque
+from decimal import Decimal
+from typing import Any, Callable, Optional
+
+from attr import dataclass
+
+from IHistoryManager import HistoryItem
+
+
+@dataclass
+class LegacyHistoryItem:
+    timestamp: Decimal
+    content: str
+    name: str
+    id: int
+    channel_id: int
+    token_count: Optional[int] = None
+    token_model: str = ""
+
+
+def make_legacy(i: int, content: str, name: str) -> Any:
+    return LegacyHistoryItem(timestamp=Decimal((1_697_000_000_000 + i * 1000) / 1000), content=content, name=name,
+                             id=1_160_000_000_000_000_000 + i, channel_id=1_000_000_000_000_000_000,
+                             token_count=12, token_model="gpt-3.5-turbo-instruct")
+
+
+def make_current(i: int, content: str, name: str) -> Any:
+    return HistoryItem(timestamp_ms=1_697_000_000_000 + i * 1000, content=content, name=name,
+                       id=1_160_000_000_000_000_000 + i, channel_id=1_000_000_000_000_000_000,
+                       token_count=12, token_model="gpt-3.5-turbo-instruct")
+
+
+def measure(make_item: Callable[[int, str, str], Any], messages: int, authors: int) -> float:
+    """Bytes allocated per item held in a deque, with content and author names built per message,
+    as they are when decoded from discord or dynamodb"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = deque(make_item(i, f"message number {i}", "".join(["author", str(i % authors)]))
+                    for i in range(messages))
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del history
+    return held / messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--authors", type=int, default=50)
+    args = parser.parse_args()
+
+    legacy = measure(make_legacy, args.messages, args.authors)
+    current = measure(make_current, args.messages, args.authors)
+    print(f"legacy HistoryItem:  {legacy:6.0f} bytes per message")
+    print(f"current HistoryItem: {current:6.0f} bytes per message ({100 * (1 - current / legacy):.0f}% less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Benchmark history snapshots: the time to write a snapshot of every channel's history,
+and to read it back on startup.
+
+Run from src/app:
+    python -m benchmarks.bench_history_snapshot --channels 50 --items-per-channel 300
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import MagicMock
+
+from IHistoryManager import HistoryItem
+from HistorySnapshot import HistorySnapshot
+
+
+def make_items(channels: int, items_per_channel: int) -> list[HistoryItem]:
+    return [HistoryItem(timestamp_ms=1_697_000_000_000 + i, content=f"message number {i} " * 8,
+                        name=f"author{i % 50}", id=channel_id * items_per_channel + i, channel_id=channel_id,
+                        token_count=40, token_model="bench")
+            for channel_id in range(channels) for i in range(items_per_channel)]
+
+
+async def run(channels: int, items_per_channel: int, repeats: int) -> None:
+    items = make_items(channels, items_per_channel)
+    with tempfile.TemporaryDirectory() as data_dir:
+        snapshot = HistorySnapshot(os.path.join(data_dir, "snapshot.bin"), lambda: items, MagicMock(), 60)
+        saves = []
+        loads = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await snapshot.save(clean=True)
+            saves.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            restored, _ = snapshot.load()
+            loads.append((time.perf_counter() - start) * 1000)
+        assert len(restored) == len(items)
+        print(f"{len(items)} items, {snapshot.last_bytes / 1024 / 1024:.1f} MiB: "
+              f"save best {min(saves):.1f}ms, load best {min(loads):.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--items-per-channel", type=int, default=300)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.channels, args.items_per_channel, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
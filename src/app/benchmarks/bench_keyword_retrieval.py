@@ -0,0 +1,78 @@
+"""Benchmark KeywordIndex indexing throughput and query latency.
+
+Run from src/app:
+    python -m benchmarks.bench_keyword_retrieval --messages 1000000
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from IHistoryManager import HistoryItem
+from retrieval.KeywordIndex import KeywordIndex
+
+
+def make_messages(count: int, vocabulary: int, words_per_message: int, seed: int = 0) -> list[str]:
+    """Generate messages with Zipf-distributed word frequencies, a rough stand-in for chat"""
+    rng = np.random.default_rng(seed)
+    words = rng.zipf(1.2, size=count * words_per_message) % vocabulary
+    return [" ".join(f"w{word}" for word in words[i * words_per_message : (i + 1) * words_per_message])
+            for i in range(count)]
+
+
+def percentile_ms(samples: list[float], percentile: float) -> float:
+    return float(np.percentile(samples, percentile) * 1000)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--vocabulary", type=int, default=200000)
+    parser.add_argument("--words", type=int, default=12, help="words per message")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, args.vocabulary, args.words)
+    index = KeywordIndex()
+    start = time.perf_counter()
+    for batch_start in range(0, args.messages, args.batch_size):
+        batch = range(batch_start, min(batch_start + args.batch_size, args.messages))
+        index.add([HistoryItem(timestamp_ms=i, content=messages[i], name="User", id=i, channel_id=1,
+                               token_count=args.words) for i in batch],
+                  [(0, i) for i in batch])
+    elapsed = time.perf_counter() - start
+    print(f"indexed {len(index)} messages in {elapsed:.1f}s ({len(index) / elapsed:.0f} messages/s)")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        index.save(index_dir)
+        saved_bytes = sum(os.path.getsize(os.path.join(directory, name))
+                          for directory, _, names in os.walk(index_dir) for name in names)
+        print(f"saved in {time.perf_counter() - start:.1f}s, {saved_bytes / 1e6:.0f}MB on disk")
+        start = time.perf_counter()
+        index = KeywordIndex.load(index_dir)
+        print(f"loaded in {time.perf_counter() - start:.1f}s")
+
+    #queries mix a few words from a stored message, so they range from rare to very common terms
+    rng = np.random.default_rng(1)
+    queries = [" ".join(rng.choice(messages[i].split(), size=3)) for i in rng.integers(args.messages, size=args.queries)]
+    runs: list[tuple[str, list[str]]] = [("loaded", []), ("loaded + new", messages[: args.batch_size])]
+    for name, extra in runs:
+        if extra:
+            index.add([HistoryItem(timestamp_ms=i, content=text, name="User", id=i, channel_id=1)
+                       for i, text in enumerate(extra)],
+                      [(1, i) for i in range(len(extra))])
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, args.limit)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:>12}: p50 {percentile_ms(timings, 50):8.2f}ms  p95 {percentile_ms(timings, 95):8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
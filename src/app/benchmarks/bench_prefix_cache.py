@@ -0,0 +1,108 @@
+"""Measure how much of each vLLM prompt is shared with the one before it in its channel, for each VLLM_PROMPT_LAYOUT,
+i.e. how much vLLM's automatic prefix caching can reuse rather than prefill again.
+
+A busy channel is replayed through the real VllmAIModelProvider, with its history filling up and then sliding,
+against a local stub of the vLLM server. The stub estimates tokens as 4 characters each, and counts only
+whole 16 token blocks of the shared prefix as reusable, as vLLM caches the KV of full blocks.
+
+Run from src/app:
+    python -m benchmarks.bench_prefix_cache --messages 400 --context-len 2048
+"""
+import argparse
+import asyncio
+import json
+from typing import Optional, Union
+from unittest.mock import MagicMock
+
+from IConfigManager import IConfigManager
+from IHistoryManager import HistoryItem
+from ai.vllm.VLLMClient import VLLMClient
+from ai.vllm.VllmAIModelProvider import VllmAIModelProvider
+
+CHARS_PER_TOKEN = 4
+BLOCK_TOKENS = 16
+
+
+class StubVLLMClient(VLLMClient):
+    """Answers locally, recording the tokens of each prompt and of the prefix it shares with the previous one"""
+
+    def __init__(self) -> None:
+        super().__init__("localhost", 0, "")
+        self.last_prompt = ""
+        self.prompt_tokens: list[int] = []
+        self.shared_tokens: list[int] = []
+
+
+    async def generate_completion(self, prompt: str, stream: bool = False,
+                                  sampling_params: Optional[dict] = None) -> Optional[dict]:
+        shared = 0
+        for a, b in zip(prompt, self.last_prompt):
+            if a != b:
+                break
+            shared += 1
+        self.last_prompt = prompt
+        self.prompt_tokens.append(len(prompt) // CHARS_PER_TOKEN)
+        self.shared_tokens.append(shared // CHARS_PER_TOKEN // BLOCK_TOKENS * BLOCK_TOKENS)
+        return {"text": ["sure, sounds good"]}
+
+
+    async def get_token_usage(self, text: Union[str, list[str]]) -> int:
+        texts = [text] if isinstance(text, str) else text
+        return sum(len(t) // CHARS_PER_TOKEN for t in texts)
+
+
+async def replay(layout: str, messages: int, context_len: int) -> StubVLLMClient:
+    params = {
+        "BOT_USERNAME": "pepeleli",
+        "VLLM_MAX_CONTEXT_LEN": str(context_len),
+        "VLLM_RESPONSE_MODEL": "bench",
+        "VLLM_AI_PROVIDER_HOST": "localhost",
+        "VLLM_AI_PROVIDER_PORT": "0",
+        "VLLM_API_KEY": "",
+        "STOP_SEQUENCES": json.dumps(["<messageID="]),
+        "VLLM_PROMPT_LAYOUT": layout,
+        "PERSIST_HISTORY": "false"
+    }
+    config_manager = MagicMock(spec=IConfigManager)
+    config_manager.get_parameter.side_effect = lambda param_name: params.get(param_name, "")
+    provider = VllmAIModelProvider(config_manager, MagicMock())
+    stub = StubVLLMClient()
+    provider.vllm = stub
+    await provider._init_async()
+
+    for i in range(messages):
+        #every message gets a reply from the bot, which is added to the history too
+        user_item = HistoryItem(timestamp_ms=2 * i, content=f"message {i}, " + "what do you think about that " * 3,
+                                name=f"user{i % 5}", id=2 * i, channel_id=1)
+        await provider.history_manager.add_history_item(1, user_item)
+        message = MagicMock()
+        message.channel.id = 1
+        message.id = user_item.id
+        response = await provider.get_response(message)
+        await provider.history_manager.add_history_item(1, HistoryItem(
+            timestamp_ms=2 * i + 1, content=response, name="pepeleli", id=2 * i + 1, channel_id=1))
+    await provider.close()
+    return stub
+
+
+async def run(messages: int, context_len: int) -> None:
+    print(f"{messages} replies in one channel, {context_len} token context")
+    for layout in VllmAIModelProvider.PROMPT_LAYOUTS:
+        stub = await replay(layout, messages, context_len)
+        prompt_tokens = sum(stub.prompt_tokens)
+        shared_tokens = sum(stub.shared_tokens)
+        print(f"{layout:>12}: {prompt_tokens / messages:.0f} prompt tokens per request, "
+              f"{shared_tokens / messages:.0f} reusable from the last prompt ({shared_tokens / prompt_tokens:.0%}), "
+              f"{(prompt_tokens - shared_tokens) / messages:.0f} left to prefill")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--context-len", type=int, default=2048)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.context_len))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare building the history part of a prompt by formatting every message and concatenating with +=,
+as _build_prompt used to, against joining the PromptAssembler's cached, incrementally kept lines once.
+Each step appends a message, trims the oldest, counts the new message's tokens, which renders its line,
+and builds the prompt, as a busy channel with full history does. The assembler's render is also timed
+without the final join, which copies the whole prompt once and so still grows with it, as any prompt must.
+
+Run from src/app:
+    python -m benchmarks.bench_prompt_assembly --sizes 50 200 800 3200
+"""
+import argparse
+import random
+import time
+from typing import Callable
+
+from IHistoryManager import HistoryItem
+from PromptAssembler import PromptAssembler
+
+
+def format_msg(message: HistoryItem) -> str:
+    return f"<messageID={message.id}> {message.name}: {message.content}\n"
+
+
+def make_item(i: int, rng: random.Random) -> HistoryItem:
+    content = " ".join(rng.choice(["hey", "what", "about", "the", "game", "lol", "tonight", "yeah"])
+                       for _ in range(rng.randint(5, 40)))
+    return HistoryItem(timestamp_ms=i, content=content, name=f"user{rng.randrange(8)}", id=i, channel_id=1)
+
+
+def concatenated(history: list[HistoryItem]) -> str:
+    prompt = ""
+    for message in history:
+        prompt += format_msg(message)
+    return prompt
+
+
+def time_builds(size: int, steps: int, seed: int, count_line: Callable[[HistoryItem], object],
+                build: Callable[[list[HistoryItem]], object], repeats: int = 5) -> float:
+    """Microseconds per step of appending, trimming, counting and building, over a history of a given size,
+    the best of several repeats"""
+    best = float("inf")
+    for _ in range(repeats):
+        rng = random.Random(seed)
+        history = [make_item(i, rng) for i in range(size)]
+        build(history)
+        start = time.perf_counter()
+        for i in range(size, size + steps):
+            item = make_item(i, rng)
+            history = history[1:] + [item]
+            count_line(item)
+            build(history)
+        best = min(best, time.perf_counter() - start)
+    return best / steps * 1_000_000
+
+
+def run(sizes: list[int], steps: int, seed: int) -> None:
+    print(f"{'history items':>13} {'format and +=':>16} {'assembler':>12} {'render only':>14}")
+    for size in sizes:
+        #the generated messages cost the same for all, so are timed on their own and taken off
+        baseline = time_builds(size, steps, seed, lambda item: "", lambda history: "")
+        old = time_builds(size, steps, seed, format_msg, concatenated) - baseline
+        assembler = PromptAssembler(format_msg)
+        new = time_builds(size, steps, seed, assembler.line,
+                          lambda history: "".join(assembler.render(1, history))) - baseline
+        assembler = PromptAssembler(format_msg)
+        render = time_builds(size, steps, seed, assembler.line,
+                             lambda history: assembler.render(1, history)) - baseline
+        print(f"{size:>13} {old:>13.1f} µs {new:>9.1f} µs {render:>11.1f} µs")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 800, 3200])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    run(args.sizes, args.steps, args.seed)
+
+
+if __name__ == "__main__":
+    main()
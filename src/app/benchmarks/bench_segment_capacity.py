@@ -0,0 +1,96 @@
+"""Estimate dynamodb capacity used by the one item per message layout and the segment layout:
+write units to persist a stream of messages through the write-behind buffer, and read units to load
+a channel's history back. Units follow dynamodb's sizing, 1KB per write unit and 4KB per read unit
+(eventually consistent reads cost half), with item sizes as attribute names plus values.
+
+Run from src/app:
+    python -m benchmarks.bench_segment_capacity --messages 5000 --batch-size 25
+"""
+import argparse
+import asyncio
+import math
+from typing import Any
+from unittest.mock import MagicMock
+
+from IConfigManager import IConfigManager
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+from SegmentedHistoryManager import SegmentedHistoryManager
+
+
+def item_size(record: dict[str, Any]) -> int:
+    """Approximate size of a dynamodb item: attribute names, plus strings and binaries by length, numbers as 21 bytes"""
+    return sum(len(name) + (len(value) if isinstance(value, (str, bytes)) else 21) for name, value in record.items())
+
+
+class CapacityTable:
+    """Stand-in for the segments table which records the write units of each put"""
+
+    def __init__(self) -> None:
+        self.items: dict[tuple[int, int], dict[str, Any]] = {}
+        self.write_units = 0
+
+    async def query(self, **kwargs: Any) -> dict[str, Any]:
+        return {"Items": []}
+
+    async def put_item(self, Item: dict[str, Any]) -> None:
+        self.write_units += math.ceil(item_size(Item) / 1024)
+        self.items[(Item["channel_id"], Item["segment"])] = Item
+
+    def batch_writer(self, **kwargs: Any) -> MagicMock:
+        batch = MagicMock()
+        batch.__aenter__.return_value = self
+        return batch
+
+
+def read_units(records: list[dict[str, Any]], history_messages: int) -> float:
+    """Read units to load the newest records holding history_messages messages,
+    half units for eventually consistent reads"""
+    total = 0
+    loaded = 0
+    for record in reversed(records):
+        total += item_size(record)
+        loaded += record.get("item_count", 1)
+        if loaded >= history_messages:
+            break
+    return math.ceil(total / 4096) / 2
+
+
+async def run(messages: int, batch_size: int, segment_bytes: int, history_messages: int) -> None:
+    items = [HistoryItem(timestamp_ms=1_697_000_000_000 + i * 1000, content=f"message number {i}, about the game " * 2,
+                         name=f"author{i % 8}", id=1_150_000_000_000_000_000 + i, channel_id=1_100_000_000_000_000_000,
+                         token_count=24, token_model="bench") for i in range(messages)]
+    params = {"PERSIST_HISTORY": "true", "HISTORY_SEGMENT_BYTES": str(segment_bytes)}
+    config_manager = MagicMock(spec=IConfigManager)
+    config_manager.get_parameter.side_effect = lambda param_name: params.get(param_name, "")
+
+    per_item = HistoryManager(MagicMock(), str, 0, MagicMock(), config_manager, "bench")
+    item_records = [per_item._item_to_dynamo(item) for item in items]
+    item_write_units = sum(math.ceil(item_size(record) / 1024) for record in item_records)
+
+    segmented = SegmentedHistoryManager(MagicMock(), str, 0, MagicMock(), config_manager, "bench")
+    table = CapacityTable()
+    for start in range(0, messages, batch_size):
+        await segmented._append_to_tail(table, items[0].channel_id, items[start : start + batch_size])
+    segment_records = [table.items[key] for key in sorted(table.items)]
+
+    print(f"{messages} messages, write-behind batches of {batch_size}, segments of up to {segment_bytes} bytes")
+    print(f"item layout:    {len(item_records)} items, {item_write_units} write units, "
+          f"{read_units(item_records, history_messages)} read units to load {history_messages} messages")
+    print(f"segment layout: {len(segment_records)} items, {table.write_units} write units, "
+          f"{read_units(segment_records, history_messages)} read units to load {history_messages} messages")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--segment-bytes", type=int, default=SegmentedHistoryManager.DEFAULT_SEGMENT_BYTES)
+    parser.add_argument("--history-messages", type=int, default=300,
+                        help="messages loaded into context by a cold load")
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.batch_size, args.segment_bytes, args.history_messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark the SQLite history backend: add_history_item latency with writes straight through,
+and the time to reload a channel's history from the database.
+
+Run from src/app:
+    python -m benchmarks.bench_sqlite_history --messages 5000 --channels 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from IConfigManager import IConfigManager
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+
+
+def make_history_manager(db_path: str, max_history_len: int) -> HistoryManager:
+    params = {
+        "PERSIST_HISTORY": "true",
+        "HISTORY_BACKEND": "sqlite",
+        "HISTORY_SQLITE_PATH": db_path,
+        "HISTORY_DATA_DIR": os.path.dirname(db_path)
+    }
+    config_manager = MagicMock(spec=IConfigManager)
+    config_manager.get_parameter.side_effect = lambda param_name: params.get(param_name, "")
+
+    async def count_tokens(items: list[HistoryItem]) -> int:
+        return sum(len(item.content) // 4 + 4 for item in items)
+
+    return HistoryManager.create(count_tokens, lambda item: item.content, max_history_len, MagicMock(), config_manager,
+                                 "bench")
+
+
+async def run(messages: int, channels: int, max_history_len: int) -> None:
+    with tempfile.TemporaryDirectory() as data_dir:
+        db_path = os.path.join(data_dir, "history.db")
+        history_manager = make_history_manager(db_path, max_history_len)
+        latencies = []
+        for i in range(messages):
+            item = HistoryItem(timestamp_ms=1_697_000_000_000 + i, content=f"message number {i} " * 4,
+                               name=f"author{i % 50}", id=i, channel_id=i % channels)
+            start = time.perf_counter()
+            await history_manager.add_history_item(item.channel_id, item)
+            latencies.append((time.perf_counter() - start) * 1000)
+        await history_manager.close()
+        print(f"add_history_item: p50 {np.percentile(latencies, 50):.3f}ms, "
+              f"p95 {np.percentile(latencies, 95):.3f}ms, p99 {np.percentile(latencies, 99):.3f}ms")
+
+        reopened = make_history_manager(db_path, max_history_len)
+        reloads = []
+        for channel_id in range(channels):
+            start = time.perf_counter()
+            history = await reopened.get_history(channel_id)
+            reloads.append((time.perf_counter() - start) * 1000)
+        await reopened.close()
+        print(f"get_history reload of {len(history)} items: p50 {np.percentile(reloads, 50):.3f}ms, "
+              f"max {max(reloads):.3f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--max-history-len", type=int, default=3000)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.channels, args.max_history_len))
+
+
+if __name__ == "__main__":
+    main()
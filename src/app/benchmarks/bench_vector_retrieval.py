@@ -0,0 +1,87 @@
+"""Benchmark VectorIndex query latency and recall, brute force against IVF.
+
+Run from src/app:
+    python -m benchmarks.bench_vector_retrieval --messages 1000000
+"""
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from retrieval.VectorIndex import VectorIndex
+from retrieval.HashingEmbedder import HashingEmbedder
+
+
+def percentile_ms(samples: list[float], percentile: float) -> float:
+    return float(np.percentile(samples, percentile) * 1000)
+
+
+def build_index(messages: int, dimension: int, n_probe: int, topics: int,
+                chunk_size: int = 100000) -> tuple[VectorIndex, np.ndarray]:
+    """Fill an index with unit vectors scattered around random topic directions,
+    a rough stand-in for embeddings of conversation, returning it and a sample of its vectors to query with"""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((topics, dimension), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    index = VectorIndex(dimension, n_probe)
+    #keep the lists from being retrained as the index grows, training once at the end instead
+    index.IVF_MIN_VECTORS = messages
+    queries = np.zeros((0, dimension), dtype=np.float32)
+    for start in range(0, messages, chunk_size):
+        count = min(chunk_size, messages - start)
+        vectors = centers[rng.integers(topics, size=count)]
+        vectors += rng.standard_normal((count, dimension), dtype=np.float32) / np.sqrt(dimension)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.add(vectors, [(0, start + i) for i in range(count)])
+        if len(queries) < 200:
+            queries = np.concatenate([queries, vectors[: 200 - len(queries)]])
+    return index, queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=1000)
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index, sample = build_index(args.messages, args.dimension, args.n_probe, args.topics)
+    print(f"built index of {len(index)} vectors, dimension {args.dimension}, in {time.perf_counter() - start:.1f}s")
+
+    #perturb stored vectors so queries resemble, but do not exactly match, a stored message
+    rng = np.random.default_rng(1)
+    queries = sample[: args.queries] + rng.standard_normal(sample[: args.queries].shape, dtype=np.float32) * 0.05
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    timings: dict[str, list[float]] = {"brute force": [], "ivf": []}
+    recalls = []
+    for query in queries:
+        start = time.perf_counter()
+        exact = index.search(query, args.limit, exhaustive=True)
+        timings["brute force"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        approximate = index.search(query, args.limit)
+        timings["ivf"].append(time.perf_counter() - start)
+
+        exact_refs = {ref for _, ref in exact}
+        recalls.append(len(exact_refs & {ref for _, ref in approximate}) / len(exact_refs))
+
+    for name, samples in timings.items():
+        print(f"{name:>12}: p50 {percentile_ms(samples, 50):8.2f}ms  p95 {percentile_ms(samples, 95):8.2f}ms")
+    print(f"ivf recall@{args.limit}: {np.mean(recalls):.3f} (n_probe {args.n_probe})")
+
+    embedder = HashingEmbedder(args.dimension)
+    texts = [f"message number {i} about some topic or other" for i in range(10000)]
+    start = time.perf_counter()
+    asyncio.run(embedder.embed(texts))
+    print(f"hashing embedder: {len(texts) / (time.perf_counter() - start):.0f} texts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Migrate persisted history from one dynamodb item per message to segments, for HISTORY_BACKEND=dynamodb-segments.
+
+Run from src/app with the bot stopped, then switch HISTORY_BACKEND to dynamodb-segments:
+    python migrate_history_segments.py [channel ids...]
+Migrates MONITOR_CHANNELS if no channel ids are given.
+"""
+import asyncio
+import json
+import sys
+
+from ConfigManager import ConfigManager
+from IHistoryManager import HistoryItem
+from Logger import Logger
+from SegmentedHistoryManager import SegmentedHistoryManager
+
+
+async def count_tokens(items: list[HistoryItem]) -> int:
+    """Migration copies the stored token counts rather than counting, so this is never called"""
+    raise RuntimeError("migrate_history_segments doesn't count tokens")
+
+
+async def migrate(channel_ids: list[int]) -> None:
+    logger = Logger()
+    config_manager = ConfigManager(logger)
+    if config_manager.get_parameter("PERSIST_HISTORY") != "true":
+        sys.exit("PERSIST_HISTORY must be enabled to migrate persisted history")
+    if not channel_ids:
+        channel_ids = json.loads(config_manager.get_parameter("MONITOR_CHANNELS"))
+
+    history_manager = SegmentedHistoryManager(count_tokens, str, 0, logger, config_manager)
+    try:
+        migrated = await history_manager.migrate_item_layout(channel_ids)
+    finally:
+        await history_manager.close()
+    print(f"migrated {int(migrated['items'])} items in {int(migrated['channels'])} channels "
+          f"into {int(migrated['segments'])} segments in {migrated['seconds']:.1f}s, "
+          f"{migrated['items_per_second']:.0f} items/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate([int(channel_id) for channel_id in sys.argv[1:]]))
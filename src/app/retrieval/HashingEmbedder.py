@@ -0,0 +1,46 @@
+import re
+import zlib
+
+import numpy as np
+
+from retrieval.IEmbedder import IEmbedder
+
+
+class HashingEmbedder(IEmbedder):
+    """Deterministic, dependency-free embedder using the hashing trick.
+
+    Each lowercased word, and each character trigram of a word, is hashed to a signed bucket of the vector.
+    This only captures lexical overlap rather than meaning, but needs no model or network access,
+    so it works offline and gives reproducible results in tests and benchmarks.
+    """
+    WORD_PATTERN = re.compile(r"\w+")
+
+
+    def __init__(self, dimension: int = 256) -> None:
+        self._dimension = dimension
+
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, hashed % self._dimension] += 1.0 if hashed & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+    def _features(self, text: str) -> list[str]:
+        """Split text into the word and character trigram features that get hashed"""
+        features = []
+        for word in self.WORD_PATTERN.findall(text.lower()):
+            features.append(word)
+            padded = f"#{word}#"
+            features.extend(f"#3{padded[i : i + 3]}" for i in range(len(padded) - 2))
+        return features
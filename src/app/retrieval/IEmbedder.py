@@ -0,0 +1,26 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class IEmbedder(ABC):
+    """Interface for turning text into embedding vectors for semantic search"""
+
+    @property
+    @abstractmethod
+    def dimension(self) -> int:
+        """The length of the vectors produced by this embedder"""
+        pass
+
+
+    @abstractmethod
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """Embed a batch of texts.
+
+        Args:
+            texts: the texts to embed
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension), one L2-normalized row per text
+        """
+        pass
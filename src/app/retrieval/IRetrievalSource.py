@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+
+from IHistoryManager import HistoryItem
+from HistoryArchive import ArchiveRef
+
+
+class IRetrievalSource(ABC):
+    """Interface for a searchable store of history items trimmed from context,
+    used to bring relevant older messages back into the prompt"""
+
+    @abstractmethod
+    async def add_items(self, items: list[HistoryItem], refs: list[ArchiveRef]) -> None:
+        """Add history items to the store, e.g. items just trimmed from context.
+        refs locate each item in the HistoryArchive, the store keeps those rather than copies of the items.
+        Indexing may happen asynchronously, so items may not be searchable immediately."""
+        pass
+
+
+    @abstractmethod
+    async def search(self, channel_id: int, query: str, limit: int) -> list[HistoryItem]:
+        """Find the stored history items in a channel most relevant to a query, most relevant first"""
+        pass
+
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Finish any outstanding indexing and persist the store, called on shutdown"""
+        pass
+
+
+    @abstractmethod
+    def stats(self) -> dict[str, float]:
+        """Get counters describing the store's activity"""
+        pass
@@ -0,0 +1,48 @@
+import os
+import shutil
+from typing import Optional
+
+
+class IndexDirectory:
+    """Atomic saves of an index's files to a directory.
+
+    Each save writes its files into a new generation subdirectory, then replaces the CURRENT file,
+    which names the generation to load, in one step. A crash part way through a save leaves
+    the previous generation in place and still current. Older generations are removed once replaced.
+    """
+    CURRENT_FILE = "CURRENT"
+    GENERATION_PREFIX = "gen-"
+
+
+    @classmethod
+    def current(cls, index_dir: str) -> Optional[str]:
+        """Get the directory of the last completed save, or None if nothing was saved"""
+        try:
+            with open(os.path.join(index_dir, cls.CURRENT_FILE), encoding="utf-8") as current_file:
+                return os.path.join(index_dir, current_file.read().strip())
+        except FileNotFoundError:
+            return None
+
+
+    @classmethod
+    def new_generation(cls, index_dir: str) -> str:
+        """Create an empty directory for the next save to write its files to"""
+        current = cls.current(index_dir)
+        number = int(os.path.basename(current)[len(cls.GENERATION_PREFIX):]) + 1 if current else 1
+        generation_dir = os.path.join(index_dir, f"{cls.GENERATION_PREFIX}{number:08d}")
+        #left over from a save that crashed before completing
+        shutil.rmtree(generation_dir, ignore_errors=True)
+        os.makedirs(generation_dir)
+        return generation_dir
+
+
+    @classmethod
+    def commit(cls, index_dir: str, generation_dir: str) -> None:
+        """Make a fully written generation the current one, then remove the generations before it"""
+        current_path = os.path.join(index_dir, cls.CURRENT_FILE)
+        with open(current_path + ".tmp", "w", encoding="utf-8") as current_file:
+            current_file.write(os.path.basename(generation_dir))
+        os.replace(current_path + ".tmp", current_path)
+        for name in os.listdir(index_dir):
+            if name.startswith(cls.GENERATION_PREFIX) and name != os.path.basename(generation_dir):
+                shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
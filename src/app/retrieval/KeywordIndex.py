@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from IHistoryManager import HistoryItem
+from HistoryArchive import ArchiveRef
+from retrieval.IndexDirectory import IndexDirectory
+
+
+class KeywordIndex:
+    """Inverted index with BM25 scoring over the history items of one channel.
+
+    Items are tokenized into lowercased words, so names, phrases and the parts of links can all be matched.
+    Postings added since the index was loaded are kept in growable arrays per term.
+    Postings loaded from disk stay in flat numpy arrays, sliced by term, and are merged with the new ones on save.
+    Each item is kept as a reference to it in the HistoryArchive, rather than a copy of the item.
+    Adds and searches may run in worker threads, the index guards its own state with a lock.
+    """
+    TOKEN_PATTERN = re.compile(r"\w+")
+    K1 = 1.2
+    B = 0.75
+    MAX_DOC_LENGTH = 0xFFFF
+    DENSE_FRACTION = 8 #score into an array over all documents once over 1/DENSE_FRACTION of them are involved
+
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total_length = 0 #sum of all document lengths, for the average used by BM25
+        self._lengths = array("H")
+        self._refs = array("q") #archive (segment, offset) of each item, flattened into pairs
+
+        self._postings: dict[str, tuple[array, array]] = {} #term -> (document positions, term frequencies)
+        self._base_terms: dict[str, int] = {} #term -> row in the postings loaded from disk
+        self._base_bounds = np.zeros(1, dtype=np.int64) #start of each loaded term's postings
+        self._base_docs = np.zeros(0, dtype=np.uint32)
+        self._base_freqs = np.zeros(0, dtype=np.uint16)
+
+
+    def __len__(self) -> int:
+        return self._count
+
+
+    @classmethod
+    def tokenize(cls, text: str) -> list[str]:
+        """Split text into the lowercased terms that are indexed and searched"""
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+
+    def add(self, items: list[HistoryItem], refs: list[ArchiveRef]) -> None:
+        """Add history items, and their archive references, to the index"""
+        tokenized = [Counter(self.tokenize(f"{item.name} {item.content}")) for item in items]
+        with self._lock:
+            for terms, ref in zip(tokenized, refs):
+                position = self._count
+                length = min(sum(terms.values()), self.MAX_DOC_LENGTH)
+                for term, freq in terms.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(position)
+                    postings[1].append(min(freq, self.MAX_DOC_LENGTH))
+                self._lengths.append(length)
+                self._total_length += length
+                self._refs.extend(ref)
+                self._count += 1
+
+
+    def search(self, query: str, limit: int) -> list[tuple[float, ArchiveRef]]:
+        """Find the history items that best match the terms of a query by BM25 score.
+
+        Terms are scored rarest first. Once no document outside the current candidates could reach
+        the top results on the remaining, more common, terms alone, those terms only add to
+        the candidates' scores, so the long postings of common words are never fully scored.
+
+        Args:
+            query: text to search for
+            limit: the maximum number of results
+
+        Returns:
+            list: (score, archive reference) pairs, best match first
+        """
+        terms = set(self.tokenize(query))
+        with self._lock:
+            if not self._count or not terms or limit <= 0:
+                return []
+            postings = sorted((self._term_postings(term) for term in terms), key=lambda pair: len(pair[0]))
+            postings = [(docs, freqs) for docs, freqs in postings if len(docs)]
+            idfs = [np.log(1 + (self._count - len(docs) + 0.5) / (len(docs) + 0.5)) for docs, _ in postings]
+            #the most a document can score from each term, as term frequency grows
+            remaining_bound = sum(idfs) * (self.K1 + 1)
+
+            dense_threshold = self._count // self.DENSE_FRACTION
+            candidates: np.ndarray = np.zeros(0, dtype=np.uint32)
+            scores: np.ndarray = np.zeros(0, dtype=np.float64)
+            for (docs, freqs), idf in zip(postings, idfs):
+                if not len(candidates):
+                    #postings are sorted by position, so the first term's documents can be taken as they are
+                    candidates, scores = docs, self._term_scores(idf, freqs, docs)
+                elif len(candidates) >= limit and np.partition(scores, -limit)[-limit] >= remaining_bound:
+                    #documents matching only this and later terms cannot make the top results, update candidates only
+                    if len(candidates) > dense_threshold:
+                        dense = np.zeros(self._count, dtype=np.float64)
+                        dense[docs] = self._term_scores(idf, freqs, docs)
+                        scores += dense[candidates]
+                    else:
+                        positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                        hits = np.flatnonzero(docs[positions] == candidates)
+                        scores[hits] += self._term_scores(idf, freqs[positions[hits]], candidates[hits])
+                elif len(candidates) + len(docs) > dense_threshold:
+                    #large merges add into a score per document, rather than sorting the postings together
+                    dense = np.zeros(self._count, dtype=np.float64)
+                    dense[candidates] = scores
+                    dense[docs] += self._term_scores(idf, freqs, docs)
+                    candidates = np.flatnonzero(dense).astype(np.uint32)
+                    scores = dense[candidates]
+                else:
+                    merged, inverse = np.unique(np.concatenate([candidates, docs]), return_inverse=True)
+                    scores = np.bincount(inverse, minlength=len(merged),
+                                         weights=np.concatenate([scores, self._term_scores(idf, freqs, docs)]))
+                    candidates = merged
+                remaining_bound -= idf * (self.K1 + 1)
+
+            limit = min(limit, len(scores))
+            if limit <= 0:
+                return []
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[rank]), self._ref_at(int(candidates[rank]))) for rank in top]
+
+
+    def save(self, index_dir: str) -> None:
+        """Write the index to a directory, replacing any index saved there before.
+        The new files are swapped in with IndexDirectory, so a crash mid-save keeps the previous index."""
+        with self._lock:
+            terms = sorted(self._base_terms.keys() | self._postings.keys())
+            doc_parts = []
+            freq_parts = []
+            bounds = np.zeros(len(terms) + 1, dtype=np.int64)
+            for row, term in enumerate(terms):
+                docs, freqs = self._term_postings(term)
+                doc_parts.append(docs)
+                freq_parts.append(freqs)
+                bounds[row + 1] = bounds[row] + len(docs)
+
+            os.makedirs(index_dir, exist_ok=True)
+            save_dir = IndexDirectory.new_generation(index_dir)
+            with open(os.path.join(save_dir, "terms.txt"), "w", encoding="utf-8") as terms_file:
+                terms_file.write("\n".join(terms))
+            np.save(os.path.join(save_dir, "bounds.npy"), bounds)
+            np.save(os.path.join(save_dir, "docs.npy"), np.concatenate(doc_parts or [self._base_docs]))
+            np.save(os.path.join(save_dir, "freqs.npy"), np.concatenate(freq_parts or [self._base_freqs]))
+            np.save(os.path.join(save_dir, "lengths.npy"), np.frombuffer(self._lengths, dtype=np.uint16))
+            np.save(os.path.join(save_dir, "refs.npy"), np.frombuffer(self._refs, dtype=np.int64).reshape(-1, 2))
+            with open(os.path.join(save_dir, "meta.json"), "w") as meta_file:
+                json.dump({"count": self._count, "total_length": self._total_length, "refs": True}, meta_file)
+            IndexDirectory.commit(index_dir, save_dir)
+
+
+    @classmethod
+    def load(cls, index_dir: str) -> 'KeywordIndex':
+        """Load an index saved with save(), or create an empty one if nothing was saved there.
+        An index saved before items were kept as archive references is discarded,
+        as its items can't be located in the archive."""
+        index = cls()
+        #indexes saved before saves were swapped in atomically keep their files in index_dir itself
+        index_dir = IndexDirectory.current(index_dir) or index_dir
+        meta_path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return index
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if not meta.get("refs"):
+            return index
+
+        index._count = meta["count"]
+        index._total_length = meta["total_length"]
+        with open(os.path.join(index_dir, "terms.txt"), encoding="utf-8") as terms_file:
+            terms = terms_file.read().split("\n")
+        index._base_terms = {term: row for row, term in enumerate(terms) if term}
+        index._base_bounds = np.load(os.path.join(index_dir, "bounds.npy"))
+        index._base_docs = np.load(os.path.join(index_dir, "docs.npy"))
+        index._base_freqs = np.load(os.path.join(index_dir, "freqs.npy"))
+        index._lengths = array("H", np.load(os.path.join(index_dir, "lengths.npy")).tobytes())
+        index._refs = array("q", np.load(os.path.join(index_dir, "refs.npy")).tobytes())
+        return index
+
+
+    def _term_postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """Get the document positions and term frequencies for a term, loaded and new postings together"""
+        docs = np.zeros(0, dtype=np.uint32)
+        freqs = np.zeros(0, dtype=np.uint16)
+        row = self._base_terms.get(term)
+        if row is not None:
+            start, end = self._base_bounds[row], self._base_bounds[row + 1]
+            docs, freqs = self._base_docs[start : end], self._base_freqs[start : end]
+        postings = self._postings.get(term)
+        if postings is not None:
+            #copied, so the growable arrays are not pinned by buffer exports
+            docs = np.concatenate([docs, np.array(postings[0], dtype=np.uint32)])
+            freqs = np.concatenate([freqs, np.array(postings[1], dtype=np.uint16)])
+        return docs, freqs
+
+
+    def _term_scores(self, idf: float, freqs: np.ndarray, docs: np.ndarray) -> np.ndarray:
+        """BM25 score contributions of one term to the given documents, with the term's frequencies in them"""
+        lengths = np.frombuffer(self._lengths, dtype=np.uint16)[docs]
+        norms = self.K1 * (1 - self.B + self.B * lengths / (self._total_length / self._count))
+        freqs = freqs.astype(np.float64)
+        return idf * freqs * (self.K1 + 1) / (freqs + norms)
+
+
+    def _ref_at(self, position: int) -> ArchiveRef:
+        """Get the archive reference of the item at a position"""
+        return self._refs[2 * position], self._refs[2 * position + 1]
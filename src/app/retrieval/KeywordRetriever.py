@@ -0,0 +1,82 @@
+import os
+import asyncio
+import time
+
+from IHistoryManager import HistoryItem
+from HistoryArchive import HistoryArchive, ArchiveRef
+from retrieval.IRetrievalSource import IRetrievalSource
+from retrieval.KeywordIndex import KeywordIndex
+
+
+class KeywordRetriever(IRetrievalSource):
+    """Keyword search over trimmed history, using a KeywordIndex per channel.
+
+    Indexing is cheap, so added items are indexed straight away, in a worker thread.
+    Each channel's index is loaded from index_dir on first use, and saved back on close.
+    Indexes hold references into the archive, search results are read back from it.
+    """
+
+    def __init__(self, archive: HistoryArchive, index_dir: str) -> None:
+        """
+        Args:
+            archive: the archive holding the items added, which search results are read from
+
+            index_dir: directory to persist indexes in, one subdirectory per channel
+        """
+        self.archive = archive
+        self.index_dir = index_dir
+        self._indexes: dict[int, KeywordIndex] = {}
+
+        self.items_indexed = 0
+        self.searches = 0
+        self.last_search_ms = 0.0
+
+
+    async def add_items(self, items: list[HistoryItem], refs: list[ArchiveRef]) -> None:
+        by_channel: dict[int, tuple[list[HistoryItem], list[ArchiveRef]]] = {}
+        for item, ref in zip(items, refs):
+            channel_items, channel_refs = by_channel.setdefault(item.channel_id, ([], []))
+            channel_items.append(item)
+            channel_refs.append(ref)
+        for channel_id, (channel_items, channel_refs) in by_channel.items():
+            index = await self._get_index(channel_id)
+            await asyncio.to_thread(index.add, channel_items, channel_refs)
+        self.items_indexed += len(items)
+
+
+    async def search(self, channel_id: int, query: str, limit: int) -> list[HistoryItem]:
+        index = await self._get_index(channel_id)
+        if not len(index) or not query:
+            return []
+        start = time.perf_counter()
+        results = await asyncio.to_thread(index.search, query, limit)
+        items = await asyncio.to_thread(self.archive.read_refs, channel_id, [ref for _, ref in results])
+        self.searches += 1
+        self.last_search_ms = (time.perf_counter() - start) * 1000
+        return items
+
+
+    async def close(self) -> None:
+        for channel_id, index in self._indexes.items():
+            await asyncio.to_thread(index.save, self._channel_dir(channel_id))
+
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "items_indexed": self.items_indexed,
+            "indexed": sum(len(index) for index in self._indexes.values()),
+            "searches": self.searches,
+            "last_search_ms": self.last_search_ms
+        }
+
+
+    async def _get_index(self, channel_id: int) -> KeywordIndex:
+        """Get the index for a channel, loading it from disk on first use"""
+        if channel_id not in self._indexes:
+            index = await asyncio.to_thread(KeywordIndex.load, self._channel_dir(channel_id))
+            self._indexes.setdefault(channel_id, index)
+        return self._indexes[channel_id]
+
+
+    def _channel_dir(self, channel_id: int) -> str:
+        return os.path.join(self.index_dir, str(channel_id))
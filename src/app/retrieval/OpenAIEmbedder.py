@@ -0,0 +1,30 @@
+import numpy as np
+import openai
+
+from retrieval.IEmbedder import IEmbedder
+
+
+class OpenAIEmbedder(IEmbedder):
+    """Embedder using the OpenAI embeddings endpoint"""
+    DIMENSIONS = {"text-embedding-ada-002": 1536}
+
+
+    def __init__(self, api_key: str, model: str = "text-embedding-ada-002") -> None:
+        self.api_key = api_key
+        self.model = model
+
+
+    @property
+    def dimension(self) -> int:
+        return self.DIMENSIONS[self.model]
+
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        response = await openai.Embedding.acreate(input=texts, model=self.model, api_key=self.api_key)
+        rows = sorted(response["data"], key=lambda row: row["index"])
+        vectors = np.array([row["embedding"] for row in rows], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
@@ -0,0 +1,204 @@
+import os
+import json
+import threading
+from typing import Optional
+
+import numpy as np
+
+from HistoryArchive import ArchiveRef
+from retrieval.IndexDirectory import IndexDirectory
+
+
+class VectorIndex:
+    """In-memory vector index over the history items of one channel.
+
+    Vectors are L2-normalized, so inner product is cosine similarity.
+    Small indexes are searched by brute force. Once an index holds IVF_MIN_VECTORS vectors,
+    it is partitioned into inverted lists around k-means centroids (IVF), and searches only scan
+    the n_probe lists nearest the query, plus any vectors added since the lists were last built.
+    The lists are rebuilt whenever the index has doubled in size since they were built.
+
+    Each vector is kept with a reference to its history item in the HistoryArchive, rather than a copy of the item.
+    Adds and searches may run in worker threads, the index guards its own state with a lock.
+    """
+    IVF_MIN_VECTORS = 20000
+    KMEANS_ITERATIONS = 8
+    KMEANS_SAMPLE_SIZE = 50000
+    ASSIGN_CHUNK_SIZE = 65536
+
+
+    def __init__(self, dimension: int, n_probe: int = 8) -> None:
+        """
+        Args:
+            dimension: length of the vectors stored in this index
+
+            n_probe: how many inverted lists to scan per search, once the index is partitioned
+        """
+        self.dimension = dimension
+        self.n_probe = n_probe
+        self._lock = threading.Lock()
+        self._count = 0
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._refs = np.zeros((0, 2), dtype=np.int64) #archive (segment, offset) of each vector's history item
+
+        self._centroids: Optional[np.ndarray] = None
+        self._list_order = np.zeros(0, dtype=np.int64) #vector positions, grouped by inverted list
+        self._list_bounds = np.zeros(0, dtype=np.int64) #start of each inverted list in _list_order
+        self._trained_count = 0 #how many vectors the inverted lists cover
+
+
+    def __len__(self) -> int:
+        return self._count
+
+
+    def add(self, vectors: np.ndarray, refs: list[ArchiveRef]) -> None:
+        """Add vectors, and the archive references of the history items they were embedded from, to the index"""
+        with self._lock:
+            new_count = self._count + len(refs)
+            if new_count > len(self._vectors):
+                capacity = max(new_count, 2 * len(self._vectors), 1024)
+                self._vectors = self._grow(self._vectors, capacity)
+                self._refs = self._grow(self._refs, capacity)
+
+            self._vectors[self._count : new_count] = vectors
+            self._refs[self._count : new_count] = np.array(refs, dtype=np.int64).reshape(-1, 2)
+            self._count = new_count
+            needs_training = new_count >= self.IVF_MIN_VECTORS and new_count >= 2 * self._trained_count
+            vectors_snapshot = self._vectors[: new_count]
+
+        if needs_training:
+            self._train(vectors_snapshot)
+
+
+    def search(self, query: np.ndarray, limit: int, exhaustive: bool = False) -> list[tuple[float, ArchiveRef]]:
+        """Find the history items whose vectors are most similar to the query vector.
+
+        Args:
+            query: the query vector, L2-normalized
+            limit: the maximum number of results
+            exhaustive: scan every vector, even if the index is partitioned
+
+        Returns:
+            list: (similarity, archive reference) pairs, most similar first
+        """
+        with self._lock:
+            if not self._count:
+                return []
+            if self._centroids is None or exhaustive:
+                candidates = None
+                scores = self._vectors[: self._count] @ query
+            else:
+                candidates = self._candidates(query)
+                scores = self._vectors[candidates] @ query
+
+            limit = min(limit, len(scores))
+            if limit <= 0:
+                return []
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            positions = candidates[top] if candidates is not None else top
+            return [(float(scores[rank]), self._ref_at(int(position))) for rank, position in zip(top, positions)]
+
+
+    def save(self, index_dir: str) -> None:
+        """Write the index to a directory, replacing any index saved there before.
+        The new files are swapped in with IndexDirectory, so a crash mid-save keeps the previous index."""
+        with self._lock:
+            os.makedirs(index_dir, exist_ok=True)
+            save_dir = IndexDirectory.new_generation(index_dir)
+            np.save(os.path.join(save_dir, "vectors.npy"), self._vectors[: self._count])
+            np.save(os.path.join(save_dir, "refs.npy"), self._refs[: self._count])
+            if self._centroids is not None:
+                np.save(os.path.join(save_dir, "centroids.npy"), self._centroids)
+                np.save(os.path.join(save_dir, "list_order.npy"), self._list_order)
+                np.save(os.path.join(save_dir, "list_bounds.npy"), self._list_bounds)
+            with open(os.path.join(save_dir, "meta.json"), "w") as meta_file:
+                json.dump({
+                    "dimension": self.dimension,
+                    "refs": True,
+                    "count": self._count,
+                    "trained_count": self._trained_count if self._centroids is not None else 0
+                }, meta_file)
+            IndexDirectory.commit(index_dir, save_dir)
+
+
+    @classmethod
+    def load(cls, index_dir: str, dimension: int, n_probe: int = 8) -> 'VectorIndex':
+        """Load an index saved with save(), or create an empty one if nothing was saved there.
+        A saved index built with a different vector dimension is discarded, as is one saved before
+        items were kept as archive references, whose items can't be located in the archive."""
+        index = cls(dimension, n_probe)
+        #indexes saved before saves were swapped in atomically keep their files in index_dir itself
+        index_dir = IndexDirectory.current(index_dir) or index_dir
+        meta_path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return index
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if meta["dimension"] != dimension or not meta.get("refs"):
+            return index
+
+        index._count = meta["count"]
+        index._vectors = np.load(os.path.join(index_dir, "vectors.npy"))
+        index._refs = np.load(os.path.join(index_dir, "refs.npy"))
+        if meta["trained_count"]:
+            index._centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+            index._list_order = np.load(os.path.join(index_dir, "list_order.npy"))
+            index._list_bounds = np.load(os.path.join(index_dir, "list_bounds.npy"))
+            index._trained_count = meta["trained_count"]
+        return index
+
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        """Get the positions of vectors in the inverted lists nearest the query,
+        plus all vectors added since the lists were built"""
+        assert self._centroids is not None
+        n_probe = min(self.n_probe, len(self._centroids))
+        nearest = np.argpartition(-(self._centroids @ query), n_probe - 1)[:n_probe]
+        parts = [self._list_order[self._list_bounds[i] : self._list_bounds[i + 1]] for i in nearest]
+        parts.append(np.arange(self._trained_count, self._count, dtype=np.int64))
+        return np.concatenate(parts)
+
+
+    def _train(self, vectors: np.ndarray) -> None:
+        """Build inverted lists over the given vectors using spherical k-means.
+        Runs without holding the lock, then swaps the new lists in."""
+        rng = np.random.default_rng(0)
+        n_lists = max(1, int(np.sqrt(len(vectors))))
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), self.KMEANS_SAMPLE_SIZE), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(self.KMEANS_ITERATIONS):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+
+        assignments = np.concatenate([
+            np.argmax(vectors[start : start + self.ASSIGN_CHUNK_SIZE] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), self.ASSIGN_CHUNK_SIZE)
+        ])
+        list_order = np.argsort(assignments, kind="stable").astype(np.int64)
+        list_bounds = np.searchsorted(assignments[list_order], np.arange(n_lists + 1)).astype(np.int64)
+
+        with self._lock:
+            self._centroids = centroids
+            self._list_order = list_order
+            self._list_bounds = list_bounds
+            self._trained_count = len(vectors)
+
+
+    def _ref_at(self, position: int) -> ArchiveRef:
+        """Get the archive reference of the history item at a position"""
+        segment, offset = self._refs[position]
+        return int(segment), int(offset)
+
+
+    @staticmethod
+    def _grow(array: np.ndarray, capacity: int) -> np.ndarray:
+        """Copy an array into a larger one along its first axis"""
+        grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[: len(array)] = array
+        return grown
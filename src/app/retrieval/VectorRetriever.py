@@ -0,0 +1,154 @@
+import os
+import asyncio
+import time
+from typing import Optional
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryArchive import HistoryArchive, ArchiveRef
+from retrieval.IEmbedder import IEmbedder
+from retrieval.IRetrievalSource import IRetrievalSource
+from retrieval.VectorIndex import VectorIndex
+
+
+class VectorRetriever(IRetrievalSource):
+    """Semantic search over trimmed history, using a VectorIndex per channel.
+
+    Added items are queued and embedded in batches by a background task, off the request path.
+    A batch that fails to embed is requeued and retried on a later pass, up to MAX_EMBED_ATTEMPTS times.
+    Each channel's index is loaded from index_dir on first use, and saved back on close.
+    Indexes hold references into the archive, search results are read back from it.
+    """
+    MAX_EMBED_ATTEMPTS = 3
+
+
+    def __init__(self,
+                 embedder: IEmbedder,
+                 archive: HistoryArchive,
+                 index_dir: str,
+                 logger: ILogger,
+                 batch_size: int,
+                 n_probe: int = 8
+                ) -> None:
+        """
+        Args:
+            embedder: the embedder used for both history items and queries
+
+            archive: the archive holding the items added, which search results are read from
+
+            index_dir: directory to persist indexes in, one subdirectory per channel
+
+            logger: reference to the active logger instance
+
+            batch_size: how many queued items to embed per embedder call
+
+            n_probe: how many inverted lists each search scans, once an index is partitioned
+        """
+        self.embedder = embedder
+        self.archive = archive
+        self.index_dir = index_dir
+        self.logger = logger
+        self.batch_size = batch_size
+        self.n_probe = n_probe
+
+        self._indexes: dict[int, VectorIndex] = {}
+        self._pending: list[tuple[HistoryItem, ArchiveRef]] = []
+        self._embed_task: Optional[asyncio.Task[None]] = None
+        self._failed_attempts: dict[int, int] = {} #item id to the number of times embedding it failed
+
+        self.items_embedded = 0
+        self.items_lost = 0
+        self.searches = 0
+        self.last_search_ms = 0.0
+
+
+    async def add_items(self, items: list[HistoryItem], refs: list[ArchiveRef]) -> None:
+        self._pending.extend(zip(items, refs))
+        if len(self._pending) >= self.batch_size and (self._embed_task is None or self._embed_task.done()):
+            self._embed_task = asyncio.get_running_loop().create_task(self._embed_pending(self.batch_size))
+
+
+    async def search(self, channel_id: int, query: str, limit: int) -> list[HistoryItem]:
+        index = await self._get_index(channel_id)
+        if not len(index) or not query:
+            return []
+        start = time.perf_counter()
+        query_vector = (await self.embedder.embed([query]))[0]
+        results = await asyncio.to_thread(index.search, query_vector, limit)
+        items = await asyncio.to_thread(self.archive.read_refs, channel_id, [ref for _, ref in results])
+        self.searches += 1
+        self.last_search_ms = (time.perf_counter() - start) * 1000
+        return items
+
+
+    async def close(self) -> None:
+        if self._embed_task:
+            await self._embed_task
+        await self._embed_pending(1)
+        for channel_id, index in self._indexes.items():
+            await asyncio.to_thread(index.save, self._channel_dir(channel_id))
+
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "pending": len(self._pending),
+            "items_embedded": self.items_embedded,
+            "items_lost": self.items_lost,
+            "indexed": sum(len(index) for index in self._indexes.values()),
+            "searches": self.searches,
+            "last_search_ms": self.last_search_ms
+        }
+
+
+    async def _embed_pending(self, min_batch: int) -> None:
+        """Embed queued items in batches, while at least min_batch items are queued.
+        A batch that fails is put back at the front of the queue for a later pass, and this pass stops"""
+        while len(self._pending) >= min_batch and self._pending:
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+            try:
+                vectors = await self.embedder.embed([f"{item.name}: {item.content}" for item, _ in batch])
+            except Exception as e:
+                self._requeue_failed(batch, e)
+                return
+            for item, _ in batch:
+                self._failed_attempts.pop(item.id, None)
+
+            by_channel: dict[int, list[int]] = {}
+            for row, (item, _) in enumerate(batch):
+                by_channel.setdefault(item.channel_id, []).append(row)
+            for channel_id, rows in by_channel.items():
+                index = await self._get_index(channel_id)
+                await asyncio.to_thread(index.add, vectors[rows], [batch[row][1] for row in rows])
+            self.items_embedded += len(batch)
+
+
+    def _requeue_failed(self, batch: list[tuple[HistoryItem, ArchiveRef]], e: Exception) -> None:
+        """Put a batch that failed to embed back at the front of the queue,
+        except items that have failed MAX_EMBED_ATTEMPTS times, which are dropped"""
+        retry = []
+        for item, ref in batch:
+            attempts = self._failed_attempts.get(item.id, 0) + 1
+            if attempts < self.MAX_EMBED_ATTEMPTS:
+                self._failed_attempts[item.id] = attempts
+                retry.append((item, ref))
+            else:
+                self._failed_attempts.pop(item.id, None)
+        lost = len(batch) - len(retry)
+        self.items_lost += lost
+        self._pending[:0] = retry
+        self.logger.exception("VectorRetriever failed to embed {} items, {} will be retried, "
+                              "{} failed too many times and will not be searchable", e, len(batch), len(retry), lost)
+
+
+    async def _get_index(self, channel_id: int) -> VectorIndex:
+        """Get the index for a channel, loading it from disk on first use"""
+        if channel_id not in self._indexes:
+            index = await asyncio.to_thread(
+                VectorIndex.load, self._channel_dir(channel_id), self.embedder.dimension, self.n_probe)
+            self._indexes.setdefault(channel_id, index)
+        return self._indexes[channel_id]
+
+
+    def _channel_dir(self, channel_id: int) -> str:
+        return os.path.join(self.index_dir, str(channel_id))
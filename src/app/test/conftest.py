@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def history_params() -> dict[str, str]:
+    """The HistoryManager configuration shared by the fake config managers,
+    which add their own parameters on top"""
+    return {
+        "PERSIST_HISTORY": "true",
+        "HISTORY_DEDUP_WINDOW": "1000",
+        "HISTORY_WRITE_BEHIND": "false",
+        "HISTORY_WRITE_BATCH_SIZE": "25",
+        "HISTORY_WRITE_MAX_AGE_SECONDS": "2",
+        "HISTORY_WRITE_MAX_PENDING": "1000",
+        "HISTORY_LOAD_PAGE_SIZE": "100",
+        "HISTORY_MAX_POOL_CONNECTIONS": "10",
+        "HISTORY_TTL_SECONDS": "0",
+        "HISTORY_DATA_DIR": "data",
+        "HISTORY_ARCHIVE": "false",
+        "HISTORY_ARCHIVE_SEGMENT_BYTES": "16777216",
+        "HISTORY_RETRIEVAL_CANDIDATES": "20",
+        "HISTORY_VECTOR_RETRIEVAL": "false",
+        "HISTORY_EMBEDDER": "hashing",
+        "HISTORY_EMBEDDING_DIMENSION": "256",
+        "HISTORY_VECTOR_TOKEN_BUDGET": "400",
+        "HISTORY_EMBED_BATCH_SIZE": "32",
+        "HISTORY_KEYWORD_RETRIEVAL": "false",
+        "HISTORY_KEYWORD_TOKEN_BUDGET": "200",
+        "HISTORY_MEMORY_BUDGET_TOKENS": "0",
+        "HISTORY_WARMUP_CONCURRENCY": "4",
+        "HISTORY_BACKEND": "dynamodb",
+        "HISTORY_SQLITE_PATH": "data/history.db",
+        "HISTORY_SUMMARIZE": "false",
+        "HISTORY_SUMMARY_TOKEN_BUDGET": "200",
+        "HISTORY_SUMMARY_BATCH_SIZE": "10",
+        "HISTORY_TOKEN_COUNT_CONCURRENCY": "8",
+        "HISTORY_SNAPSHOT": "false",
+        "HISTORY_SNAPSHOT_INTERVAL_SECONDS": "300",
+        "HISTORY_SEGMENT_BYTES": "8192",
+        "HISTORY_MAX_ITEM_TOKENS": "0",
+        "HISTORY_SPILL_TRUNCATED": "false",
+        "HISTORY_CONTEXT_TOKENS": "0"
+    }
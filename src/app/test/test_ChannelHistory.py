@@ -0,0 +1,50 @@
+import pytest
+
+from IHistoryManager import HistoryItem
+from ChannelHistory import ChannelHistory
+
+
+def make_item(i: int) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1)
+
+
+def ids(items: object) -> list[int]:
+    return [item.id for item in items] #type: ignore
+
+
+def test_views_are_unchanged_by_appends_and_trims() -> None:
+    history = ChannelHistory(make_item(i) for i in range(5))
+    view = history.view()
+    history.append(make_item(5))
+    assert history.popleft().id == 0
+    assert ids(view) == [0, 1, 2, 3, 4]
+    assert ids(history) == [1, 2, 3, 4, 5]
+    assert ids(history.view()) == [1, 2, 3, 4, 5]
+
+
+def test_views_survive_compaction() -> None:
+    history = ChannelHistory(make_item(i) for i in range(100))
+    view = history.view()
+    for _ in range(60):
+        history.popleft()
+    #trimming past half the list moved the live items to a new list
+    assert history._start < 60
+    history.append(make_item(100))
+    assert ids(view) == list(range(100))
+    assert ids(history) == list(range(60, 101))
+    assert history[0].id == 60 and history[-1].id == 100
+
+
+def test_view_sequence_access() -> None:
+    history = ChannelHistory(make_item(i) for i in range(6))
+    history.popleft()
+    view = history.view()
+    assert len(view) == 5
+    assert view[0].id == 1 and view[-1].id == 5
+    assert ids(view[-2:]) == [4, 5]
+    assert ids(view[::2]) == [1, 3, 5]
+    assert ids(reversed(view)) == [5, 4, 3, 2, 1]
+    with pytest.raises(IndexError):
+        view[5]
+    with pytest.raises(IndexError):
+        ChannelHistory().popleft()
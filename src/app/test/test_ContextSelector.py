@@ -0,0 +1,72 @@
+from typing import Optional
+
+from IHistoryManager import HistoryItem
+from ContextSelector import ContextSelector
+
+
+def make_item(i: int, name: str, reply_to: Optional[int] = None) -> HistoryItem:
+    content = f"message {i}"
+    if reply_to is not None:
+        content = f"[reply to: {reply_to}] " + content
+    return HistoryItem(timestamp_ms=i, content=content, name=name, id=i, channel_id=1, token_count=10)
+
+
+def interleaved_history() -> list[HistoryItem]:
+    #alice and the bot talk about one thing while carol and dave talk about another
+    return [
+        make_item(1, "alice"),
+        make_item(2, "carol"),
+        make_item(3, "alice"),              #a new turn, as carol spoke in between
+        make_item(4, "pepeleli"),           #the bot answers alice
+        make_item(5, "dave", reply_to=2),
+        make_item(6, "carol", reply_to=5),
+        make_item(7, "alice", reply_to=4),
+        make_item(8, "alice"),              #the same turn as 7
+        make_item(9, "dave", reply_to=6),
+        make_item(10, "carol"),
+    ]
+
+
+def test_reply_chain_is_selected_first_then_newest_messages() -> None:
+    history = interleaved_history()
+    selector = ContextSelector(budget=60)
+    selector.index(1, history)
+
+    selected = selector.select(1, history, reply_id=8)
+
+    #8 and the rest of its turn, 7, which replies to the bot's 4, taken to answer alice's 3 just before it
+    #then the newest messages fill the last 10 tokens, all in chronological order
+    assert [item.id for item in selected] == [3, 4, 7, 8, 9, 10]
+    assert selector.stats()["chain_items_selected"] == 4
+
+
+def test_without_a_reply_the_newest_messages_are_selected() -> None:
+    history = interleaved_history()
+    selector = ContextSelector(budget=30)
+    selector.index(1, history)
+
+    assert [item.id for item in selector.select(1, history)] == [8, 9, 10]
+    #a reply to a message no longer in history falls back the same way
+    assert [item.id for item in selector.select(1, history, reply_id=100)] == [8, 9, 10]
+
+
+def test_explicit_links_are_followed_along_the_whole_chain() -> None:
+    history = interleaved_history()
+    selector = ContextSelector(budget=40)
+    selector.index(1, history)
+
+    assert [item.id for item in selector.select(1, history, reply_id=9)] == [2, 5, 6, 9]
+
+
+def test_trimmed_items_end_the_chain() -> None:
+    history = interleaved_history()
+    selector = ContextSelector(budget=40)
+    selector.index(1, history[:6])
+    selector.index(1, history[6:])
+    selector.forget(1, history[:2])
+
+    #2 was trimmed, so the chain stops at 5, and the newest message fills the rest
+    assert [item.id for item in selector.select(1, history[2:], reply_id=9)] == [5, 6, 9, 10]
+
+    selector.reset(1)
+    assert [item.id for item in selector.select(1, history[2:], reply_id=9)] == [7, 8, 9, 10]
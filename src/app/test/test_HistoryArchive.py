@@ -0,0 +1,70 @@
+from pathlib import Path
+
+from IHistoryManager import HistoryItem
+from HistoryArchive import HistoryArchive
+from HistoryRecordCodec import HistoryRecordCodec
+
+
+def make_item(i: int, channel_id: int = 1) -> HistoryItem:
+    return HistoryItem(timestamp_ms=(1000 + i) * 1000, content=f"message {i} ünïcode", name=f"User{i % 3}", 
+                       id=i, channel_id=channel_id, token_count=i, token_model="model-a")
+
+
+def test_codec_round_trip() -> None:
+    items = [make_item(i) for i in range(3)]
+    items[0].token_count = None
+    items[0].token_model = ""
+    buffer = HistoryRecordCodec.encode_all(items)
+    assert list(HistoryRecordCodec.decode_all(buffer)) == items
+
+
+def test_read_time_range(tmp_path: Path) -> None:
+    archive = HistoryArchive(str(tmp_path), max_segment_bytes=1024)
+    archive.append([make_item(i) for i in range(500)])
+    archive.append([make_item(i, channel_id=2) for i in range(10)])
+
+    assert len(list((tmp_path / "1").glob("*.seg"))) > 1
+    items = archive.read(1, 1_100_000, 1_199_000)
+    assert [item.id for item in items] == list(range(100, 200))
+    assert [item.id for item in archive.read(2, 0, 2_000_000)] == list(range(10))
+
+
+def test_reopen_reads_from_disk(tmp_path: Path) -> None:
+    HistoryArchive(str(tmp_path), max_segment_bytes=1024).append([make_item(i) for i in range(300)])
+
+    archive = HistoryArchive(str(tmp_path), max_segment_bytes=1024)
+    archive.append([make_item(300)])
+    items = archive.read(1, 1_250_000, 1_300_000)
+    assert [item.id for item in items] == list(range(250, 301))
+    assert items[0] == make_item(250)
+
+
+def test_read_refs_returns_items_in_given_order(tmp_path: Path) -> None:
+    archive = HistoryArchive(str(tmp_path), max_segment_bytes=1024)
+    refs = archive.append([make_item(i) for i in range(100)])
+    assert len({segment for segment, _ in refs}) > 1
+
+    reopened = HistoryArchive(str(tmp_path), max_segment_bytes=1024)
+    wanted = [99, 3, 50, 4]
+    assert reopened.read_refs(1, [refs[i] for i in wanted]) == [make_item(i) for i in wanted]
+    assert reopened.read_refs(1, []) == []
+
+
+def test_torn_tail_is_truncated_on_reopen(tmp_path: Path) -> None:
+    archive = HistoryArchive(str(tmp_path), max_segment_bytes=1 << 20)
+    archive.append([make_item(i) for i in range(100)])
+    archive.close()
+
+    #a crash part way through writing the next record, and its index entry
+    segment_path = next((tmp_path / "1").glob("*.seg"))
+    with open(segment_path, "ab") as segment_file:
+        segment_file.write(HistoryRecordCodec.encode(make_item(100))[:20])
+    with open(segment_path.with_suffix(".idx"), "ab") as index_file:
+        index_file.write(b"\x01\x02\x03")
+
+    reopened = HistoryArchive(str(tmp_path), max_segment_bytes=1 << 20)
+    reopened.append([make_item(i) for i in range(101, 200)])
+    assert [item.id for item in reopened.read(1, 0, 2_000_000)] == [*range(100), *range(101, 200)]
+    assert reopened.stats()["torn_records_truncated"] == 1
+    assert segment_path.with_suffix(".idx").stat().st_size % HistoryArchive.INDEX_ENTRY.size == 0
+    reopened.close()
@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Optional
+from unittest.mock import AsyncMock, MagicMock
+
+from discord import Message, TextChannel
+
+from IConfigManager import IConfigManager
+from ILogger import ILogger
+from HistoryBackfill import HistoryBackfill
+from ai.IAIModelProvider import IAIModelProvider
+
+
+BOT_USER_ID = 99
+
+
+@pytest.fixture
+def logger() -> MagicMock:
+    return MagicMock(spec=ILogger)
+
+
+@pytest.fixture
+def config_manager() -> MagicMock:
+    config_manager = MagicMock(spec=IConfigManager)
+    fake_params = {
+        "HISTORY_BACKFILL_MAX_MESSAGES": "3",
+        "HISTORY_BACKFILL_CONCURRENCY": "1"
+    }
+    config_manager.get_parameter.side_effect = lambda param_name: fake_params[param_name]
+    return config_manager
+
+
+@pytest.fixture
+def ai_model_provider() -> MagicMock:
+    provider = MagicMock(spec=IAIModelProvider)
+    provider.get_latest_message_id = AsyncMock(return_value=10)
+    provider.add_messages = AsyncMock()
+    return provider
+
+
+def make_message(message_id: int, author_id: int, bot: bool = False) -> MagicMock:
+    message = MagicMock(spec=Message)
+    message.id = message_id
+    message.author.id = author_id
+    message.author.bot = bot
+    message.content = f"message {message_id}"
+    message.created_at = datetime.fromtimestamp(message_id, timezone.utc)
+    return message
+
+
+def make_channel(messages: list[MagicMock]) -> MagicMock:
+    channel = MagicMock(spec=TextChannel)
+    channel.history_calls = []
+
+    def history(limit: int, after: Optional[Any] = None, oldest_first: Optional[bool] = None) -> AsyncIterator[Any]:
+        channel.history_calls.append((limit, after.id if after else None, oldest_first))
+
+        async def iterate() -> AsyncIterator[Any]:
+            for message in sorted(messages, key=lambda message: message.id, reverse=True)[:limit]:
+                yield message
+        return iterate()
+    channel.history.side_effect = history
+    return channel
+
+
+def make_bot(channels: dict[int, MagicMock]) -> MagicMock:
+    bot = MagicMock()
+    bot.user.id = BOT_USER_ID
+    bot.get_channel.side_effect = lambda channel_id: channels.get(channel_id)
+    return bot
+
+
+def test_backfill_fetches_normalizes_and_adds_each_channel_in_one_batch(
+        config_manager: MagicMock, logger: MagicMock, ai_model_provider: MagicMock) -> None:
+    messages = [make_message(11, 1), make_message(12, BOT_USER_ID, bot=True), make_message(13, 2, bot=True),
+                make_message(14, 1)]
+    channels = {1: make_channel(messages), 2: make_channel([])}
+    normalize_message = AsyncMock()
+    backfill = HistoryBackfill(make_bot(channels), normalize_message, ai_model_provider, config_manager, logger)
+
+    stats = asyncio.run(backfill.run([1, 2, 3], before_id=1000))
+
+    #the newest messages after the last one in history, up to the limit
+    assert channels[1].history_calls == [(3, 10, False)]
+    ai_model_provider.get_latest_message_id.assert_any_await(1, 1000)
+    #other bots are skipped, and only user messages are normalized
+    added = {call.args[0]: [message.id for message in call.args[1]]
+             for call in ai_model_provider.add_messages.await_args_list}
+    assert added == {1: [14, 12], 2: []}
+    assert [call.args[0].id for call in normalize_message.await_args_list] == [14]
+    assert (stats["channels"], stats["messages"]) == (2, 2)
+    assert stats["messages_per_second"] > 0
+    logger.error.assert_called_once() #channel 3 doesn't exist
+
+
+def test_backfill_failure_in_one_channel_doesnt_stop_the_others(
+        config_manager: MagicMock, logger: MagicMock, ai_model_provider: MagicMock) -> None:
+    ai_model_provider.add_messages = AsyncMock(side_effect=[RuntimeError("tokenizer down"), None])
+    channels = {1: make_channel([make_message(11, 1)]), 2: make_channel([make_message(12, 1)])}
+    backfill = HistoryBackfill(make_bot(channels), AsyncMock(), ai_model_provider, config_manager, logger)
+
+    stats = asyncio.run(backfill.run([1, 2]))
+
+    assert (stats["channels"], stats["messages"]) == (1, 1)
+    logger.exception.assert_called_once()
+
+
+def test_backfill_disabled(config_manager: MagicMock, logger: MagicMock, ai_model_provider: MagicMock) -> None:
+    config_manager.get_parameter.side_effect = lambda param_name: "0"
+    channels = {1: make_channel([make_message(11, 1)])}
+    backfill = HistoryBackfill(make_bot(channels), AsyncMock(), ai_model_provider, config_manager, logger)
+
+    assert not backfill.enabled
+    assert asyncio.run(backfill.run([1])) == {}
+    ai_model_provider.add_messages.assert_not_awaited()
+
+
+def test_backfill_skips_providers_without_message_ids(config_manager: MagicMock, logger: MagicMock,
+                                                      ai_model_provider: MagicMock) -> None:
+    ai_model_provider.SUPPORTS_BACKFILL = False
+    channels = {1: make_channel([make_message(11, 1)])}
+    backfill = HistoryBackfill(make_bot(channels), AsyncMock(), ai_model_provider, config_manager, logger)
+
+    assert not backfill.enabled
+    assert asyncio.run(backfill.run([1])) == {}
+    ai_model_provider.add_messages.assert_not_awaited()
@@ -1,13 +1,17 @@
 import asyncio
 import pytest
 from unittest.mock import AsyncMock, MagicMock
-from collections import deque
+from collections import OrderedDict, deque
 from datetime import datetime
 from decimal import Decimal
+from pathlib import Path
 
 from IConfigManager import IConfigManager
 from ILogger import ILogger
 from HistoryManager import HistoryManager, HistoryItem
+from IHistoryManager import HistoryView
+from ChannelHistory import ChannelHistory
+from HistoryWriteBuffer import HistoryWriteBuffer
 
 """
 these tests are pretty incomplete
@@ -15,13 +19,12 @@ TODO: figure out mocking for aioboto3 to test the rest of HistoryManager
 """
 
 @pytest.fixture
-def config_manager_history() -> IConfigManager:
+def config_manager_history(history_params: dict[str, str]) -> IConfigManager:
     config_manager_history = MagicMock(spec=IConfigManager)
-    fake_params = {
+    fake_params = history_params | {
         "AWS_ACCESS_KEY_ID": "fake_access_key",
         "AWS_SECRET_ACCESS_KEY": "fake_secret_key",
-        "AWS_DYNAMODB_TABLE_NAME": "pepeleli-chat-history",
-        "PERSIST_HISTORY": "true"
+        "AWS_DYNAMODB_TABLE_NAME": "pepeleli-chat-history"
     }
     config_manager_history.get_parameter.side_effect = lambda param_name: fake_params[param_name]
 
@@ -45,7 +48,7 @@ def logger() -> ILogger:
 @pytest.fixture
 def sample_history_item() -> HistoryItem:
     return HistoryItem(
-        timestamp=Decimal(datetime.now().timestamp()),
+        timestamp_ms=int(datetime.now().timestamp() * 1000),
         content="Test message",
         name="User",
         id=1234,
@@ -55,21 +58,630 @@ def sample_history_item() -> HistoryItem:
 
 def test_get_history_local_present(history_manager: HistoryManager, sample_history_item: HistoryItem) -> None:
     
-    history_manager._local_history = {1: deque([sample_history_item])}
+    history_manager._local_history = OrderedDict({1: ChannelHistory([sample_history_item])})
 
     async def run_test() -> None:
         history = await history_manager.get_history(1)
-        assert history == deque([sample_history_item])
+        assert list(history) == [sample_history_item]
 
     asyncio.run(run_test())
 
 
 def test_clear_history(history_manager: HistoryManager, sample_history_item: HistoryItem) -> None:
 
-    history_manager._local_history = {1: deque([sample_history_item])}
+    history_manager._local_history = OrderedDict({1: ChannelHistory([sample_history_item])})
 
     async def run_test() -> None:
         await history_manager.clear_history(1)
-        assert history_manager._local_history[1] == deque()
+        assert len(history_manager._local_history[1]) == 0
 
-    asyncio.run(run_test())
\ No newline at end of file
+    asyncio.run(run_test())
+
+def test_add_history_item_drops_duplicate(history_manager: HistoryManager, sample_history_item: HistoryItem) -> None:
+
+    history_manager._local_history = OrderedDict({1: ChannelHistory()})
+    history_manager._token_totals = {1: 0}
+    persist_mock = AsyncMock()
+    history_manager._persist_history_item = persist_mock #type: ignore
+    history_manager._trim_history = AsyncMock() #type: ignore
+
+    async def run_test() -> None:
+        assert not await history_manager.is_duplicate(1, sample_history_item.id)
+        await history_manager.add_history_item(1, sample_history_item)
+        await history_manager.add_history_item(1, sample_history_item)
+        assert await history_manager.is_duplicate(1, sample_history_item.id)
+        assert list(history_manager._local_history[1]) == [sample_history_item]
+        persist_mock.assert_called_once_with(sample_history_item)
+        assert history_manager.get_stats()["duplicates_suppressed"] == 1
+
+    asyncio.run(run_test())
+
+
+def test_failed_add_is_not_recorded_as_seen(history_manager: HistoryManager, sample_history_item: HistoryItem) -> None:
+
+    history_manager._local_history = OrderedDict({1: ChannelHistory()})
+    history_manager._token_totals = {1: 0}
+    persist_mock = AsyncMock(side_effect=[RuntimeError("dynamodb unavailable"), None])
+    history_manager._persist_history_item = persist_mock #type: ignore
+    history_manager._trim_history = AsyncMock() #type: ignore
+
+    async def run_test() -> None:
+        with pytest.raises(RuntimeError):
+            await history_manager.add_history_item(1, sample_history_item)
+        assert not await history_manager.is_duplicate(1, sample_history_item.id)
+        assert list(history_manager._local_history[1]) == []
+
+        #the redelivered message is added rather than dropped as a duplicate
+        await history_manager.add_history_item(1, sample_history_item)
+        assert list(history_manager._local_history[1]) == [sample_history_item]
+        assert history_manager.get_stats()["duplicates_suppressed"] == 0
+
+    asyncio.run(run_test())
+
+
+def test_trim_history_uses_cached_token_counts(history_manager: HistoryManager) -> None:
+
+    history_manager._persist = False
+    history_manager.max_history_len = 25
+    count_tokens = AsyncMock(return_value=10)
+    history_manager.count_tokens = count_tokens
+    items = [HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1) 
+             for i in range(4)]
+
+    async def run_test() -> None:
+        for item in items:
+            await history_manager.add_history_item(1, item)
+        assert list(await history_manager.get_history(1)) == items[2:]
+        assert history_manager._token_totals[1] == 20
+        assert count_tokens.call_count == len(items)
+
+    asyncio.run(run_test())
+
+
+def test_get_history_trusts_persisted_token_counts(history_manager: HistoryManager) -> None:
+
+    history_manager.tokenizer_id = "model-a"
+    count_tokens = AsyncMock(return_value=10)
+    history_manager.count_tokens = count_tokens
+    persisted = deque([
+        HistoryItem(timestamp_ms=1, content="same model", name="User", id=1, channel_id=1,
+                    token_count=7, token_model="model-a"),
+        HistoryItem(timestamp_ms=2, content="other model", name="User", id=2, channel_id=1,
+                    token_count=7, token_model="model-b"),
+        HistoryItem(timestamp_ms=3, content="never counted", name="User", id=3, channel_id=1)
+    ])
+    history_manager._get_persisted_history = AsyncMock(return_value=persisted) #type: ignore
+
+    async def run_test() -> None:
+        history = await history_manager.get_history(1)
+        assert [item.token_count for item in history] == [7, 10, 10]
+        assert all(item.token_model == "model-a" for item in history)
+        assert history_manager._token_totals[1] == 27
+        assert count_tokens.call_count == 2
+
+    asyncio.run(run_test())
+
+
+def test_ensure_token_counts_bounds_concurrency(history_manager: HistoryManager) -> None:
+
+    history_manager._token_count_semaphore = asyncio.Semaphore(3)
+    in_flight = 0
+    peak = 0
+
+    async def count_tokens(items: list[HistoryItem]) -> int:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        return 10
+
+    history_manager.count_tokens = count_tokens
+    items = [HistoryItem(timestamp_ms=i, content="uncounted", name="User", id=i, channel_id=1) for i in range(20)]
+
+    async def run_test() -> None:
+        await history_manager._ensure_token_counts(items)
+        assert all(item.token_count == 10 for item in items)
+        assert peak == 3
+
+    asyncio.run(run_test())
+
+
+def test_item_dynamo_round_trip(history_manager: HistoryManager, sample_history_item: HistoryItem) -> None:
+    sample_history_item.token_count = 12
+    sample_history_item.token_model = "model-a"
+    record = history_manager._item_to_dynamo(sample_history_item)
+    record = {key: Decimal(value) if isinstance(value, int) else value for key, value in record.items()}
+    assert history_manager._item_from_dynamo(record) == sample_history_item
+
+
+def mock_dynamodb_table(history_manager: HistoryManager) -> MagicMock:
+    """Replace the history manager's aioboto3 session with one whose dynamodb table is a mock"""
+    table = MagicMock()
+    dynamodb = MagicMock()
+    dynamodb.Table = AsyncMock(return_value=table)
+    history_manager._session = MagicMock()
+    history_manager._session.resource.return_value.__aenter__.return_value = dynamodb
+    return table
+
+
+def test_get_persisted_history_loads_newest_pages_within_budget(history_manager: HistoryManager) -> None:
+
+    history_manager.tokenizer_id = "model-a"
+    history_manager.max_history_len = 35
+    history_manager._load_page_size = 2
+    records = [{"timestamp": Decimal(i), "content": f"message {i}", "name": "User", "id": Decimal(i),
+                "channel_id": Decimal(1), "token_count": Decimal(10), "token_model": "model-a"}
+               for i in range(5, 0, -1)]
+    pages = [
+        {"Items": records[0:2], "LastEvaluatedKey": {"channel_id": 1, "timestamp": 4}},
+        {"Items": records[2:4], "LastEvaluatedKey": {"channel_id": 1, "timestamp": 2}},
+        {"Items": records[4:]}
+    ]
+    table = mock_dynamodb_table(history_manager)
+    table.query = AsyncMock(side_effect=pages)
+
+    async def run_test() -> None:
+        history = await history_manager._get_persisted_history(1)
+        assert [item.id for item in history] == [3, 4, 5]
+        assert table.query.call_count == 2
+        first_query = table.query.call_args_list[0].kwargs
+        assert first_query["ScanIndexForward"] is False
+        assert first_query["Limit"] == 2
+        assert table.query.call_args_list[1].kwargs["ExclusiveStartKey"] == {"channel_id": 1, "timestamp": 4}
+
+    asyncio.run(run_test())
+
+
+def test_dynamodb_client_is_reused_and_closed(history_manager: HistoryManager, sample_history_item: HistoryItem) -> None:
+
+    table = mock_dynamodb_table(history_manager)
+    table.put_item = AsyncMock()
+    session: MagicMock = history_manager._session #type: ignore
+    resource = session.resource.return_value
+
+    async def run_test() -> None:
+        await history_manager._persist_history_item(sample_history_item)
+        await history_manager._persist_history_item(sample_history_item)
+        assert session.resource.call_count == 1
+        assert table.put_item.call_count == 2
+        stats = history_manager.get_stats()
+        assert stats["pool_requests"] == 2
+        assert stats["pool_in_use"] == 0
+
+        await history_manager.close()
+        resource.__aexit__.assert_called_once()
+
+    asyncio.run(run_test())
+
+
+def test_trim_history_deletes_by_key(history_manager: HistoryManager) -> None:
+
+    history_manager.max_history_len = 15
+    table = mock_dynamodb_table(history_manager)
+    table.query = AsyncMock()
+    batch = MagicMock()
+    batch.delete_item = AsyncMock()
+    table.batch_writer.return_value.__aenter__.return_value = batch
+    items = [HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1,
+                         token_count=10) for i in range(2)]
+    history_manager._local_history = OrderedDict({1: ChannelHistory(items)})
+    history_manager._token_totals = {1: 20}
+
+    async def run_test() -> None:
+        await history_manager._trim_history(1)
+        table.query.assert_not_called()
+        batch.delete_item.assert_called_once_with(Key={"channel_id": 1, "timestamp": Decimal(0)})
+
+    asyncio.run(run_test())
+
+
+def test_trim_history_with_ttl_leaves_expiry_to_dynamodb(history_manager: HistoryManager, 
+                                                         sample_history_item: HistoryItem) -> None:
+
+    history_manager.max_history_len = 15
+    history_manager._ttl_seconds = 3600
+    delete_mock = AsyncMock()
+    history_manager._delete_persisted_items = delete_mock #type: ignore
+    items = [HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1,
+                         token_count=10) for i in range(2)]
+    history_manager._local_history = OrderedDict({1: ChannelHistory(items)})
+    history_manager._token_totals = {1: 20}
+
+    async def run_test() -> None:
+        await history_manager._trim_history(1)
+        delete_mock.assert_not_called()
+        assert history_manager._item_to_dynamo(sample_history_item)["expires_at"] > 0
+
+    asyncio.run(run_test())
+
+
+def test_retrieve_fills_budget_with_items_not_in_context(history_manager: HistoryManager) -> None:
+
+    in_context = HistoryItem(timestamp_ms=5, content="in context", name="User", id=5, channel_id=1,
+                             token_count=10)
+    found = [
+        in_context,
+        HistoryItem(timestamp_ms=3, content="best", name="User", id=3, channel_id=1, token_count=30),
+        HistoryItem(timestamp_ms=1, content="too long", name="User", id=1, channel_id=1, token_count=80),
+        HistoryItem(timestamp_ms=2, content="fits", name="User", id=2, channel_id=1, token_count=20)
+    ]
+    source = MagicMock()
+    source.search = AsyncMock(return_value=found)
+    history_manager._retrieval_sources = [(source, 50)]
+    history_manager._local_history = OrderedDict({1: ChannelHistory([in_context])})
+    history_manager._token_totals = {1: 10}
+
+    async def run_test() -> None:
+        retrieved = await history_manager.retrieve(1, "query")
+        assert [item.id for item in retrieved] == [2, 3]
+        assert history_manager._history_budget == history_manager.max_history_len - 50
+        assert await history_manager.retrieve(1, "") == []
+
+    asyncio.run(run_test())
+
+
+def test_trimmed_items_are_keyword_retrievable(logger: ILogger, config_manager_history: IConfigManager,
+                                               tmp_path: Path) -> None:
+    params = {
+        "PERSIST_HISTORY": "false",
+        "HISTORY_DATA_DIR": str(tmp_path),
+        "HISTORY_KEYWORD_RETRIEVAL": "true",
+        "HISTORY_KEYWORD_TOKEN_BUDGET": "20"
+    }
+    get_parameter = config_manager_history.get_parameter.side_effect #type: ignore
+    config_manager_history.get_parameter.side_effect = lambda name: params.get(name) or get_parameter(name) #type: ignore
+    history_manager = HistoryManager(AsyncMock(return_value=10), str, 50, logger, config_manager_history)
+
+    async def run_test() -> None:
+        for i, content in enumerate(["the password is hunter2", "ok", "what", "fine", "cool"]):
+            await history_manager.add_history_item(1,
+                HistoryItem(timestamp_ms=i, content=content, name="User", id=i, channel_id=1))
+
+        assert [item.id for item in await history_manager.get_history(1)] == [2, 3, 4]
+        assert [item.id for item in await history_manager.retrieve(1, "what was the password?")] == [0]
+        await history_manager.close()
+
+    asyncio.run(run_test())
+
+
+def test_idle_channels_are_evicted_and_reloaded(history_manager: HistoryManager, logger: ILogger) -> None:
+
+    history_manager._memory_budget = 25
+    history_manager._write_buffer = HistoryWriteBuffer(AsyncMock(), logger, 100, 60, 1000)
+    table = mock_dynamodb_table(history_manager)
+    table.query = AsyncMock(return_value={"Items": []})
+
+    async def run_test() -> None:
+        for item_id, channel_id in [(1, 1), (2, 1), (3, 2)]:
+            await history_manager.add_history_item(channel_id, HistoryItem(
+                timestamp_ms=item_id, content="message", name="User", id=item_id, channel_id=channel_id))
+        assert list(history_manager._local_history.keys()) == [2]
+        assert history_manager.get_stats()["evictions"] == 1
+
+        #the evicted channel's items were never flushed, so they come back from the write buffer
+        assert [item.id for item in await history_manager.get_history(1)] == [1, 2]
+        assert list(history_manager._local_history.keys()) == [1]
+        stats = history_manager.get_stats()
+        assert stats["reloads"] == 1
+        assert stats["evictions"] == 2
+        assert stats["resident_tokens"] == 20
+        await history_manager.close()
+
+    asyncio.run(run_test())
+
+
+def test_items_are_compact_and_keep_legacy_dynamo_keys(history_manager: HistoryManager) -> None:
+
+    created_at = datetime(2023, 10, 19, 12, 30, 45, 123000)
+    timestamp_ms = round(created_at.timestamp() * 1000)
+    item = HistoryItem(timestamp_ms=timestamp_ms, content="hi", name="".join(["Us", "er"]), id=1, channel_id=1)
+    other = HistoryItem(timestamp_ms=timestamp_ms, content="hi", name="".join(["Use", "r"]), id=2, channel_id=1)
+
+    assert not hasattr(item, "__dict__")
+    assert item.name is other.name
+    #keys written before timestamps were held in milliseconds were Decimal(created_at.timestamp())
+    assert history_manager._item_to_dynamo(item)["timestamp"] == Decimal(created_at.timestamp())
+    assert history_manager._from_dynamo_timestamp(Decimal(created_at.timestamp())) == timestamp_ms
+
+
+def test_burst_into_cold_channel_loads_once_and_keeps_order(history_manager: HistoryManager) -> None:
+
+    history_manager._persist_history_item = AsyncMock() #type: ignore
+    table = mock_dynamodb_table(history_manager)
+    persisted = {"timestamp": Decimal(0), "content": "persisted", "name": "User", "id": Decimal(100),
+                 "channel_id": Decimal(1), "token_count": Decimal(10), "token_model": ""}
+
+    async def slow_query(**kwargs: object) -> dict:
+        await asyncio.sleep(0.01)
+        return {"Items": [persisted]}
+    table.query = AsyncMock(side_effect=slow_query)
+
+    async def run_test() -> None:
+        await asyncio.gather(
+            history_manager.get_history(1),
+            *(history_manager.add_history_item(1, HistoryItem(
+                timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1)) for i in range(1, 6))
+        )
+        assert table.query.call_count == 1
+        assert [item.id for item in await history_manager.get_history(1)] == [100, 1, 2, 3, 4, 5]
+        assert history_manager._token_totals[1] == 60
+        stats = history_manager.get_stats()
+        assert stats["load_requests"] - stats["loads_shared"] == 1
+
+    asyncio.run(run_test())
+
+
+def test_warm_up_loads_channels_concurrently_within_limits(history_manager: HistoryManager) -> None:
+
+    history_manager._warmup_concurrency = 2
+    history_manager._memory_budget = 25
+    table = mock_dynamodb_table(history_manager)
+    in_flight = 0
+    peak = 0
+    started: list[int] = []
+
+    async def slow_query(**kwargs: object) -> dict:
+        nonlocal in_flight, peak
+        channel_id = int(kwargs["KeyConditionExpression"]._values[1]) #type: ignore
+        started.append(channel_id)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return {"Items": [{"timestamp": Decimal(1), "content": "hi", "name": "User", "id": Decimal(channel_id),
+                           "channel_id": Decimal(channel_id), "token_count": Decimal(10), "token_model": ""}]}
+    table.query = AsyncMock(side_effect=slow_query)
+
+    async def run_test() -> None:
+        timings = await history_manager.warm_up([3, 1, 2, 4, 5])
+        assert peak == 2
+        assert started[:2] == [3, 1]
+        #two channels fit the memory budget, loading the next two evicts, so the last is skipped
+        assert sorted(timings) == [1, 2, 3, 4]
+        assert 5 not in history_manager._local_history
+        assert len(history_manager._local_history) == 2
+
+    asyncio.run(run_test())
+
+
+def test_trimmed_items_are_summarized(logger: ILogger, config_manager_history: IConfigManager,
+                                      tmp_path: Path) -> None:
+    params = {
+        "PERSIST_HISTORY": "false",
+        "HISTORY_DATA_DIR": str(tmp_path),
+        "HISTORY_SUMMARIZE": "true",
+        "HISTORY_SUMMARY_TOKEN_BUDGET": "20",
+        "HISTORY_SUMMARY_BATCH_SIZE": "2"
+    }
+    get_parameter = config_manager_history.get_parameter.side_effect #type: ignore
+    config_manager_history.get_parameter.side_effect = lambda name: params.get(name) or get_parameter(name) #type: ignore
+    summarize = AsyncMock(side_effect=lambda summary, items, max_tokens: f"{len(items)} messages about cats")
+    history_manager = HistoryManager(AsyncMock(return_value=10), str, 50, logger, config_manager_history, "", summarize)
+
+    async def run_test() -> None:
+        assert history_manager._history_budget == 30
+        for i in range(5):
+            await history_manager.add_history_item(1,
+                HistoryItem(timestamp_ms=i + 1, content="cats", name="User", id=i, channel_id=1))
+        await asyncio.sleep(0.01)
+
+        assert [item.id for item in await history_manager.get_history(1)] == [2, 3, 4]
+        assert await history_manager.get_summary(1) == "2 messages about cats"
+        assert summarize.call_args.args[2] == 20
+        assert await history_manager.get_summary(2) == ""
+        await history_manager.close()
+        assert history_manager.get_stats()["summarizer_summaries_updated"] == 1
+
+    asyncio.run(run_test())
+
+
+def test_close_flushes_writes_even_if_a_source_fails(history_manager: HistoryManager, logger: ILogger) -> None:
+    flush_items = AsyncMock()
+    history_manager._write_buffer = HistoryWriteBuffer(flush_items, logger, 100, 60, 1000)
+    failing_source = MagicMock()
+    failing_source.close = AsyncMock(side_effect=OSError("disk full"))
+    other_source = MagicMock()
+    other_source.close = AsyncMock()
+    history_manager._retrieval_sources = [(failing_source, 10), (other_source, 10)]
+
+    async def run_test() -> None:
+        await history_manager._write_buffer.add( #type: ignore
+            HistoryItem(timestamp_ms=1, content="unflushed", name="User", id=1, channel_id=1))
+        await history_manager.close()
+        assert flush_items.call_count == 1
+        other_source.close.assert_called_once()
+        logger.exception.assert_called_once() #type: ignore
+
+    asyncio.run(run_test())
+
+
+def test_cold_load_with_ttl_skips_expired_items(history_manager: HistoryManager) -> None:
+
+    history_manager._ttl_seconds = 3600
+    now = int(datetime.now().timestamp())
+    records = [{"timestamp": Decimal(i), "content": f"message {i}", "name": "User", "id": Decimal(i),
+                "channel_id": Decimal(1), "token_count": Decimal(10), "expires_at": Decimal(now + 60)}
+               for i in range(3, 1, -1)]
+    table = mock_dynamodb_table(history_manager)
+    table.query = AsyncMock(return_value={"Items": records})
+
+    async def run_test() -> None:
+        history = await history_manager.get_history(1)
+        assert [item.id for item in history] == [2, 3]
+        #the retention window counts from the write, and expired items are filtered out of the load
+        filter_expression = table.query.call_args.kwargs["FilterExpression"]
+        assert filter_expression.get_expression()["operator"] == "OR"
+        _, unexpired = filter_expression.get_expression()["values"]
+        assert unexpired.get_expression()["values"][1] >= now
+
+        history_manager._ttl_seconds = 0
+        history_manager._local_history.clear()
+        await history_manager.get_history(1)
+        assert "FilterExpression" not in table.query.call_args.kwargs
+
+    asyncio.run(run_test())
+
+
+def test_memory_budget_without_persistence_warns(logger: ILogger, config_manager_history: IConfigManager) -> None:
+    params = {"PERSIST_HISTORY": "false", "HISTORY_MEMORY_BUDGET_TOKENS": "25"}
+    get_parameter = config_manager_history.get_parameter.side_effect #type: ignore
+    config_manager_history.get_parameter.side_effect = lambda name: params.get(name) or get_parameter(name) #type: ignore
+    history_manager = HistoryManager(AsyncMock(return_value=10), str, 50, logger, config_manager_history)
+
+    logger.warning.assert_called_once() #type: ignore
+    assert "PERSIST_HISTORY" in logger.warning.call_args.args[0] #type: ignore
+
+    async def run_test() -> None:
+        for channel_id in range(3):
+            await history_manager.add_history_item(channel_id,
+                HistoryItem(timestamp_ms=1, content="hi", name="User", id=channel_id, channel_id=channel_id))
+        #nothing to reload evicted channels from, so they all stay resident
+        assert history_manager.get_stats()["evictions"] == 0
+        assert len(history_manager._local_history) == 3
+
+    asyncio.run(run_test())
+
+
+def test_restart_restores_history_from_snapshot(logger: ILogger, config_manager_history: IConfigManager,
+                                                tmp_path: Path) -> None:
+    params = {"PERSIST_HISTORY": "false", "HISTORY_DATA_DIR": str(tmp_path), "HISTORY_SNAPSHOT": "true"}
+    get_parameter = config_manager_history.get_parameter.side_effect #type: ignore
+    config_manager_history.get_parameter.side_effect = lambda name: params.get(name) or get_parameter(name) #type: ignore
+
+    def make_item(i: int, channel_id: int) -> HistoryItem:
+        return HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=channel_id)
+
+    async def run_test() -> None:
+        history_manager = HistoryManager(AsyncMock(return_value=10), str, 30, logger, config_manager_history)
+        await history_manager.warm_up([])
+        for i in range(4):
+            await history_manager.add_history_item(1, make_item(i, 1))
+        await history_manager.add_history_item(2, make_item(10, 2))
+        await history_manager.close()
+
+        #restored items keep their token counts, so the restarted manager doesn't count them again
+        count_tokens = AsyncMock(return_value=10)
+        restarted = HistoryManager(count_tokens, str, 30, logger, config_manager_history)
+        #a message arriving before the restore is merged with the restored history
+        await restarted.add_history_item(2, make_item(11, 2))
+        await restarted.warm_up([])
+        assert count_tokens.call_count == 1
+        assert [item.id for item in await restarted.get_history(1)] == [1, 2, 3]
+        assert [item.id for item in await restarted.get_history(2)] == [10, 11]
+        assert restarted._token_totals[1] == 30
+        assert await restarted.is_duplicate(1, 3)
+        assert restarted.get_stats()["snapshot_items_restored"] == 4
+        await restarted.close()
+
+    asyncio.run(run_test())
+
+
+def test_get_history_returns_a_view_unchanged_by_later_updates(history_manager: HistoryManager) -> None:
+
+    history_manager._persist = False
+    history_manager.max_history_len = 30
+
+    async def run_test() -> None:
+        for i in range(3):
+            await history_manager.add_history_item(1,
+                HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1))
+        view = await history_manager.get_history(1)
+        #an append which trims the oldest item, as happens while a prompt is being built
+        await history_manager.add_history_item(1,
+            HistoryItem(timestamp_ms=3, content="message 3", name="User", id=3, channel_id=1))
+        assert [item.id for item in view] == [0, 1, 2]
+        assert [item.id for item in await history_manager.get_history(1)] == [1, 2, 3]
+
+    asyncio.run(run_test())
+
+
+def test_oversized_items_are_truncated_and_spilled(logger: ILogger, config_manager_history: IConfigManager,
+                                                   tmp_path: Path) -> None:
+    params = {
+        "PERSIST_HISTORY": "false",
+        "HISTORY_DATA_DIR": str(tmp_path),
+        "HISTORY_ARCHIVE": "true",
+        "HISTORY_MAX_ITEM_TOKENS": "50",
+        "HISTORY_SPILL_TRUNCATED": "true"
+    }
+    get_parameter = config_manager_history.get_parameter.side_effect #type: ignore
+    config_manager_history.get_parameter.side_effect = lambda name: params.get(name) or get_parameter(name) #type: ignore
+    count_tokens = AsyncMock(side_effect=lambda items: sum(len(item.content) // 4 for item in items))
+    history_manager = HistoryManager(count_tokens, str, 120, logger, config_manager_history)
+    pasted_log = "".join(f"log line {i}\n" for i in range(200))
+
+    async def run_test() -> None:
+        await history_manager.add_history_item(1,
+            HistoryItem(timestamp_ms=1, content=pasted_log, name="User", id=1, channel_id=1))
+        stored = (await history_manager.get_history(1))[0]
+        assert stored.token_count is not None and stored.token_count <= 50
+        assert stored.content.startswith("log line 0\n") and stored.content.endswith("log line 199\n")
+        assert "characters cut ...]" in stored.content
+        assert history_manager.get_stats()["items_truncated"] == 1
+
+        #once trimmed from context, the archive hands back the full message
+        for i in range(2, 6):
+            await history_manager.add_history_item(1,
+                HistoryItem(timestamp_ms=i, content="x" * 160, name="User", id=i, channel_id=1))
+        assert 1 not in [item.id for item in await history_manager.get_history(1)]
+        archived = await history_manager.get_archived_history(1, 0, 10)
+        assert archived[0].id == 1 and archived[0].content == pasted_log
+
+    asyncio.run(run_test())
+
+
+def test_add_history_items_merges_a_backfilled_batch_with_one_write(history_manager: HistoryManager) -> None:
+
+    history_manager._local_history = OrderedDict({1: ChannelHistory()})
+    history_manager._token_totals = {1: 0}
+    persist_items = AsyncMock()
+    history_manager._persist_history_item = AsyncMock() #type: ignore
+    history_manager._persist_history_items = persist_items #type: ignore
+    history_manager.max_history_len = 50
+
+    def make_item(i: int) -> HistoryItem:
+        return HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1)
+
+    async def run_test() -> None:
+        #a live message arrives while the older messages are being fetched
+        await history_manager.add_history_item(1, make_item(5))
+        await history_manager.add_history_items(1, [make_item(i) for i in (5, 4, 2, 3, 1)])
+
+        #merged in timestamp order, and the live message isn't added again
+        assert [item.id for item in await history_manager.get_history(1)] == [1, 2, 3, 4, 5]
+        assert history_manager._token_totals[1] == 50
+        persist_items.assert_awaited_once()
+        assert [item.id for item in persist_items.await_args_list[0].args[0]] == [1, 2, 3, 4]
+
+        await history_manager.add_history_items(1, [make_item(3), make_item(4)])
+        persist_items.assert_awaited_once()
+
+    asyncio.run(run_test())
+
+
+def test_get_context_selects_the_reply_chain_once_over_budget(logger: ILogger,
+                                                               config_manager_history: IConfigManager) -> None:
+    params = {"PERSIST_HISTORY": "false", "HISTORY_CONTEXT_TOKENS": "30"}
+    get_parameter = config_manager_history.get_parameter.side_effect #type: ignore
+    config_manager_history.get_parameter.side_effect = lambda name: params.get(name) or get_parameter(name) #type: ignore
+    history_manager = HistoryManager(AsyncMock(return_value=10), str, 60, logger, config_manager_history)
+
+    def make_item(i: int, name: str, content: str) -> HistoryItem:
+        return HistoryItem(timestamp_ms=i, content=content, name=name, id=i, channel_id=1)
+
+    async def run_test() -> None:
+        await history_manager.add_history_item(1, make_item(1, "alice", "hello"))
+        await history_manager.add_history_item(1, make_item(2, "bob", "hi"))
+        assert [item.id for item in await history_manager.get_context(1, reply_id=2)] == [1, 2]
+        assert isinstance(await history_manager.get_context(1, reply_id=2), HistoryView)
+
+        for i, name in [(3, "carol"), (4, "bob"), (5, "carol"), (6, "alice")]:
+            await history_manager.add_history_item(1, make_item(i, name, "chatter"))
+        await history_manager.add_history_item(1, make_item(7, "dave", "[reply to: 2] what did bob say?"))
+        #1 was trimmed, so the chain is 7 and 2, then the newest message
+        assert [item.id for item in await history_manager.get_context(1, reply_id=7)] == [2, 6, 7]
+        assert [item.id for item in await history_manager.get_context(1)] == [5, 6, 7]
+        assert history_manager.get_stats()["context_chain_items_selected"] == 2
+
+    asyncio.run(run_test())
@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from pathlib import Path
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistorySnapshot import HistorySnapshot
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+def make_item(i: int, channel_id: int = 1) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=f"message {i} ✓", name="User", id=i, channel_id=channel_id,
+                       token_count=10, token_model="model-a")
+
+
+def test_snapshot_round_trip(logger: ILogger, tmp_path: Path) -> None:
+    items = [make_item(1), make_item(2), make_item(3, channel_id=2)]
+    path = str(tmp_path / "snapshot.bin")
+
+    async def run_test() -> None:
+        snapshot = HistorySnapshot(path, lambda: items, logger, 60)
+        assert snapshot.load() == ([], False)
+        assert await snapshot.save()
+        assert snapshot.load() == (items, False)
+
+        await snapshot.close()
+        assert snapshot.load() == (items, True)
+        assert snapshot.stats()["snapshots"] == 2
+        assert snapshot.stats()["items_restored"] == 3
+
+    asyncio.run(run_test())
+
+
+def test_failed_save_keeps_previous_snapshot(logger: ILogger, tmp_path: Path) -> None:
+    items = [make_item(1)]
+    path = str(tmp_path / "snapshot.bin")
+
+    async def run_test() -> None:
+        snapshot = HistorySnapshot(path, lambda: items, logger, 60)
+        assert await snapshot.save()
+        items.append(make_item(2))
+        with patch("HistorySnapshot.os.replace", side_effect=OSError("disk full")):
+            assert not await snapshot.save()
+        assert snapshot.load() == ([make_item(1)], False)
+        assert snapshot.stats()["failures"] == 1
+
+    asyncio.run(run_test())
+
+
+def test_unreadable_snapshot_restores_nothing(logger: ILogger, tmp_path: Path) -> None:
+    path = tmp_path / "snapshot.bin"
+    snapshot = HistorySnapshot(str(path), lambda: [], logger, 60)
+    path.write_bytes(b"not a snapshot")
+    assert snapshot.load() == ([], False)
+    path.write_bytes(HistorySnapshot.HEADER.pack(HistorySnapshot.MAGIC, HistorySnapshot.VERSION, 1, 0) + b"\x30")
+    assert snapshot.load() == ([], False)
+
+
+def test_snapshots_are_taken_in_the_background(logger: ILogger, tmp_path: Path) -> None:
+    path = str(tmp_path / "snapshot.bin")
+
+    async def run_test() -> None:
+        snapshot = HistorySnapshot(path, lambda: [make_item(1)], logger, 0.01)
+        snapshot.start()
+        await asyncio.sleep(0.05)
+        assert snapshot.stats()["snapshots"] >= 2
+        await snapshot.close()
+        assert snapshot.load()[1]
+
+    asyncio.run(run_test())
@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from pathlib import Path
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistorySummarizer import HistorySummarizer
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+def make_item(i: int, channel_id: int = 1) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=channel_id)
+
+
+async def fold(summary: str, items: list[HistoryItem], max_tokens: int) -> str:
+    return " ".join([summary] + [item.content for item in items]).strip()
+
+
+def test_summarizes_in_batches_and_persists(logger: ILogger, tmp_path: Path) -> None:
+    summarize = AsyncMock(side_effect=fold)
+
+    async def run_test() -> None:
+        summarizer = HistorySummarizer(summarize, str(tmp_path), logger, max_tokens=50, min_batch=2)
+        summarizer.add_items([make_item(1), make_item(2, channel_id=2)])
+        await asyncio.sleep(0.01)
+        summarize.assert_not_called()
+
+        summarizer.add_items([make_item(3)])
+        await asyncio.sleep(0.01)
+        summarize.assert_called_once_with("", [make_item(1), make_item(3)], 50)
+        assert await summarizer.get_summary(1) == "message 1 message 3"
+
+        await summarizer.close()
+        assert summarizer.stats()["items_summarized"] == 3
+
+        reopened = HistorySummarizer(summarize, str(tmp_path), logger, max_tokens=50, min_batch=2)
+        assert await reopened.get_summary(2) == "message 2"
+        #items already covered by a saved summary aren't folded in again
+        reopened.add_items([make_item(3), make_item(4)])
+        await reopened.close()
+        assert await reopened.get_summary(1) == "message 1 message 3 message 4"
+
+    asyncio.run(run_test())
+
+
+def test_failed_summary_is_retried_with_later_items(logger: ILogger, tmp_path: Path) -> None:
+    summarize = AsyncMock(side_effect=[RuntimeError("model down"), "later summary"])
+
+    async def run_test() -> None:
+        summarizer = HistorySummarizer(summarize, str(tmp_path), logger, max_tokens=50, min_batch=1)
+        summarizer.add_items([make_item(1)])
+        await asyncio.sleep(0.01)
+        assert await summarizer.get_summary(1) == ""
+        assert summarizer.stats()["failures"] == 1
+        assert summarizer.stats()["pending"] == 1
+
+        summarizer.add_items([make_item(2)])
+        await summarizer.close()
+        assert summarize.call_args.args[1] == [make_item(1), make_item(2)]
+        assert await summarizer.get_summary(1) == "later summary"
+        assert summarizer.stats()["items_lost"] == 0
+
+    asyncio.run(run_test())
+
+
+def test_close_counts_unsummarized_items_as_lost(logger: ILogger, tmp_path: Path) -> None:
+    summarize = AsyncMock(side_effect=RuntimeError("model down"))
+
+    async def run_test() -> None:
+        summarizer = HistorySummarizer(summarize, str(tmp_path), logger, max_tokens=50, min_batch=5)
+        summarizer.add_items([make_item(1), make_item(2)])
+        await summarizer.close()
+        stats = summarizer.stats()
+        assert stats["items_lost"] == 2
+        assert stats["pending"] == 0
+
+    asyncio.run(run_test())
+
+
+def test_items_are_dropped_after_repeated_failures(logger: ILogger, tmp_path: Path) -> None:
+    #an empty summary counts as a failure, rather than replacing the summary so far
+    summarize = AsyncMock(side_effect=["first summary", "", RuntimeError("model down"), RuntimeError("model down")])
+
+    async def run_test() -> None:
+        summarizer = HistorySummarizer(summarize, str(tmp_path), logger, max_tokens=50, min_batch=1)
+        summarizer.add_items([make_item(1)])
+        await asyncio.sleep(0.01)
+        for i in range(2, 2 + HistorySummarizer.MAX_ATTEMPTS):
+            summarizer.add_items([make_item(i)])
+            await asyncio.sleep(0.01)
+        stats = summarizer.stats()
+        assert stats["failures"] == 3
+        assert stats["items_lost"] == 3
+        assert stats["pending"] == 0
+        assert await summarizer.get_summary(1) == "first summary"
+
+    asyncio.run(run_test())
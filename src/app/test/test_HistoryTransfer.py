@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+from IConfigManager import IConfigManager
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+from HistoryTransfer import HistoryExportDirectory, HistoryTransfer
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+def make_sqlite_store(logger: ILogger, path: Path) -> HistoryManager:
+    params = {
+        "PERSIST_HISTORY": "true",
+        "HISTORY_BACKEND": "sqlite",
+        "HISTORY_SQLITE_PATH": str(path),
+        "HISTORY_LOAD_PAGE_SIZE": "7"
+    }
+    config_manager = MagicMock(spec=IConfigManager)
+    config_manager.get_parameter.side_effect = lambda param_name: params.get(param_name, "")
+    return HistoryManager.create(AsyncMock(), str, 0, logger, config_manager)
+
+
+def make_items() -> list[HistoryItem]:
+    return [HistoryItem(timestamp_ms=1000 + i, content=f"message {i}", name="User", id=channel_id * 100 + i,
+                        channel_id=channel_id, token_count=10, token_model="test-model")
+            for channel_id in (1, 2, 3) for i in range(20)]
+
+
+async def scan_all(store: HistoryManager) -> list[HistoryItem]:
+    return [item async for page, _ in store.scan_persisted_history(0, 1) for item in page]
+
+
+def test_export_and_import_round_trip(logger: ILogger, tmp_path: Path) -> None:
+
+    async def run_test() -> None:
+        source = make_sqlite_store(logger, tmp_path / "source.db")
+        await source.import_history_items(make_items())
+        export = HistoryExportDirectory(str(tmp_path / "export"), 7)
+
+        exported = await HistoryTransfer(source, export, "export", 2, str(tmp_path / "export.json"), logger).run()
+        assert exported["items"] == 60 and exported["items_per_second"] > 0
+        #channels are split across the parts, each channel kept whole and in order
+        assert export.total_segments == 2
+
+        target = make_sqlite_store(logger, tmp_path / "target.db")
+        imported = await HistoryTransfer(export, target, "import", 2, str(tmp_path / "import.json"), logger).run()
+        assert imported["items"] == 60
+        assert await scan_all(target) == make_items()
+        await source.close()
+        await target.close()
+
+    asyncio.run(run_test())
+
+
+def test_interrupted_transfer_resumes_from_its_checkpoint(logger: ILogger, tmp_path: Path) -> None:
+
+    async def run_test() -> None:
+        source = make_sqlite_store(logger, tmp_path / "source.db")
+        await source.import_history_items(make_items())
+        export = HistoryExportDirectory(str(tmp_path / "export"), 7)
+        write = export.write
+        writes = 0
+
+        async def failing_write(segment: int, items: list[HistoryItem]) -> None:
+            nonlocal writes
+            writes += 1
+            await write(segment, items)
+            if writes == 4:
+                raise OSError("disk full")
+        export.write = failing_write #type: ignore
+
+        checkpoint = str(tmp_path / "export.json")
+        with pytest.raises(OSError):
+            await HistoryTransfer(source, export, "export", 1, checkpoint, logger).run()
+
+        #the page written before the failure isn't in the checkpoint, so it's cut from the export and written again
+        resumed = await HistoryTransfer(source, export, "export", 1, checkpoint, logger).run()
+        assert resumed["items"] < 60 and resumed["total_items"] == 60
+        exported = [item async for page, _ in export.scan(0, 1) for item in page]
+        assert exported == make_items()
+        #a finished transfer has nothing left to do
+        rerun = await HistoryTransfer(source, export, "export", 1, checkpoint, logger).run()
+        assert rerun["items"] == 0 and rerun["total_items"] == 60
+
+        with pytest.raises(ValueError):
+            await HistoryTransfer(source, export, "another transfer", 1, checkpoint, logger).run()
+        await source.close()
+
+    asyncio.run(run_test())
@@ -0,0 +1,111 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryWriteBuffer import HistoryWriteBuffer
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+def make_item(i: int) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=f"message {i}", name="User", id=i, channel_id=1)
+
+
+def test_flush_on_batch_size(logger: ILogger) -> None:
+    flush_items = AsyncMock()
+    buffer = HistoryWriteBuffer(flush_items, logger, max_batch_size=3, max_age=60, max_pending=100)
+
+    async def run_test() -> None:
+        for i in range(3):
+            await buffer.add(make_item(i))
+        await asyncio.sleep(0.01)
+        flush_items.assert_called_once_with([make_item(i) for i in range(3)])
+        assert buffer.stats()["depth"] == 0
+        await buffer.close()
+
+    asyncio.run(run_test())
+
+
+def test_flush_on_age(logger: ILogger) -> None:
+    flush_items = AsyncMock()
+    buffer = HistoryWriteBuffer(flush_items, logger, max_batch_size=100, max_age=0.05, max_pending=100)
+
+    async def run_test() -> None:
+        await buffer.add(make_item(1))
+        await asyncio.sleep(0.01)
+        flush_items.assert_not_called()
+        await asyncio.sleep(0.1)
+        flush_items.assert_called_once_with([make_item(1)])
+        await buffer.close()
+
+    asyncio.run(run_test())
+
+
+def test_close_flushes_and_counts_lost_items(logger: ILogger) -> None:
+    flush_items = AsyncMock(side_effect=Exception("dynamodb unavailable"))
+    buffer = HistoryWriteBuffer(flush_items, logger, max_batch_size=100, max_age=60, max_pending=100)
+
+    async def run_test() -> None:
+        await buffer.add(make_item(1))
+        await buffer.add(make_item(2))
+        await buffer.close()
+        assert flush_items.call_count == 1
+        stats = buffer.stats()
+        assert stats["items_lost"] == 2
+        assert stats["flush_failures"] == 1
+        assert stats["depth"] == 0
+
+    asyncio.run(run_test())
+
+
+def test_close_lets_flush_in_progress_finish(logger: ILogger) -> None:
+    async def slow_flush(items: list[HistoryItem]) -> None:
+        await asyncio.sleep(0.05)
+    flush_items = AsyncMock(side_effect=slow_flush)
+    buffer = HistoryWriteBuffer(flush_items, logger, max_batch_size=2, max_age=60, max_pending=100)
+
+    async def run_test() -> None:
+        await buffer.add(make_item(1))
+        await buffer.add(make_item(2))
+        await asyncio.sleep(0.01)
+        await buffer.close()
+        stats = buffer.stats()
+        assert stats["items_flushed"] == 2
+        assert stats["items_lost"] == 0
+
+    asyncio.run(run_test())
+
+
+def test_backpressure_waits_for_flush(logger: ILogger) -> None:
+    flush_items = AsyncMock()
+    buffer = HistoryWriteBuffer(flush_items, logger, max_batch_size=100, max_age=60, max_pending=2)
+
+    async def run_test() -> None:
+        for i in range(3):
+            await buffer.add(make_item(i))
+        flush_items.assert_called_once_with([make_item(0), make_item(1)])
+        assert buffer.stats()["backpressure_waits"] == 1
+        assert buffer.stats()["depth"] == 1
+        await buffer.close()
+        assert flush_items.call_count == 2
+
+    asyncio.run(run_test())
+
+
+def test_discard_drops_pending_items(logger: ILogger) -> None:
+    flush_items = AsyncMock()
+    buffer = HistoryWriteBuffer(flush_items, logger, max_batch_size=100, max_age=60, max_pending=100)
+
+    async def run_test() -> None:
+        await buffer.add(make_item(1))
+        await buffer.add(make_item(2))
+        buffer.discard([make_item(1)])
+        await buffer.close()
+        flush_items.assert_called_once_with([make_item(2)])
+
+    asyncio.run(run_test())
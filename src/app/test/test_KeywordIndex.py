@@ -0,0 +1,96 @@
+import asyncio
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from IHistoryManager import HistoryItem
+from HistoryArchive import HistoryArchive, ArchiveRef
+from retrieval.KeywordIndex import KeywordIndex
+from retrieval.KeywordRetriever import KeywordRetriever
+
+
+def make_item(i: int, content: str) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=content, name="User", id=i, channel_id=1, token_count=5)
+
+
+def make_items() -> list[HistoryItem]:
+    return [
+        make_item(1, "the build is green again"),
+        make_item(2, "see https://github.com/example/pepeleli/pull/17 for the fix"),
+        make_item(3, "the build the build the build"),
+        make_item(4, "Gandalf said the build was fine")
+    ]
+
+
+def refs_of(items: list[HistoryItem]) -> list[ArchiveRef]:
+    """Stand-in archive references, with the item id as the offset"""
+    return [(0, item.id) for item in items]
+
+
+def test_search_ranks_by_bm25() -> None:
+    index = KeywordIndex()
+    index.add(make_items(), refs_of(make_items()))
+
+    assert [ref for _, ref in index.search("github pull 17", limit=5)] == [(0, 2)]
+    results = index.search("gandalf build", limit=5)
+    assert results[0][1] == (0, 4)
+    assert {ref for _, ref in results} == {(0, 1), (0, 3), (0, 4)}
+    assert results[0][0] > results[1][0]
+    assert index.search("nothing matches", limit=5) == []
+    assert index.search("", limit=5) == []
+
+
+def test_save_load_and_keep_adding(tmp_path: Path) -> None:
+    index = KeywordIndex()
+    index.add(make_items()[:2], refs_of(make_items()[:2]))
+    index.save(str(tmp_path))
+
+    loaded = KeywordIndex.load(str(tmp_path))
+    assert len(loaded) == 2
+    loaded.add(make_items()[2:], refs_of(make_items()[2:]))
+    assert {ref for _, ref in loaded.search("build", limit=5)} == {(0, 1), (0, 3), (0, 4)}
+    loaded.save(str(tmp_path))
+
+    reloaded = KeywordIndex.load(str(tmp_path))
+    assert len(reloaded) == 4
+    assert [ref for _, ref in reloaded.search("pepeleli", limit=5)] == [(0, 2)]
+    assert reloaded.search("gandalf build", limit=1)[0][1] == (0, 4)
+
+
+def test_retriever_searches_per_channel_and_persists(tmp_path: Path) -> None:
+    async def run_test() -> None:
+        archive = HistoryArchive(str(tmp_path / "archive"), max_segment_bytes=1024)
+        retriever = KeywordRetriever(archive, str(tmp_path / "keywords"))
+        await retriever.add_items(make_items(), archive.append(make_items()))
+        assert await retriever.search(1, "gandalf", limit=3) == [make_items()[3]]
+        assert await retriever.search(2, "gandalf", limit=3) == []
+        await retriever.close()
+
+        reopened = KeywordRetriever(HistoryArchive(str(tmp_path / "archive"), 1024), str(tmp_path / "keywords"))
+        assert [item.id for item in await reopened.search(1, "github", limit=3)] == [2]
+
+    asyncio.run(run_test())
+
+
+def test_failed_save_keeps_previous_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    index = KeywordIndex()
+    index.add(make_items()[:2], refs_of(make_items()[:2]))
+    index.save(str(tmp_path))
+    index.add(make_items()[2:], refs_of(make_items()[2:]))
+
+    real_save = np.save
+    def failing_save(path: str, array: np.ndarray) -> None:
+        if path.endswith("lengths.npy"):
+            raise OSError("disk full")
+        real_save(path, array)
+    monkeypatch.setattr(np, "save", failing_save)
+    with pytest.raises(OSError):
+        index.save(str(tmp_path))
+    assert len(KeywordIndex.load(str(tmp_path))) == 2
+
+    monkeypatch.setattr(np, "save", real_save)
+    index.save(str(tmp_path))
+    assert len(KeywordIndex.load(str(tmp_path))) == 4
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("gen-")]) == 1
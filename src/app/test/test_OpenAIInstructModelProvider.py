@@ -5,7 +5,6 @@ from unittest.mock import MagicMock, AsyncMock
 import asyncio
 from typing import Any
 from datetime import datetime
-from decimal import Decimal
 
 from discord import Message, User
 
@@ -16,17 +15,16 @@ from HistoryManager import HistoryManager, HistoryItem
 
 
 @pytest.fixture
-def config_manager_instruct() -> IConfigManager:
+def config_manager_instruct(history_params: dict[str, str]) -> IConfigManager:
     config_manager_instruct = MagicMock(spec=IConfigManager)
-    fake_params = {
+    fake_params = history_params | {
         "OPENAI_API_KEY": "fake_api_key",
         "OPENAI_INSTRUCT_PROVIDER_BASE_URI": "fake_base_uri",
         "OPENAI_INSTRUCT_RESPONSE_MODEL": "fake_instruct_response_model",
         "OPENAI_MAX_CONTEXT_LEN": "4096",
         "BOT_USERNAME": "BotUsername",
         "STOP_SEQUENCES": '["<messageID="]',
-        "OPENAI_MODERATION_THRESHOLD": "0",
-        "PERSIST_HISTORY": "true"
+        "OPENAI_MODERATION_THRESHOLD": "0"
     }
     config_manager_instruct.get_parameter.side_effect = lambda param_name: fake_params[param_name]
 
@@ -127,7 +125,7 @@ def test_history_append_user(
         assert new_item.name == msg.author.display_name
         assert new_item.id == msg.id
         assert new_item.channel_id == msg.channel.id
-        assert new_item.timestamp == Decimal(msg.created_at.timestamp())
+        assert new_item.timestamp_ms == round(msg.created_at.timestamp() * 1000)
 
     asyncio.run(verify_new_item())
 
@@ -158,6 +156,6 @@ def test_history_append_bot(
         assert new_item.name == openai_instruct_model_provider.BOT_USERNAME
         assert new_item.id == msg.id
         assert new_item.channel_id == msg.channel.id
-        assert new_item.timestamp == Decimal(msg.created_at.timestamp())
+        assert new_item.timestamp_ms == round(msg.created_at.timestamp() * 1000)
 
     asyncio.run(verify_new_item())
\ No newline at end of file
@@ -0,0 +1,66 @@
+import attr
+
+from IHistoryManager import HistoryItem
+from PromptAssembler import PromptAssembler
+
+
+def make_item(i: int) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=f"message {i}", name=f"user{i % 3}", id=i, channel_id=1)
+
+
+def format_msg(item: HistoryItem) -> str:
+    return f"<messageID={item.id}> {item.name}: {item.content}\n"
+
+
+def test_render_matches_full_join_as_history_slides() -> None:
+    assembler = PromptAssembler(format_msg)
+    history = [make_item(i) for i in range(10)]
+    assert "".join(assembler.render(1, history)) == "".join(format_msg(item) for item in history)
+
+    for i in range(10, 15):
+        #the oldest item is trimmed and a new one appended, as in a full channel
+        history = history[1:] + [make_item(i)]
+        assert "".join(assembler.render(1, history)) == "".join(format_msg(item) for item in history)
+
+    stats = assembler.stats()
+    assert stats["full_renders"] == 1
+    assert stats["incremental_renders"] == 5
+    #each item was rendered once, when it first appeared
+    assert stats["lines_rendered"] == 15
+
+
+def test_render_falls_back_to_cached_lines_for_other_selections() -> None:
+    assembler = PromptAssembler(format_msg)
+    history = [make_item(i) for i in range(10)]
+    assembler.render(1, history)
+
+    #a selection from the middle, e.g. a reply chain, can't reuse the last render but reuses its lines
+    selection = [history[2], history[5], history[9]]
+    assert "".join(assembler.render(1, selection)) == "".join(format_msg(item) for item in selection)
+    assert assembler.stats()["full_renders"] == 2
+    assert assembler.stats()["lines_rendered"] == 10
+
+    #a selection sharing its first and last items with the previous one, but not the items between
+    a, c, d, e, f = (make_item(i) for i in (1, 3, 4, 5, 6))
+    assembler.render(2, [a, c, e])
+    assert "".join(assembler.render(2, [a, d, e, f])) == "".join(format_msg(item) for item in [a, d, e, f])
+    assert assembler.stats()["full_renders"] == 4
+
+    #an item merged into the middle, e.g. backfilled
+    merged = history[:5] + [make_item(100)] + history[5:]
+    assembler.render(1, history)
+    assert "".join(assembler.render(1, merged)) == "".join(format_msg(item) for item in merged)
+    assert assembler.stats()["full_renders"] == 6
+
+
+def test_line_is_rendered_again_when_content_changes() -> None:
+    assembler = PromptAssembler(format_msg, max_cached_lines=2)
+    item = make_item(1)
+    assert assembler.line(item) == format_msg(item)
+    truncated = attr.evolve(item, content="message [... cut ...]")
+    assert assembler.line(truncated) == format_msg(truncated)
+
+    assembler.line(make_item(2))
+    assembler.line(make_item(3))
+    assert assembler.stats()["cached_lines"] == 2
+    assert assembler.stats()["lines_rendered"] == 4
@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from pathlib import Path
+from typing import Any
+
+from IConfigManager import IConfigManager
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+from SQLiteHistoryManager import SQLiteHistoryManager
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+@pytest.fixture
+def fake_params(tmp_path: Path) -> dict[str, str]:
+    return {
+        "PERSIST_HISTORY": "true",
+        "HISTORY_BACKEND": "sqlite",
+        "HISTORY_SQLITE_PATH": str(tmp_path / "history.db"),
+        "HISTORY_DATA_DIR": str(tmp_path),
+        "HISTORY_LOAD_PAGE_SIZE": "3"
+    }
+
+
+def make_history_manager(logger: ILogger, fake_params: dict[str, str], max_history_len: int = 100) -> HistoryManager:
+    config_manager = MagicMock(spec=IConfigManager)
+    config_manager.get_parameter.side_effect = lambda param_name: fake_params.get(param_name, "")
+    count_tokens = AsyncMock(side_effect=lambda items: 10 * len(items))
+    format_msg = lambda h_item: f"{h_item.id}: {h_item.name} - {h_item.content}"
+    return HistoryManager.create(count_tokens, format_msg, max_history_len, logger, config_manager, "test-model")
+
+
+def make_item(i: int) -> HistoryItem:
+    return HistoryItem(timestamp_ms=1000 + i, content=f"message {i}", name="User", id=i, channel_id=1)
+
+
+def stored_rows(path: str) -> list[Any]:
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT id, token_count, token_model FROM history ORDER BY timestamp_ms").fetchall()
+
+
+def test_create_selects_sqlite_backend(logger: ILogger, fake_params: dict[str, str]) -> None:
+    assert isinstance(make_history_manager(logger, fake_params), SQLiteHistoryManager)
+    fake_params["HISTORY_BACKEND"] = "dynamodb"
+    assert type(make_history_manager(logger, fake_params)) is HistoryManager
+    fake_params["HISTORY_BACKEND"] = "redis"
+    with pytest.raises(ValueError):
+        make_history_manager(logger, fake_params)
+
+
+def test_history_persists_and_reloads_newest_within_budget(logger: ILogger, fake_params: dict[str, str]) -> None:
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params, max_history_len=1000)
+        for i in range(8):
+            await history_manager.add_history_item(1, make_item(i))
+        await history_manager.close()
+        assert [row[0] for row in stored_rows(fake_params["HISTORY_SQLITE_PATH"])] == list(range(8))
+        assert stored_rows(fake_params["HISTORY_SQLITE_PATH"])[0][1:] == (10, "test-model")
+
+        #a smaller budget on reload reads pages newest first, and stops once the budget is met
+        reopened = make_history_manager(logger, fake_params, max_history_len=50)
+        history = await reopened.get_history(1)
+        assert [item.id for item in history] == [3, 4, 5, 6, 7]
+        assert history[0] == HistoryItem(
+            timestamp_ms=1003, content="message 3", name="User", id=3, channel_id=1,
+            token_count=10, token_model="test-model")
+        assert reopened.get_stats()["sqlite_reads"] == 2
+        assert len(await reopened.get_history(2)) == 0
+        await reopened.close()
+
+    asyncio.run(run_test())
+
+
+def test_trimmed_items_are_deleted(logger: ILogger, fake_params: dict[str, str]) -> None:
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params, max_history_len=30)
+        for i in range(5):
+            await history_manager.add_history_item(1, make_item(i))
+        assert [item.id for item in await history_manager.get_history(1)] == [2, 3, 4]
+        await history_manager.close()
+        assert [row[0] for row in stored_rows(fake_params["HISTORY_SQLITE_PATH"])] == [2, 3, 4]
+
+    asyncio.run(run_test())
+
+
+def test_write_behind_batches_and_expired_items_are_purged(logger: ILogger, fake_params: dict[str, str]) -> None:
+    fake_params.update({"HISTORY_WRITE_BEHIND": "true", "HISTORY_WRITE_BATCH_SIZE": "4", "HISTORY_TTL_SECONDS": "60"})
+
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params)
+        for i in range(8):
+            await history_manager.add_history_item(1, make_item(i))
+        await history_manager.close()
+        stats = history_manager.get_stats()
+        assert stats["sqlite_rows_written"] == 8
+        assert stats["sqlite_writes"] == 2
+
+        with sqlite3.connect(fake_params["HISTORY_SQLITE_PATH"]) as connection:
+            connection.execute("UPDATE history SET expires_at = 1 WHERE id < 6")
+        reopened = make_history_manager(logger, fake_params)
+        assert [item.id for item in await reopened.get_history(1)] == [6, 7]
+        await reopened.close()
+        assert len(stored_rows(fake_params["HISTORY_SQLITE_PATH"])) == 2
+
+    asyncio.run(run_test())
@@ -0,0 +1,38 @@
+from SeenMessageIndex import SeenMessageIndex
+
+
+def test_check_and_record_detects_duplicate() -> None:
+    index = SeenMessageIndex(window=10)
+    assert index.check_and_record(1, 1001) is False
+    assert index.check_and_record(1, 1001) is True
+    assert index.duplicates_suppressed == 1
+
+
+def test_channels_are_independent() -> None:
+    index = SeenMessageIndex(window=10)
+    index.check_and_record(1, 1001)
+    assert index.contains(1, 1001)
+    assert not index.contains(2, 1001)
+    assert index.check_and_record(2, 1001) is False
+
+
+def test_window_forgets_oldest() -> None:
+    index = SeenMessageIndex(window=2)
+    index.check_and_record(1, 1)
+    index.check_and_record(1, 2)
+    index.check_and_record(1, 3)
+    assert not index.contains(1, 1)
+    assert index.contains(1, 2)
+    assert index.contains(1, 3)
+    assert index.check_and_record(1, 1) is False
+
+
+def test_forget_lets_an_id_be_recorded_again() -> None:
+    index = SeenMessageIndex(window=2)
+    index.check_and_record(1, 1)
+    index.check_and_record(1, 2)
+    index.forget(1, 1)
+    index.forget(1, 99)
+    assert not index.contains(1, 1)
+    assert index.check_and_record(1, 1) is False
+    assert index.contains(1, 2)
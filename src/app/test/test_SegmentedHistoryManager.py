@@ -0,0 +1,227 @@
+import asyncio
+import zlib
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from decimal import Decimal
+from typing import Any, Optional
+
+from boto3.dynamodb.conditions import ConditionBase
+
+from IConfigManager import IConfigManager
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+from SegmentedHistoryManager import SegmentedHistoryManager
+
+
+class FakeTable:
+    """In-memory stand-in for a dynamodb table, supporting the queries and writes the history managers make"""
+
+    def __init__(self, range_key: str) -> None:
+        self.range_key = range_key
+        self.items: dict[tuple[Any, Any], dict[str, Any]] = {}
+        self.queries = 0
+        self.puts = 0
+
+    @staticmethod
+    def matches(condition: ConditionBase, item: dict[str, Any]) -> bool:
+        expression = condition.get_expression()
+        operator, values = expression["operator"], expression["values"]
+        if operator == "AND":
+            return all(FakeTable.matches(value, item) for value in values)
+        if operator == "OR":
+            return any(FakeTable.matches(value, item) for value in values)
+        if operator == "attribute_not_exists":
+            return values[0].name not in item
+        value = item.get(values[0].name)
+        return value is not None and {"=": value == values[1], "<": value < values[1],
+                                      ">": value > values[1]}[operator]
+
+    async def query(self, KeyConditionExpression: ConditionBase, ScanIndexForward: bool = True,
+                    Limit: Optional[int] = None, ExclusiveStartKey: Optional[dict[str, Any]] = None,
+                    FilterExpression: Optional[ConditionBase] = None, **kwargs: Any) -> dict[str, Any]:
+        self.queries += 1
+        matching = sorted((item for item in self.items.values() if self.matches(KeyConditionExpression, item)),
+                          key=lambda item: item[self.range_key], reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            start = [item[self.range_key] for item in matching].index(ExclusiveStartKey[self.range_key]) + 1
+            matching = matching[start:]
+        page = matching[:Limit] if Limit else matching
+        response: dict[str, Any] = {"Items": [item for item in page
+                                              if FilterExpression is None or self.matches(FilterExpression, item)]}
+        if len(matching) > len(page):
+            response["LastEvaluatedKey"] = {"channel_id": page[-1]["channel_id"],
+                                            self.range_key: page[-1][self.range_key]}
+        return response
+
+    async def scan(self, Segment: int, TotalSegments: int, Limit: Optional[int] = None,
+                   ExclusiveStartKey: Optional[dict[str, Any]] = None, **kwargs: Any) -> dict[str, Any]:
+        #like dynamodb, segments split channels by partition key, and a channel's items come in sort key order
+        matching = [item for key, item in sorted(self.items.items()) if key[0] % TotalSegments == Segment]
+        if ExclusiveStartKey:
+            keys = [(item["channel_id"], item[self.range_key]) for item in matching]
+            matching = matching[keys.index((ExclusiveStartKey["channel_id"], ExclusiveStartKey[self.range_key])) + 1:]
+        page = matching[:Limit] if Limit else matching
+        response: dict[str, Any] = {"Items": page}
+        if len(matching) > len(page):
+            response["LastEvaluatedKey"] = {"channel_id": page[-1]["channel_id"],
+                                            self.range_key: page[-1][self.range_key]}
+        return response
+
+    async def put_item(self, Item: dict[str, Any], **kwargs: Any) -> None:
+        self.puts += 1
+        self.items[(Item["channel_id"], Item[self.range_key])] = Item
+
+    async def delete_item(self, Key: dict[str, Any]) -> None:
+        self.items.pop((Key["channel_id"], Key[self.range_key]), None)
+
+    def batch_writer(self, **kwargs: Any) -> MagicMock:
+        batch = MagicMock()
+        batch.__aenter__.return_value = self
+        return batch
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+@pytest.fixture
+def fake_params() -> dict[str, str]:
+    return {
+        "PERSIST_HISTORY": "true",
+        "HISTORY_BACKEND": "dynamodb-segments",
+        "HISTORY_WRITE_BATCH_SIZE": "5",
+        "HISTORY_SEGMENT_BYTES": "130",
+        "HISTORY_LOAD_PAGE_SIZE": "4"
+    }
+
+
+@pytest.fixture
+def tables() -> dict[str, FakeTable]:
+    return {SegmentedHistoryManager.TABLE_NAME: FakeTable("segment"),
+            SegmentedHistoryManager.ITEM_TABLE_NAME: FakeTable("timestamp")}
+
+
+def make_history_manager(logger: ILogger, fake_params: dict[str, str], tables: dict[str, FakeTable],
+                         max_history_len: int = 1000) -> HistoryManager:
+    config_manager = MagicMock(spec=IConfigManager)
+    config_manager.get_parameter.side_effect = lambda param_name: fake_params.get(param_name, "")
+    history_manager = HistoryManager.create(AsyncMock(side_effect=lambda items: 10 * len(items)), str,
+                                            max_history_len, logger, config_manager, "test-model")
+    dynamodb = MagicMock()
+    dynamodb.Table = AsyncMock(side_effect=lambda name: tables[name])
+    history_manager._session = MagicMock()
+    history_manager._session.resource.return_value.__aenter__.return_value = dynamodb
+    return history_manager
+
+
+def make_item(i: int) -> HistoryItem:
+    return HistoryItem(timestamp_ms=1000 + i, content=f"message {i}", name="User", id=i, channel_id=1)
+
+
+def stored_ids(table: FakeTable) -> list[list[int]]:
+    return [[item.id for item in SegmentedHistoryManager._segment_from_dynamo(record)]
+            for _, record in sorted(table.items.items())]
+
+
+def test_create_selects_segment_backend_with_write_behind(logger: ILogger, fake_params: dict[str, str],
+                                                         tables: dict[str, FakeTable]) -> None:
+    history_manager = make_history_manager(logger, fake_params, tables)
+    assert isinstance(history_manager, SegmentedHistoryManager)
+    assert history_manager._write_buffer is not None
+
+
+def test_messages_pack_into_segments_and_reload(logger: ILogger, fake_params: dict[str, str],
+                                                tables: dict[str, FakeTable]) -> None:
+    segments = tables[SegmentedHistoryManager.TABLE_NAME]
+
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params, tables)
+        for i in range(10):
+            await history_manager.add_history_item(1, make_item(i))
+        await history_manager.close()
+        #two messages fit each segment, and each flush of five rewrites the tail once and seals the rest
+        assert stored_ids(segments) == [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
+        assert segments.puts < 10
+        record = segments.items[(1, 1000)]
+        assert zlib.decompress(record["data"]) and record["item_count"] == 2 and record["last_ms"] == 1001
+
+        #a restarted manager reads only the segments it needs, newest first, then appends to the stored tail
+        reopened = make_history_manager(logger, fake_params, tables, max_history_len=50)
+        segments.queries = 0
+        assert [item.id for item in await reopened.get_history(1)] == [5, 6, 7, 8, 9]
+        assert segments.queries == 1
+        await reopened.add_history_item(1, make_item(10))
+        await reopened.close()
+        assert stored_ids(segments)[-1] == [10]
+        assert reopened.get_stats()["segment_writes"] == 1
+
+    asyncio.run(run_test())
+
+
+def test_segments_out_of_context_are_deleted_when_the_tail_is_sealed(logger: ILogger, fake_params: dict[str, str],
+                                                                      tables: dict[str, FakeTable]) -> None:
+    segments = tables[SegmentedHistoryManager.TABLE_NAME]
+
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params, tables, max_history_len=30)
+        for i in range(12):
+            await history_manager.add_history_item(1, make_item(i))
+            assert history_manager._write_buffer
+            await history_manager._write_buffer.flush()
+        #trimmed messages stay stored until their whole segment has left context
+        assert [item.id for item in await history_manager.get_history(1)] == [9, 10, 11]
+        assert stored_ids(segments) == [[8, 9], [10, 11]]
+        assert history_manager.get_stats()["segments_deleted"] == 4
+        await history_manager.close()
+
+    asyncio.run(run_test())
+
+
+def test_migrate_item_layout(logger: ILogger, fake_params: dict[str, str], tables: dict[str, FakeTable]) -> None:
+    item_table = tables[SegmentedHistoryManager.ITEM_TABLE_NAME]
+    for i in range(7):
+        item_table.items[(1, i)] = {"timestamp": Decimal(1 + i / 1000), "content": f"message {i}", "name": "User",
+                                    "id": Decimal(i), "channel_id": Decimal(1), "token_count": Decimal(10),
+                                    "token_model": "test-model"}
+
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params, tables)
+        assert isinstance(history_manager, SegmentedHistoryManager)
+        migrated = await history_manager.migrate_item_layout([1])
+        assert (migrated["channels"], migrated["items"], migrated["segments"]) == (1, 7, 4)
+        assert stored_ids(tables[SegmentedHistoryManager.TABLE_NAME]) == [[0, 1], [2, 3], [4, 5], [6]]
+
+        #the migrated tail is appended to by the next message
+        await history_manager.add_history_item(1, make_item(7))
+        await history_manager.close()
+        assert stored_ids(tables[SegmentedHistoryManager.TABLE_NAME])[-1] == [6, 7]
+        history = await make_history_manager(logger, fake_params, tables).get_history(1)
+        assert [(item.id, item.token_count) for item in history][:2] == [(0, 10), (1, 10)]
+
+    asyncio.run(run_test())
+
+
+def test_scan_persisted_history_streams_every_segment(logger: ILogger, fake_params: dict[str, str],
+                                                      tables: dict[str, FakeTable]) -> None:
+
+    async def run_test() -> None:
+        history_manager = make_history_manager(logger, fake_params, tables)
+        items = [make_item(i) for i in range(10)] + [HistoryItem(timestamp_ms=2000 + i, content=f"message {i}",
+                                                                 name="User", id=100 + i, channel_id=2)
+                                                     for i in range(5)]
+        await history_manager.import_history_items(items)
+        assert history_manager._write_buffer and not history_manager._write_buffer.pending(1)
+
+        scanned: list[HistoryItem] = []
+        pages = 0
+        for segment in range(2):
+            async for page, _ in history_manager.scan_persisted_history(segment, 2):
+                scanned.extend(page)
+                pages += 1
+        assert sorted(scanned, key=lambda item: item.channel_id) == items
+        assert pages > 2
+        await history_manager.close()
+
+    asyncio.run(run_test())
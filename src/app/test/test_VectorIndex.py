@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from HistoryArchive import ArchiveRef
+from retrieval.VectorIndex import VectorIndex
+
+
+def make_refs(count: int) -> list[ArchiveRef]:
+    return [(i // 100, 40 * (i % 100)) for i in range(count)]
+
+
+def random_vectors(count: int, dimension: int, seed: int = 1) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_brute_force_search_finds_exact_match() -> None:
+    index = VectorIndex(dimension=16)
+    vectors = random_vectors(100, 16)
+    index.add(vectors, make_refs(100))
+
+    results = index.search(vectors[42], limit=3)
+    assert len(results) == 3
+    assert results[0][1] == make_refs(100)[42]
+    assert results[0][0] > results[1][0] >= results[2][0]
+
+
+def test_ivf_search_after_training() -> None:
+    index = VectorIndex(dimension=16, n_probe=4)
+    index.IVF_MIN_VECTORS = 1000
+    vectors = random_vectors(2000, 16)
+    index.add(vectors[:1500], make_refs(2000)[:1500])
+    index.add(vectors[1500:], make_refs(2000)[1500:])
+
+    assert index._centroids is not None
+    for position in (7, 1499, 1999):
+        assert index.search(vectors[position], limit=1)[0][1] == make_refs(2000)[position]
+
+
+def test_save_and_load(tmp_path: Path) -> None:
+    index = VectorIndex(dimension=16)
+    index.IVF_MIN_VECTORS = 100
+    vectors = random_vectors(300, 16)
+    index.add(vectors, make_refs(300))
+    index.save(str(tmp_path))
+
+    loaded = VectorIndex.load(str(tmp_path), dimension=16)
+    assert len(loaded) == 300
+    assert loaded._centroids is not None
+    assert loaded.search(vectors[123], limit=1)[0][1] == make_refs(300)[123]
+    assert len(VectorIndex.load(str(tmp_path), dimension=32)) == 0
+
+
+def test_failed_save_keeps_previous_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    index = VectorIndex(dimension=16)
+    vectors = random_vectors(20, 16)
+    index.add(vectors[:10], make_refs(20)[:10])
+    index.save(str(tmp_path))
+    index.add(vectors[10:], make_refs(20)[10:])
+
+    real_save = np.save
+    def failing_save(path: str, array: np.ndarray) -> None:
+        if path.endswith("refs.npy"):
+            raise OSError("disk full")
+        real_save(path, array)
+    monkeypatch.setattr(np, "save", failing_save)
+    with pytest.raises(OSError):
+        index.save(str(tmp_path))
+    assert len(VectorIndex.load(str(tmp_path), dimension=16)) == 10
+
+    monkeypatch.setattr(np, "save", real_save)
+    index.save(str(tmp_path))
+    assert len(VectorIndex.load(str(tmp_path), dimension=16)) == 20
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("gen-")]) == 1
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from pathlib import Path
+
+import numpy as np
+
+from ILogger import ILogger
+from IHistoryManager import HistoryItem
+from HistoryArchive import HistoryArchive
+from retrieval.HashingEmbedder import HashingEmbedder
+from retrieval.VectorRetriever import VectorRetriever
+
+
+@pytest.fixture
+def logger() -> ILogger:
+    return MagicMock(spec=ILogger)
+
+
+def make_item(i: int, content: str) -> HistoryItem:
+    return HistoryItem(timestamp_ms=i, content=content, name="User", id=i, channel_id=1, token_count=5)
+
+
+def test_hashing_embedder_is_deterministic_and_normalized() -> None:
+    async def run_test() -> None:
+        vectors = await HashingEmbedder(64).embed(["the quick brown fox", "the quick brown fox", ""])
+        assert vectors.shape == (3, 64)
+        assert np.allclose(vectors[0], vectors[1])
+        assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+        assert not vectors[2].any()
+
+    asyncio.run(run_test())
+
+
+def test_search_finds_related_item_and_persists(logger: ILogger, tmp_path: Path) -> None:
+    items = [
+        make_item(1, "anyone want to grab pizza tonight?"),
+        make_item(2, "the deploy pipeline is broken again"),
+        make_item(3, "my cat knocked the plant off the shelf")
+    ]
+
+    async def run_test() -> None:
+        archive = HistoryArchive(str(tmp_path / "archive"), max_segment_bytes=1024)
+        retriever = VectorRetriever(HashingEmbedder(256), archive, str(tmp_path / "vectors"), logger, batch_size=2)
+        await retriever.add_items(items, archive.append(items))
+        await retriever.close()
+        assert retriever.stats()["items_embedded"] == 3
+
+        reopened = VectorRetriever(HashingEmbedder(256), HistoryArchive(str(tmp_path / "archive"), 1024),
+                                   str(tmp_path / "vectors"), logger, batch_size=2)
+        results = await reopened.search(1, "is the pipeline still broken?", limit=1)
+        assert results == [items[1]]
+        assert await reopened.search(2, "pizza", limit=1) == []
+
+    asyncio.run(run_test())
+
+
+def test_failed_batch_is_retried_then_dropped(logger: ILogger, tmp_path: Path) -> None:
+    items = [make_item(1, "first message"), make_item(2, "second message")]
+    embedder = HashingEmbedder(64)
+    working_embed = embedder.embed
+
+    async def run_test() -> None:
+        archive = HistoryArchive(str(tmp_path / "archive"), max_segment_bytes=1024)
+        retriever = VectorRetriever(embedder, archive, str(tmp_path / "vectors"), logger, batch_size=2)
+        embedder.embed = AsyncMock(side_effect=RuntimeError("embedding api unavailable")) #type: ignore
+        await retriever.add_items(items, archive.append(items))
+        await retriever._embed_pending(1)
+        #a transient failure keeps the batch queued, and it's embedded once the embedder recovers
+        assert retriever.stats()["pending"] == 2
+        embedder.embed = working_embed #type: ignore
+        await retriever._embed_pending(1)
+        assert retriever.stats()["items_embedded"] == 2
+
+        #items that keep failing are dropped after MAX_EMBED_ATTEMPTS
+        embedder.embed = AsyncMock(side_effect=RuntimeError("embedding api unavailable")) #type: ignore
+        await retriever.add_items([make_item(3, "third message")], archive.append([make_item(3, "third message")]))
+        for _ in range(VectorRetriever.MAX_EMBED_ATTEMPTS):
+            await retriever._embed_pending(1)
+        assert retriever.stats()["pending"] == 0
+        assert retriever.stats()["items_lost"] == 1
+
+    asyncio.run(run_test())
@@ -5,7 +5,6 @@ import asyncio
 from typing import Any 
 from collections import deque
 from datetime import datetime
-from decimal import Decimal
 
 from discord import Message, User
 
@@ -14,12 +13,13 @@ from ILogger import ILogger
 from ai.vllm.VllmAIModelProvider import VllmAIModelProvider
 from ai.vllm.VLLMClient import VLLMClient
 from HistoryManager import HistoryManager
+from IHistoryManager import HistoryItem, HistoryView
 
 
 @pytest.fixture
-def config_manager_vllm() -> IConfigManager:
+def config_manager_vllm(history_params: dict[str, str]) -> IConfigManager:
     config_manager_vllm = MagicMock(spec=IConfigManager)
-    fake_params = {
+    fake_params = history_params | {
         "BOT_USERNAME": "BotUsername",
         "VLLM_MAX_CONTEXT_LEN": "4096",
         "VLLM_RESPONSE_MODEL": "fake_vllm_response_model",
@@ -27,7 +27,7 @@ def config_manager_vllm() -> IConfigManager:
         "VLLM_AI_PROVIDER_PORT": "8888",
         "VLLM_API_KEY": "fake_vllm_api_key",
         "STOP_SEQUENCES": '["<messageID="]',
-        "PERSIST_HISTORY": "true"
+        "VLLM_PROMPT_LAYOUT": "classic"
     }
     config_manager_vllm.get_parameter.side_effect = lambda param_name: fake_params[param_name]
 
@@ -127,7 +127,7 @@ def test_history_append_user_vllm(
         assert new_item.name == msg.author.display_name
         assert new_item.id == msg.id
         assert new_item.channel_id == msg.channel.id
-        assert new_item.timestamp == Decimal(msg.created_at.timestamp())
+        assert new_item.timestamp_ms == round(msg.created_at.timestamp() * 1000)
      
     asyncio.run(run_test())
 
@@ -161,7 +161,75 @@ def test_history_append_bot_vllm(
         assert new_item.name == vllm_ai_model_provider.BOT_USERNAME
         assert new_item.id == msg.id
         assert new_item.channel_id == msg.channel.id
-        assert new_item.timestamp == Decimal(msg.created_at.timestamp())
+        assert new_item.timestamp_ms == round(msg.created_at.timestamp() * 1000)
 
     asyncio.run(verify_new_item())
 
+
+def test_prefix_cache_layout_vllm(
+        config_manager_vllm: MagicMock,
+        logger: ILogger,
+        mock_vllmclient: None
+        ) -> None:
+    params = config_manager_vllm.get_parameter.side_effect
+    config_manager_vllm.get_parameter.side_effect = (
+        lambda param_name: "prefix_cache" if param_name == "VLLM_PROMPT_LAYOUT" else params(param_name))
+    vllm_ai_model_provider = VllmAIModelProvider(config_manager_vllm, logger)
+    history = [HistoryItem(timestamp_ms=i, content=f"message {i}", name="Username", id=i, channel_id=1,
+                           token_count=10) for i in range(1, 9)]
+
+    async def run_test() -> None:
+        await vllm_ai_model_provider._init_async()
+        history_manager = MagicMock(spec=HistoryManager)
+        history_manager.get_context = AsyncMock(side_effect=lambda channel_id, reply_id: HistoryView(list(history)))
+        history_manager.get_summary = AsyncMock(return_value="")
+        history_manager.retrieve = AsyncMock(return_value=[])
+        vllm_ai_model_provider.history_manager = history_manager
+
+        first = await vllm_ai_model_provider._build_prompt(1, 8)
+        history.append(HistoryItem(timestamp_ms=9, content="message 9", name="Username", id=9, channel_id=1,
+                                   token_count=10))
+        second = await vllm_ai_model_provider._build_prompt(1, 9)
+        #everything up to the reply instruction is the start of the next prompt
+        prefix = first[:first.rindex(vllm_ai_model_provider.REPLY_HEADER)]
+        assert "<messageID=8>" in prefix
+        assert second.startswith(prefix)
+        assert f"{vllm_ai_model_provider.REPLY_INSTRUCTION} 9" in second[len(prefix):]
+
+        #once the first item is trimmed, the history starts a quarter of its tokens on, and stays there
+        history.pop(0)
+        history.append(HistoryItem(timestamp_ms=10, content="message 10", name="Username", id=10, channel_id=1,
+                                   token_count=10))
+        third = await vllm_ai_model_provider._build_prompt(1, 10)
+        assert "<messageID=4>" not in third
+        assert "<messageID=5>" in third
+        history.pop(0)
+        fourth = await vllm_ai_model_provider._build_prompt(1, 10)
+        assert fourth == third
+
+        #a selection isn't anchored, so it's put in the prompt as given
+        history_manager.get_context = AsyncMock(return_value=[history[0], history[-1]])
+        selected = await vllm_ai_model_provider._build_prompt(1, 10)
+        assert "<messageID=3>" in selected
+        assert "<messageID=5>" not in selected
+
+    asyncio.run(run_test())
+
+
+
+def test_summarize_keeps_summary_on_empty_completion_vllm(
+        vllm_ai_model_provider: VllmAIModelProvider, monkeypatch: MonkeyPatch
+        ) -> None:
+    messages = [HistoryItem(timestamp_ms=1, content="see you at 8", name="User", id=1, channel_id=1)]
+
+    async def run_test() -> None:
+        generate_completion = AsyncMock(return_value={"text": ["User is meeting at 8."]})
+        monkeypatch.setattr(vllm_ai_model_provider.vllm, "generate_completion", generate_completion)
+        assert await vllm_ai_model_provider._summarize("", messages, 50) == "User is meeting at 8."
+        prompt = generate_completion.call_args.args[0]
+        assert prompt.startswith(vllm_ai_model_provider.SUMMARY_INSTRUCTION)
+        assert "User: see you at 8\n" in prompt
+
+        generate_completion.return_value = {"text": ["  "]}
+        assert await vllm_ai_model_provider._summarize("User is meeting at 8.", messages, 50) == "User is meeting at 8."
+    asyncio.run(run_test())
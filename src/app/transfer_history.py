@@ -0,0 +1,109 @@
+"""Export, import and migrate persisted history between stores, e.g. to move history to another backend,
+rebuild a store from scratch, or seed a load test with real history.
+
+A store is a HISTORY_BACKEND (dynamodb, dynamodb-segments, or sqlite, optionally sqlite:PATH),
+or an export directory, dir:PATH. Run from src/app with the bot stopped:
+    python transfer_history.py dynamodb dir:exports/history --segments 16
+    python transfer_history.py dir:exports/history sqlite:data/rebuilt.db
+    python transfer_history.py dynamodb dynamodb-segments --segments 16
+Rerun an interrupted transfer with the same arguments to resume it from its checkpoint.
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+from typing import Union
+
+from ConfigManager import ConfigManager
+from IConfigManager import IConfigManager
+from IHistoryManager import HistoryItem
+from HistoryManager import HistoryManager
+from HistoryTransfer import HistoryExportDirectory, HistoryTransfer
+from Logger import Logger
+
+
+class TransferConfigManager(IConfigManager):
+    """The bot's config, with history settings overridden for one store of a transfer"""
+
+    def __init__(self, config_manager: IConfigManager, overrides: dict[str, str]) -> None:
+        self.config_manager = config_manager
+        self.overrides = overrides
+
+
+    def get_parameter(self, key: str) -> str:
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.config_manager.get_parameter(key)
+
+
+async def count_tokens(items: list[HistoryItem]) -> int:
+    """Transfers copy the stored token counts rather than counting, so this is never called"""
+    raise RuntimeError("transfer_history doesn't count tokens")
+
+
+def open_store(store: str, config_manager: IConfigManager, logger: Logger, page_size: int
+               ) -> Union[HistoryManager, HistoryExportDirectory]:
+    if store.startswith("dir:"):
+        return HistoryExportDirectory(store[len("dir:"):], page_size)
+    backend, _, path = store.partition(":")
+    overrides = {
+        "HISTORY_BACKEND": backend,
+        "PERSIST_HISTORY": "true",
+        "HISTORY_LOAD_PAGE_SIZE": str(page_size),
+        #only persistence is used, so nothing else should be set up
+        "HISTORY_WRITE_BEHIND": "false",
+        "HISTORY_ARCHIVE": "false",
+        "HISTORY_VECTOR_RETRIEVAL": "false",
+        "HISTORY_KEYWORD_RETRIEVAL": "false",
+        "HISTORY_SUMMARIZE": "false",
+        "HISTORY_SNAPSHOT": "false"
+    }
+    if path:
+        overrides["HISTORY_SQLITE_PATH"] = path
+    return HistoryManager.create(count_tokens, str, 0, logger, TransferConfigManager(config_manager, overrides))
+
+
+async def transfer(source: str, target: str, segments: int, checkpoint: str, page_size: int,
+                   report_seconds: float) -> None:
+    logger = Logger()
+    config_manager = ConfigManager(logger)
+    source_store = open_store(source, config_manager, logger, page_size)
+    target_store = open_store(target, config_manager, logger, page_size)
+    if isinstance(source_store, HistoryExportDirectory):
+        segments = source_store.total_segments
+        if not segments:
+            sys.exit(f"{source_store.path} has no exported history")
+    if not checkpoint:
+        checkpoint = os.path.join("data", "transfers", re.sub(r"[^\w.-]+", "_", f"{source}-to-{target}") + ".json")
+
+    history_transfer = HistoryTransfer(source_store, target_store, f"{source} -> {target}", segments, checkpoint,
+                                       logger, report_seconds)
+    try:
+        stats = await history_transfer.run()
+    finally:
+        for store in (source_store, target_store):
+            if isinstance(store, HistoryManager):
+                await store.close()
+    print(f"transferred {int(stats['items'])} items in {stats['seconds']:.1f}s, "
+          f"{stats['items_per_second']:.0f} items/s, {stats['content_mb_per_second']:.1f} MB/s of content, "
+          f"{int(stats['total_items'])} items in total. checkpoint: {checkpoint}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="store to read from")
+    parser.add_argument("target", help="store to write to")
+    parser.add_argument("--segments", type=int, default=8,
+                        help="parallel scan segments, and workers. an export directory source uses its own")
+    parser.add_argument("--checkpoint", default="",
+                        help="checkpoint file, named after the source and target by default")
+    parser.add_argument("--page-size", type=int, default=500, help="items read per page")
+    parser.add_argument("--report-seconds", type=float, default=10.0, help="seconds between throughput reports")
+    args = parser.parse_args()
+    asyncio.run(transfer(args.source, args.target, args.segments, args.checkpoint, args.page_size,
+                         args.report_seconds))
+
+
+if __name__ == "__main__":
+    main()
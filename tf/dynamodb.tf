@@ -14,8 +14,41 @@ resource "aws_dynamodb_table" "chat_history" {
     type = "N"
   }
 
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    Terraform = "true"
+    Application = "pepeleli"
+  }
+}
+
+# used with HISTORY_BACKEND=dynamodb-segments, many messages packed into each item
+resource "aws_dynamodb_table" "chat_history_segments" {
+  name           = "pepeleli-chat-history-segments"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "channel_id"
+  range_key      = "segment"
+
+  attribute {
+    name = "channel_id"
+    type = "N"
+  }
+
+  attribute {
+    name = "segment"
+    type = "N"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
   tags = {
     Terraform = "true"
     Application = "pepeleli"
   }
-}
\ No newline at end of file
+}